@@ -1,14 +1,29 @@
-from vedo import load, Plotter
 from os import listdir, path
-import numpy as np
+import importlib.util
+import sys
 import time
-import trimesh
-import vtk
+
+# vedo, trimesh and vtk are only imported by the functions that use them : "import objtools" stays fast
+
+# The mesh metrics and the mesh store are shared with the main code (nii_mesh_generation/source)
+SOURCE_DIR = path.join(path.dirname(path.abspath(__file__)), "..", "nii_mesh_generation", "source")
+
+def _load_source(name):
+    # Loaded from its location under a name of its own : another "source" module on sys.path can't take its place
+    spec = importlib.util.spec_from_file_location(f"nii_mesh_generation_{name}", path.join(SOURCE_DIR, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+_mesh_metrics = _load_source("mesh_metrics")
+mesh_metrics, signed_volume, surface_area = _mesh_metrics.mesh_metrics, _mesh_metrics.signed_volume, _mesh_metrics.surface_area
+load_mesh = _load_source("mesh_store").load_mesh
 
 # ----------------------------------
-# Afficher un .obj
+# Show a .obj
                 
-def showObj(mesh_path, pitch=-30, yaw=30, roll =0, z=1, save_image = False, show_3d = True, output_folder_path="."):
+def showObj(mesh_path, pitch=-30, yaw=30, roll =0, z=1, save_image = False, show_3d = True, output_folder_path=".", store_dir=None):
     """shows a 3d parametrable view of the object. has an option to save the view into a flat image file
     Args:
         mesh_path (_type_): path to the mesh
@@ -18,10 +33,12 @@ def showObj(mesh_path, pitch=-30, yaw=30, roll =0, z=1, save_image = False, show
         z (int, optional): zoom level. Defaults to 1.
         save_image (bool, optional): save the image as a jpg. Defaults to False.
         show_3d (bool, optional): if false, the plot is not showed 
+        store_dir (string, optional): folder of the mesh store (see read_arrays). Defaults to ".mesh_store" next to the mesh.
     """
+    from vedo import Plotter
     print("_____________________")
     print(mesh_path)
-    mesh = load(mesh_path).color('gray')
+    mesh = stored_mesh(mesh_path, store_dir).color('gray')
     if save_image: 
         plt = Plotter(bg='white', offscreen=True) # the plot will not be showed
         plt += mesh
@@ -41,21 +58,21 @@ def showObj(mesh_path, pitch=-30, yaw=30, roll =0, z=1, save_image = False, show
         plt2.show(zoom=z, interactive=True)
         plt2.close()
         
-def showFolder(folder_path, pitch=-30, yaw=30, roll =0,  z=1, save_image=False, show_details=False, show_3d=True, name="", output_folder_path="."):
+def showFolder(folder_path, pitch=-30, yaw=30, roll =0,  z=1, save_image=False, show_details=False, show_3d=True, name="", output_folder_path=".", store_dir=None):
     print("\n ----- 3D FILES ----- \n")
     data = {'File Name': [], 'File Size (B)': [], 'File Size (MB)': [], 'Mesh Volume': []}
     for file in listdir(folder_path):
         if file.endswith(".obj") or file.endswith(".stl"):
-            # Montrer l'objet
-            showObj(path.join(folder_path, file), pitch, yaw, roll, z, save_image, show_3d, output_folder_path)
-            # Donner la taille de l'objet
-            if show_size:
+            # Show the object
+            showObj(path.join(folder_path, file), pitch, yaw, roll, z, save_image, show_3d, output_folder_path, store_dir)
+            # Size of the object
+            if show_details:
                 file_size = path.getsize(path.join(folder_path, file))
                 # Save data in the dictionary
                 data['File Name'].append(file)
                 data['File Size (B)'].append(file_size)
                 data['File Size (MB)'].append(file_size / (1024 * 1024))
-                data['Mesh Volume'].append(vol_obj(path.join(folder_path, file)))
+                data['Mesh Volume'].append(vol_obj(path.join(folder_path, file), store_dir))
     if show_details:
         import pandas as pd
         import openpyxl
@@ -67,7 +84,7 @@ def showFolder(folder_path, pitch=-30, yaw=30, roll =0,  z=1, save_image=False,
         print(f"File sizes saved to {excel_file_path}")
         
 
-def showObjCam(mesh_path, cam, z=1, save_image=False, show_3d=True, output_folder_path="."):
+def showObjCam(mesh_path, cam, z=1, save_image=False, show_3d=True, output_folder_path=".", store_dir=None):
     """shows a 3d parametrable view of the object. has an option to save the view into a flat image file
     Args:
         mesh_path (_type_): path to the mesh
@@ -75,11 +92,13 @@ def showObjCam(mesh_path, cam, z=1, save_image=False, show_3d=True, output_folde
         z (int, optional): zoom level. Defaults to 1.
         save_image (bool, optional): save the image as a jpg. Defaults to False.
         show_3d (bool, optional): if false, the plot is not showed 
+        store_dir (string, optional): folder of the mesh store (see read_arrays). Defaults to ".mesh_store" next to the mesh.
     """
+    from vedo import Plotter
     print("_____________________")
     print(mesh_path)
     try:
-        mesh = load(mesh_path).color('gray')
+        mesh = stored_mesh(mesh_path, store_dir).color('gray')
     except FileNotFoundError:
         print("File not found")
         return 0
@@ -107,7 +126,7 @@ def showObjCam(mesh_path, cam, z=1, save_image=False, show_3d=True, output_folde
         plt2.show(zoom=z, interactive=True)
         plt2.close()
 
-def showFolderCam(folder_path, cam, z=1, save_image=False, show_details=False, show_3d=True, name="", output_folder_path="."):
+def showFolderCam(folder_path, cam, z=1, save_image=False, show_details=False, show_3d=True, name="", output_folder_path=".", store_dir=None):
     """show all the 3d meshes in the folder
     Args:
         folder_path (string): path to the folder containing the meshes
@@ -118,16 +137,16 @@ def showFolderCam(folder_path, cam, z=1, save_image=False, show_details=False, s
     data = {'File Name': [], 'File Size (B)': [], 'File Size (MB)': [], 'Mesh Volume': []}
     for file in listdir(folder_path):
         if file.endswith(".obj") or file.endswith(".stl"):
-            # Montrer l'objet
-            showObjCam(path.join(folder_path, file), cam, z, save_image, show_3d, output_folder_path)
-            # Donner la taille de l'objet
-            if show_size:
+            # Show the object
+            showObjCam(path.join(folder_path, file), cam, z, save_image, show_3d, output_folder_path, store_dir)
+            # Size of the object
+            if show_details:
                 file_size = path.getsize(path.join(folder_path, file))
                 # Save data in the dictionary
                 data['File Name'].append(file)
                 data['File Size (B)'].append(file_size)
                 data['File Size (MB)'].append(file_size / (1024 * 1024))
-                data['Mesh Volume'].append(vol_obj(path.join(folder_path, file)))
+                data['Mesh Volume'].append(vol_obj(path.join(folder_path, file), store_dir))
                 
     if show_details:
         import pandas as pd
@@ -140,7 +159,7 @@ def showFolderCam(folder_path, cam, z=1, save_image=False, show_details=False, s
         print(f"File sizes saved to {excel_file_path}")
 
 # ----------------------------------
-# Volume d'un mesh
+# Volume of a mesh
 
 def convex_hull_volume(file_path):
     import pymeshlab
@@ -152,34 +171,34 @@ def convex_hull_volume(file_path):
     hull = ConvexHull(vertices)
     return hull.volume 
 
+# Every library only gives its (vertices, faces) arrays : the volume is computed the same way for all of them
+
 def trimesh_volume(mesh):
-    vol = abs(round(mesh.volume, 2))
-    return vol
+    return abs(round(signed_volume(mesh.vertices, mesh.faces), 2))
+
+def pymeshlab_arrays(meshset):
+    mesh = meshset.current_mesh()
+    return mesh.vertex_matrix(), mesh.face_matrix()
 
 def pymeshlab_volume(meshset):
-    try:
-        out_dict = meshset.get_geometric_measures()
-        mesh_volume = out_dict['mesh_volume']
-        vol = abs(round(mesh_volume, 2))
-        return vol
-    except:
-        return 0.00
+    return abs(round(signed_volume(*pymeshlab_arrays(meshset)), 2))
 
 def voxelfuse_volume(mesh):
-    mesh_tri = trimesh.Trimesh(vertices=mesh.verts, faces=mesh.tris)
-    return trimesh_volume(mesh_tri)
+    return abs(round(signed_volume(mesh.verts, mesh.tris), 2))
+
+def vtk_arrays(model_vtk):
+    from vtk.util.numpy_support import vtk_to_numpy
+    model_vtk.Update()
+    polydata = model_vtk.GetOutput()
+    verts = vtk_to_numpy(polydata.GetPoints().GetData())
+    faces = vtk_to_numpy(polydata.GetPolys().GetConnectivityArray()).reshape(-1, 3)
+    return verts, faces
 
 def vtk_volume(model_vtk):
-    mass_vtk = vtk.vtkMassProperties()
-    mass_vtk.SetInputConnection(model_vtk.GetOutputPort())
-    vol = mass_vtk.GetVolume()
-    return abs(round(vol, 2))
+    return abs(round(signed_volume(*vtk_arrays(model_vtk)), 2))
 
 def pymeshlab_surface(meshset):
-    out_dict = meshset.get_geometric_measures()
-    surf_area = out_dict['surface_area']
-    surf = abs(round(surf_area, 2))
-    return surf
+    return abs(round(surface_area(*pymeshlab_arrays(meshset)), 2))
 
 def showError(nbVoxels, volume):
     """shows the error between two volumes
@@ -188,43 +207,71 @@ def showError(nbVoxels, volume):
         volume (int): volume that is compared to nbVoxels
     """
     diff = abs(nbVoxels-volume)
-    # print("Différence volumétrique: ", diff)
+    # print("Volume difference: ", diff)
     
     print("Erreur volumétrique: \n",round((diff/nbVoxels)*100, 5), "%")
 
 # ----------------------------------
-# Volume d'un .obj
+# Volume of a .obj
 # ----------------------------------
 
-def vol_obj(file_path):
-    """Calcule le volume d'un objet .obj avec la méthode incluse dans VTK.
-    Attention : ne fonctionne qu'avec un type .OBJ (pas STL)
+def parse_arrays(file_path):
+    """reads the (vertices, faces) arrays of a mesh (.obj, .stl, .ply, ...) by parsing the file.
+    Identical vertices are merged (an STL file stores 3 vertices per face).
+    Args:
+        file_path (string): path to the mesh file
+    """
+    import numpy as np
+    import trimesh
+    mesh = trimesh.load(file_path, force="mesh", process=True)
+    return np.asarray(mesh.vertices), np.asarray(mesh.faces)
+
+def read_arrays(file_path, store_dir=None):
+    """reads the (vertices, faces) arrays of a mesh through the mesh store (nii_mesh_generation/source/mesh_store.py) :
+    the file is only parsed on the first read, then its arrays are memory-mapped (.npy) from the ".mesh_store"
+    folder next to the file (or store_dir). A modified file is parsed again.
     Args:
-        file_path (string): path to the .obj file
+        file_path (string): path to the mesh file
+        store_dir (string, optional): folder of the mesh store
     """
-    reader = vtk.vtkOBJReader()
-    reader.SetFileName(file_path)
-    reader.Update()
-    # Create a mass properties filter and set the input
-    mass = vtk.vtkMassProperties()
-    mass.SetInputConnection(reader.GetOutputPort())
-    # Print the volume
-    volume = mass.GetVolume()
-    return(volume)
+    return load_mesh(file_path, store_dir, reader=parse_arrays)
+
+def stored_mesh(file_path, store_dir=None):
+    """vedo Mesh built from the arrays of the mesh store (see read_arrays)
+    Args:
+        file_path (string): path to the mesh file
+        store_dir (string, optional): folder of the mesh store
+    """
+    from vedo import Mesh
+    return Mesh(list(read_arrays(file_path, store_dir)))
+
+def metrics_obj(file_path, store_dir=None):
+    """computes every metric of a mesh : volume, surface area, bounding box, Euler characteristic,
+    boundary / non-manifold edges, connected components (see nii_mesh_generation/source/mesh_metrics.py)
+    Args:
+        file_path (string): path to the mesh file
+        store_dir (string, optional): folder of the mesh store (see read_arrays)
+    """
+    return mesh_metrics(*read_arrays(file_path, store_dir))
+
+def vol_obj(file_path, store_dir=None):
+    """computes the volume of a mesh directly from its (vertices, faces) arrays.
+    Works with every format (.obj, .stl, ...)
+    Args:
+        file_path (string): path to the mesh file
+        store_dir (string, optional): folder of the mesh store (see read_arrays)
+    """
+    return abs(signed_volume(*read_arrays(file_path, store_dir)))
 
 def vol_obj_2(file_path):
-    """Calcule le volume d'un objet .obj avec la méthode incluse dans Pymeshlab.
-    Cette méthode semble moins fiable que celle de VTK
+    """former version of vol_obj (Pymeshlab). Now gives the same result as vol_obj.
     Args:
-        file_path (string): path to the .obj file
+        file_path (string): path to the mesh file
     """
-    import pymeshlab
-    mset = pymeshlab.MeshSet()
-    mset.load_new_mesh(file_path)
-    return (pymeshlab_volume(mset))
+    return vol_obj(file_path)
 
 # ----------------------------------
-# Temps d'execution
+# Execution time
 
 def affiche_temps(t_init):
     print(time.time()-t_init)
@@ -8,6 +8,7 @@ import pymeshlab
 import voxelfuse as vf       
 import vtk
 import numpy as np
+import trimesh
 
 # _______________________________ INPUT ZONE ___________________________________
 
@@ -6,6 +6,7 @@ import nibabel as nib
 from skimage import measure
 import pymeshlab
 import numpy as np
+import trimesh
 
 # _______________________________ INPUT ZONE ___________________________________
 
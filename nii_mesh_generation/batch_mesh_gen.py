@@ -0,0 +1,182 @@
+"""
+Authors: Sacha Cruz, Mario Espinoza
+________________________________
+|                              |
+|   NIFTI -> MESH GENERATION   |
+|             ---              |
+|       batch_mesh_gen.py      |
+|______________________________|
+
+Runs generate_from_nii on a whole folder (or glob pattern) of NIFTI files, on a pool of worker processes.
+Each file is meshed with the same parameters, without visualization, and a single "manifest.json" is written
+in the output folder with the outputs, volumes, errors and timings of every file.
+
+Usage (CLI):
+    python batch_mesh_gen.py "input_files/*.nii.gz" -o output_files --library pymeshlab --smoothing lap --smooth-val 5 --workers 8
+
+Usage (Python):
+    from batch_mesh_gen import generate_batch
+    manifest = generate_batch("input_files", out_dir="output_files", workers=8, smoothing="lap", smooth_val=5)
+
+/!\ On Windows, call generate_batch under a 'if __name__ == "__main__":' block (worker processes).
+"""
+
+from os import makedirs, path, cpu_count, listdir
+from glob import glob
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+import argparse
+import io
+import json
+import time
+
+from nii_mesh_gen import generate_from_nii, default_name
+from source.worker_threads import single_threaded, limit_threads
+
+NII_EXTENSIONS = (".nii", ".nii.gz")
+
+def find_nii(inputs):
+    """
+    Lists the NIFTI files of a folder, a glob pattern, a file, or a list of these.
+    """
+    if isinstance(inputs, (str, bytes)) or hasattr(inputs, "__fspath__"):
+        inputs = [inputs]
+    files = []
+    for item in inputs:
+        item = str(item)
+        if path.isdir(item):
+            found = [path.join(item, f) for f in listdir(item)]
+        elif path.isfile(item):
+            found = [item]
+        else:
+            found = glob(item)
+        files += sorted(f for f in found if f.endswith(NII_EXTENSIONS))
+    return files
+
+def nii_stem(nii_file):
+    """
+    File name without the .nii / .nii.gz extension.
+    """
+    name = path.basename(nii_file)
+    for extension in NII_EXTENSIONS[::-1]:
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+def generate_batch(
+        inputs,
+        out_dir     = ".",
+        workers     = None,
+        verbose     = False,
+        manifest    = "manifest.json",
+        **params):
+    """
+    Generates one Mesh per NIFTI file, on a pool of worker processes.
+    Args:
+        inputs      (str / list):       Folder, glob pattern or file (or a list of them) of the NIFTI files.
+        out_dir     (str, optional):    Output folder of the meshes and of the manifest.
+        workers     (int, optional):    Number of worker processes. Defaults to the number of CPUs.
+        verbose     (bool, optional):   If false, the output of each run is not printed.
+        manifest    (str, optional):    Name of the manifest file written in out_dir.
+        **params:                       Parameters of generate_from_nii (library, simplify, smoothing, ...). visualize is always False.
+    Returns:
+        dict: The manifest (parameters, total time and one row per file).
+    """
+    if "visualize" in params or "out_name" in params or "out_dir" in params:
+        raise ValueError("visualize, out_name and out_dir can't be set per file in a batch")
+    nii_files = find_nii(inputs)
+    if not nii_files:
+        raise FileNotFoundError(f"No NIFTI file found in {inputs}")
+    workers = workers or cpu_count() or 1
+    makedirs(out_dir, exist_ok=True)
+
+    # Each file gets its own name, so that parallel runs never fight over the same output file
+    name = default_name(params.get("library", "pymeshlab"), params.get("simply_val", 100), params.get("smooth_val", 0))
+
+    print(f"{len(nii_files)} NIFTI files, {workers} workers")
+    initial_time = time.time()
+    rows = []
+    # The workers start with the thread variables set (see source/worker_threads.py)
+    with single_threaded(), ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        jobs = [pool.submit(_run_file, nii_file, out_dir, f"{nii_stem(nii_file)}_{name}", verbose, params)
+                for nii_file in nii_files]
+        for job in as_completed(jobs):
+            row = job.result()
+            rows.append(row)
+            print(f"[{len(rows)}/{len(nii_files)}] {row['status']} : {row['input']} ({round(row['wall_time'], 2)} s)")
+    rows.sort(key=lambda row: row["input"])
+
+    result = dict(
+        params      = params,
+        workers     = workers,
+        total_time  = time.time() - initial_time,
+        errors      = sum(row["status"] != "ok" for row in rows),
+        files       = rows)
+    manifest_path = path.join(out_dir, manifest)
+    with open(manifest_path, "w") as file:
+        json.dump(result, file, indent=2, default=str)
+    print(f"Manifest saved successfully as : \n{manifest_path}")
+    return result
+
+def _init_worker():
+    # One process per core : the libraries loaded in the worker read the variables of single_threaded(),
+    # the ones inherited from the parent process (fork) are limited here
+    limit_threads()
+
+def _run_file(nii_file, out_dir, out_name, verbose, params):
+    # Runs in a worker process : errors are stored in the manifest instead of stopping the batch
+    initial_time = time.time()
+    row = dict(input=nii_file, status="ok")
+    # One process per core : the distance queries stay on one thread
+    params = dict(params, distance_workers=1)
+    try:
+        if verbose:
+            info = generate_from_nii(nii_file, visualize=False, out_dir=out_dir, out_name=out_name, **params)
+        else:
+            with redirect_stdout(io.StringIO()):
+                info = generate_from_nii(nii_file, visualize=False, out_dir=out_dir, out_name=out_name, **params)
+        # Only the path, the metrics and the stages go back to the main process, not the arrays
+        row.update(info.as_dict(), stages=info.stages)
+    except Exception as e:
+        row.update(status="error", error=f"{type(e).__name__}: {e}")
+    row["wall_time"] = time.time() - initial_time
+    return row
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generates one mesh per NIFTI file of a folder, in parallel.")
+    parser.add_argument("inputs", nargs="+", help="NIFTI folders, files or glob patterns")
+    parser.add_argument("-o", "--out-dir", default=".", help="output folder (meshes and manifest.json)")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--library", default="pymeshlab", choices=["pymeshlab", "nii2mesh", "vtk"])
+    parser.add_argument("--simplify", default="")
+    parser.add_argument("--simply-val", type=int, default=100)
+    parser.add_argument("--smoothing", default="")
+    parser.add_argument("--smooth-val", type=int, default=0)
+    parser.add_argument("--grid-scale", type=float, nargs=3, default=None,
+                        help="voxel spacing forced instead of the header's (default: spacing and affine of each file)")
+    parser.add_argument("--out-type", default="obj")
+    parser.add_argument("--no-doc", action="store_true", help="do not save a TXT document per mesh")
+    parser.add_argument("--no-crop", action="store_true", help="run the marching cubes on the full grid")
+    parser.add_argument("--stages-file", default=None, help="JSON lines file receiving the timings of every stage of every run")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the output of every run")
+    args = parser.parse_args(argv)
+
+    result = generate_batch(
+        inputs      = args.inputs,
+        out_dir     = args.out_dir,
+        workers     = args.workers,
+        verbose     = args.verbose,
+        library     = args.library,
+        simplify    = args.simplify,
+        simply_val  = args.simply_val,
+        smoothing   = args.smoothing,
+        smooth_val  = args.smooth_val,
+        grid_scale  = args.grid_scale and tuple(args.grid_scale),
+        out_type    = args.out_type,
+        info_doc    = not args.no_doc,
+        crop        = not args.no_crop,
+        stages_file = args.stages_file)
+    return 1 if result["errors"] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,346 @@
+"""
+Authors: Sacha Cruz, Mario Espinoza
+________________________________
+|                              |
+|   NIFTI -> MESH GENERATION   |
+|             ---              |
+|       bench_mesh_gen.py      |
+|______________________________|
+
+Benchmarks of the mesh generation.
+
+Parallel marching cubes : the serial marching cubes and the parallel one (source/mesh_parallel.py) run on the same
+cropped mask for several numbers of workers. Each row gives the best time of a few runs, the speedup over the serial
+marching cubes, and whether the welded mesh is topologically identical to the serial one (same faces on the same voxel edges).
+
+Import time : each module is imported in a new Python process (python -X importtime), and the best time of a few
+runs is compared with its budget. The heavy libraries it imported (numpy, nibabel, pymeshlab, ...) are listed :
+they should only be imported when a mesh is generated (source/backends.py). The command fails if a budget is exceeded.
+
+Phantoms : every library and setting runs on analytic phantoms (source/phantoms.py : spheres, tori, thin tubes, noisy blobs)
+of several sizes, each run in a new process. Each row gives the time of generate_from_nii, the peak memory of the process,
+the face count, the size of the mesh file and the volume error against the exact volume of the shape. The rows are saved
+in a JSON file, and can be compared with a baseline file : the command fails if a run got slower, bigger or less precise.
+
+Usage (CLI):
+    python bench_mesh_gen.py input_files/whole_body.nii --workers 1 2 4 8 16 32 -o output_files/bench_mc.tsv
+    python bench_mesh_gen.py --imports --budget 0.15
+    python bench_mesh_gen.py --phantoms --sizes 64 128 256 -o bench_phantoms.json
+    python bench_mesh_gen.py --phantoms --sizes 64 128 256 -o bench_new.json --baseline bench_phantoms.json
+
+Usage (Python):
+    from bench_mesh_gen import bench_parallel_mc, bench_imports, bench_phantoms, compare_results
+    rows = bench_parallel_mc("input_files/whole_body.nii", workers=(1, 2, 4, 8))
+    rows = bench_imports({"nii_mesh_gen": 0.15})
+    rows = bench_phantoms(shapes=("sphere", "tube"), sizes=(64, 128), libraries=("pymeshlab", "vtk"))
+"""
+
+from os import path
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from source.nii_volume import load_volume
+from source.mesh_streaming import edge_keys
+from source.mesh_parallel import parallel_marching_cubes
+
+def face_signature(grid_verts, faces, shape):
+    """
+    Faces written with the edge keys of their vertices, each one starting at its smallest key (orientation kept), sorted.
+    Two marching cubes meshes of the same grid are topologically identical if their signatures are equal.
+    """
+    keyed = edge_keys(grid_verts, shape)[faces]
+    shift = keyed.argmin(axis=1)
+    rolled = np.take_along_axis(keyed, (shift[:, None] + np.arange(3)) % 3, axis=1)
+    return rolled[np.lexsort(rolled.T[::-1])]
+
+def bench_parallel_mc(nii_dir, workers=(1, 2, 4, 8), repeats=3, block_size=None, threads=False):
+    """
+    Times the serial and the parallel marching cubes on the cropped mask of a label-map.
+    Args:
+        nii_dir     (str):              Location of the NIFTI file. An already-loaded numpy array, nibabel image or NiiVolume is also accepted.
+        workers     (tuple, optional):  Numbers of workers to benchmark.
+        repeats     (int, optional):    Number of runs of each setting (the best time is kept).
+        block_size, threads :           See parallel_marching_cubes.
+    Returns:
+        list of dict: One row per setting (workers, blocks, time, speedup, faces, vertices, identical).
+    """
+    from skimage import measure
+    mask = load_volume(nii_dir).crop().mask()
+    print(f"Mask : {mask.shape}, {int(np.count_nonzero(mask))} voxels")
+
+    def best_time(function):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = function()
+            times.append(time.perf_counter() - start)
+        return min(times), result
+
+    serial_time, (verts, faces, _, _) = best_time(lambda: measure.marching_cubes(mask, level=0.5))
+    reference = face_signature(verts.astype(np.float64), faces, mask.shape)
+    rows = [dict(workers="serial", time=serial_time, speedup=1.0, faces=len(faces), vertices=len(verts), identical=True)]
+    print(f"serial : {len(faces)} faces in {round(serial_time, 3)} s")
+
+    for worker_number in workers:
+        elapsed, (verts, faces) = best_time(
+            lambda: parallel_marching_cubes(mask, workers=worker_number, block_size=block_size, threads=threads))
+        identical = bool(len(faces) == len(reference) and np.array_equal(face_signature(verts, faces, mask.shape), reference))
+        rows.append(dict(workers=worker_number, time=elapsed, speedup=serial_time / elapsed,
+                         faces=len(faces), vertices=len(verts), identical=identical))
+        print(f"{worker_number} workers : {round(elapsed, 3)} s, speedup x{round(serial_time / elapsed, 2)}"
+              + ("" if identical else " /!\\ NOT IDENTICAL to the serial mesh"))
+    return rows
+
+# Cold import budgets in seconds (a slow machine is allowed several times the usual time)
+IMPORT_BUDGETS = {"nii_mesh_gen": 0.15, "batch_mesh_gen": 0.2, "warm_mesh_gen": 0.1}
+HEAVY_MODULES = ("numpy", "nibabel", "skimage", "scipy", "pymeshlab", "vtk", "vedo", "trimesh")
+
+def import_time(module, cwd=None):
+    """
+    Imports a module in a new Python process (python -X importtime). Returns the import time in seconds and the list
+    of the modules it imported, with their cumulative times.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=cwd or path.dirname(path.abspath(__file__)), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise ImportError(f"Unable to import {module} :\n{result.stderr}")
+    imported = {}
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            imported[name.strip()] = int(cumulative) / 1e6
+    return imported[module], imported
+
+def bench_imports(budgets=None, repeats=5):
+    """
+    Times the cold import of modules of the package and compares it with their budgets.
+    Args:
+        budgets     (dict, optional):   {module: budget in seconds}. Defaults to IMPORT_BUDGETS.
+        repeats     (int, optional):    Number of imports of each module (the best time is kept).
+    Returns:
+        list of dict: One row per module (module, time, budget, passed, heavy : heavy libraries imported).
+    """
+    rows = []
+    for module, budget in (budgets or IMPORT_BUDGETS).items():
+        runs = [import_time(module) for _ in range(repeats)]
+        best, imported = min(runs, key=lambda run: run[0])
+        heavy = [name for name in HEAVY_MODULES if name in imported]
+        rows.append(dict(module=module, time=best, budget=budget, passed=best <= budget, heavy=",".join(heavy)))
+        print(f"import {module} : {round(best * 1000, 1)} ms (budget {round(budget * 1000)} ms)"
+              + ("" if best <= budget else " /!\\ OVER BUDGET") + (f", imports {', '.join(heavy)}" if heavy else ""))
+    return rows
+
+# Settings of each library benchmarked on the phantoms (parameters of generate_from_nii)
+PHANTOM_SETTINGS = {
+    "pymeshlab":    [dict(), dict(smoothing="lap", smooth_val=5), dict(smoothing="hc", smooth_val=5),
+                     dict(simplify="qec", simply_val=25), dict(simplify="qec", simply_val=25, smoothing="lap", smooth_val=5)],
+    "nii2mesh":     [dict(), dict(smooth_val=5), dict(smooth_val=5, simply_val=25)],
+    "vtk":          [dict(), dict(simply_val=25)]}
+
+# Relative increase of time / memory / size, and absolute increase of volume error, above which a run is a regression
+TOLERANCES = dict(time=0.25, peak_memory=0.1, file_size=0.05, volume_error=0.002)
+
+def setting_name(params):
+    """
+    Short name of a setting, for example "smoothing=lap,smooth_val=5" ("default" without parameters).
+    """
+    return ",".join(f"{name}={value}" for name, value in params.items()) or "default"
+
+def _bench_run(shape, size, library, params, repeats):
+    # Runs in a new process : its peak memory only counts this run (phantom included)
+    import os
+    import nibabel as nib
+    from nii_mesh_gen import generate_from_nii
+    from source.mesh_tools import peak_rss
+    from source.phantoms import make_phantom
+    # Silences the runs, the C libraries included (they write to the file descriptor, not to sys.stdout)
+    os.dup2(os.open(os.devnull, os.O_WRONLY), 1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # The libraries are imported on first use : a small untimed run first
+        generate_from_nii(nib.Nifti1Image(make_phantom("sphere", 16)[0], np.eye(4)), library=library, visualize=False,
+                          info_doc=False, out_dir=tmp_dir, out_name="warm_up", **params)
+        mask, exact_volume = make_phantom(shape, size)
+        image = nib.Nifti1Image(mask, np.eye(4))
+        times = []
+        for repeat in range(repeats):
+            start = time.perf_counter()
+            mesh = generate_from_nii(image, library=library, visualize=False, info_doc=False,
+                                     out_dir=tmp_dir, out_name=f"run{repeat}", **params)
+            times.append(time.perf_counter() - start)
+    return dict(
+        time            = min(times),
+        peak_memory     = peak_rss(),
+        faces           = int(mesh.face_number),
+        vertices        = int(mesh.vertex_number),
+        file_size       = mesh.metrics["size"],
+        exact_volume    = exact_volume,
+        mesh_volume     = mesh.metrics["mesh_volume"],
+        volume_error    = abs(mesh.metrics["mesh_volume"] - exact_volume) / exact_volume,
+        voxel_error     = mesh.metrics["error"])
+
+def bench_phantoms(shapes=None, sizes=(64, 128, 256), libraries=None, settings=None, repeats=1):
+    """
+    Runs every library and setting on analytic phantoms.
+    Args:
+        shapes      (tuple, optional):  Phantoms ("sphere", "torus", "tube", "blob"). Defaults to all of them.
+        sizes       (tuple, optional):  Sizes of the phantoms (voxels along each axis, 64 to 1024).
+        libraries   (tuple, optional):  Libraries to run. Defaults to the available ones (source/backends.py).
+        settings    (dict, optional):   {library: list of parameter dictionaries}. Defaults to PHANTOM_SETTINGS.
+        repeats     (int, optional):    Runs of each setting on the same phantom (the best time is kept).
+    Returns:
+        list of dict: One row per run (shape, size, library, setting, time, peak_memory, faces, vertices, file_size,
+                      exact / mesh volume, volume_error against the exact volume, voxel_error against the voxel count,
+                      or error if the run failed).
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from source.backends import available_backends
+    from source.phantoms import PHANTOMS
+    settings = settings or PHANTOM_SETTINGS
+    if libraries is None:
+        libraries = [name for name, available in available_backends().items() if available and name in settings]
+    # A new (spawned) process per run : nothing of the previous runs is left in its memory
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for shape in shapes or PHANTOMS:
+        for size in sizes:
+            for library in libraries:
+                for params in settings.get(library, [dict()]):
+                    row = dict(shape=shape, size=size, library=library, setting=setting_name(params))
+                    rows.append(row)
+                    try:
+                        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                            row.update(pool.submit(_bench_run, shape, size, library, params, repeats).result())
+                    except Exception as e:
+                        # A failed run (or a worker killed by the memory limit) is recorded, the others go on
+                        row["error"] = f"{type(e).__name__}: {e}"
+                        print(f"{shape} {size}^3 {library} {row['setting']} : {row['error']}")
+                        continue
+                    print(f"{shape} {size}^3 {library} {row['setting']} : {round(row['time'], 3)} s, "
+                          f"{round(row['peak_memory'] or 0)} MB, {row['faces']} faces, volume error {round(row['volume_error'] * 100, 3)} %")
+    return rows
+
+def machine_info():
+    """
+    Description of the machine and of the library versions, saved with the results.
+    """
+    from importlib.metadata import version, PackageNotFoundError
+    versions = {}
+    for package in ("numpy", "nibabel", "scikit-image", "pymeshlab", "vtk"):
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            pass
+    import os
+    return dict(python=platform.python_version(), platform=platform.platform(), processor=platform.processor(),
+                cpus=os.cpu_count(), versions=versions, date=time.strftime("%Y-%m-%d %H:%M:%S"))
+
+def save_results(rows, out_file):
+    """
+    Saves the rows of bench_phantoms in a JSON file, with the description of the machine.
+    """
+    with open(out_file, "w") as file:
+        json.dump(dict(machine=machine_info(), rows=rows), file, indent=1)
+    print(f"Results saved successfully as : \n{out_file}")
+
+def compare_results(rows, baseline, tolerances=None):
+    """
+    Compares rows of bench_phantoms with the rows of a baseline (same shape, size, library and setting).
+    Args:
+        rows        (list):             Rows of the new run.
+        baseline    (list / str):       Rows of the baseline, or its JSON file.
+        tolerances  (dict, optional):   See TOLERANCES.
+    Returns:
+        list of dict: One row per run found in both (ratios of time / memory / file size, change of volume error,
+                      regressions : names of the figures beyond their tolerance).
+    """
+    tolerances = dict(TOLERANCES, **(tolerances or {}))
+    if isinstance(baseline, str):
+        with open(baseline) as file:
+            baseline = json.load(file)["rows"]
+    key = lambda row: (row["shape"], row["size"], row["library"], row["setting"])
+    old_rows = {key(row): row for row in baseline if "error" not in row}
+    comparison = []
+    for row in rows:
+        old = old_rows.get(key(row))
+        if old is None or "error" in row:
+            continue
+        result = dict(shape=row["shape"], size=row["size"], library=row["library"], setting=row["setting"])
+        regressions = []
+        for name in ("time", "peak_memory", "file_size"):
+            if row[name] and old[name]:
+                result[name + "_ratio"] = row[name] / old[name]
+                if row[name] > old[name] * (1 + tolerances[name]):
+                    regressions.append(name)
+        result["volume_error_change"] = row["volume_error"] - old["volume_error"]
+        if result["volume_error_change"] > tolerances["volume_error"]:
+            regressions.append("volume_error")
+        result["faces_change"] = row["faces"] - old["faces"]
+        result["regressions"] = ",".join(regressions)
+        comparison.append(result)
+        print(f"{row['shape']} {row['size']}^3 {row['library']} {row['setting']} : time x{round(result.get('time_ratio', 1), 2)}, "
+              f"memory x{round(result.get('peak_memory_ratio', 1), 2)}, volume error {round(result['volume_error_change'] * 100, 3):+} %"
+              + (f"  /!\\ REGRESSION ({result['regressions']})" if regressions else ""))
+    return comparison
+
+def save_rows(rows, out_file):
+    """
+    Saves rows (list of dict with the same keys) in a .tsv file.
+    """
+    with open(out_file, "w") as file:
+        file.write("\t".join(rows[0]) + "\n")
+        for row in rows:
+            file.write("\t".join(str(value) for value in row.values()) + "\n")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the mesh generation.")
+    parser.add_argument("input", nargs="?", help="NIFTI file (parallel marching cubes)")
+    parser.add_argument("-w", "--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="numbers of workers of the parallel marching cubes")
+    parser.add_argument("-r", "--repeats", type=int, default=None, help="runs of each setting (the best time is kept, default: 3, 1 for the phantoms)")
+    parser.add_argument("--block-size", type=int, default=None, help="cells of a block along each axis (default: z-slabs)")
+    parser.add_argument("--threads", action="store_true", help="thread pool instead of process pool")
+    parser.add_argument("-o", "--output", default=None, help="also saves the rows in this .tsv file")
+    parser.add_argument("--imports", action="store_true", help="times the cold imports of the package instead")
+    parser.add_argument("--budget", type=float, default=None, help="import budget of nii_mesh_gen in seconds (with --imports)")
+    parser.add_argument("--phantoms", action="store_true", help="runs the libraries on analytic phantoms instead (JSON output)")
+    parser.add_argument("--shapes", nargs="+", default=None, help="phantoms (default: sphere torus tube blob)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 128, 256], help="sizes of the phantoms (64 to 1024)")
+    parser.add_argument("--libraries", nargs="+", default=None, help="libraries (default: the available ones)")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare with (with --phantoms)")
+    parser.add_argument("--time-tolerance", type=float, default=TOLERANCES["time"], help="relative slow-down accepted against the baseline")
+    args = parser.parse_args(argv)
+
+    if args.phantoms:
+        rows = bench_phantoms(args.shapes, args.sizes, args.libraries, repeats=args.repeats or 1)
+        save_results(rows, args.output or "bench_phantoms.json")
+        failed = any("error" in row for row in rows)
+        if args.baseline:
+            comparison = compare_results(rows, args.baseline, dict(time=args.time_tolerance))
+            failed = failed or any(row["regressions"] for row in comparison)
+        return 1 if failed else 0
+
+    if args.imports:
+        budgets = dict(IMPORT_BUDGETS, **({"nii_mesh_gen": args.budget} if args.budget is not None else {}))
+        rows = bench_imports(budgets, repeats=args.repeats or 5)
+        if args.output:
+            save_rows(rows, args.output)
+        return 0 if all(row["passed"] for row in rows) else 1
+    if args.input is None:
+        parser.error("a NIFTI file is needed (or --imports / --phantoms)")
+    rows = bench_parallel_mc(args.input, args.workers, args.repeats or 3, args.block_size, args.threads)
+    if args.output:
+        save_rows(rows, args.output)
+    return 0 if all(row["identical"] for row in rows) else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
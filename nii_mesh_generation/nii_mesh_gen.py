@@ -27,6 +27,7 @@ Dependencies:
 - pymeshlab and vtk for advanced mesh manipulation.
 
 Custom Modules:
+- `backends.py`         registry of the libraries, imported on first use.
 - `mesh_gen_python.py`  provides Python-based mesh generation tools.
 - `mesh_gen_c.py`          provides C-based mesh generation tools.
 - `mesh_tools.py`       includes utilities for displaying a mesh and its details.
@@ -34,19 +35,17 @@ Custom Modules:
 """
 
 from os import makedirs, path
-from pathlib import Path
-from numpy import count_nonzero
-import nibabel as nib
 import time
 
-from source.mesh_gen_python import mesh_gen_pylab
-from source.mesh_gen_python import mesh_gen_vtk
-from source.mesh_gen_c import mesh_gen_nii2mesh
-from source.mesh_tools import show_obj, vol_obj, doc_obj
+# numpy, nibabel and the libraries of the backends are imported on first use : importing this module stays cheap
+from source.backends import get_backend
+from source.mesh_stages import StageRecorder, stage_totals
+from source.nii_volume import load_volume, label_boxes, transform_points
+from source.mesh_tools import show_mesh, vol_mesh, doc_obj, doc_table, bundle_obj, peak_rss
 
 def generate_from_nii(
         nii_dir, 
-        grid_scale  = (0.55, 0.55, 0.55),
+        grid_scale  = None,
         library     = "pymeshlab", 
         simplify    = "", 
         simply_val  = 100,
@@ -56,14 +55,25 @@ def generate_from_nii(
         visualize   = True,
         out_type    = "obj",
         out_dir     = ".",
-        out_name    = "" ):
+        out_name    = "",
+        native_dtype = True,
+        crop        = True,
+        cache_dir   = None,
+        cache_size  = 1024,
+        mc_workers  = None,
+        distances   = False,
+        distance_workers = -1,
+        stages_file = None,
+        on_stage    = None ):
     """
     Generates a Mesh (.obj / .stl) from a .nii file.
     Args:
-        nii_dir         (str):              Location of the NIFTI file.
-        grid_scale      (tuple, optional):  Grid normalization values.                  (DEPENDS ON THE LIBRARY)
+        nii_dir         (str):              Location of the NIFTI file. An already-loaded numpy array, nibabel image or NiiVolume is also accepted.
+        grid_scale      (tuple, optional):  Voxel spacing. If None (default), the spacing and the affine of the NIFTI header are used
+                                            and the mesh is in world coordinates. If given, it replaces the spacing of the header
+                                            and the mesh stays in grid coordinates (the affine is not applied). (pymeshlab and vtk)
         # -----------------------------------------------------------------------------------------------------------------------------------------
-        library         (str, optional):    Choose the library : "pymeshlab" / "nii2mesh" / "vtk".
+        library         (str, optional):    Choose the library : "pymeshlab" / "nii2mesh" / "vtk" (or a library registered in source/backends.py).
         simplify        (str, optional):    Choose the simplification method.           (DEPENDS ON THE LIBRARY)
         smoothing       (str, optional):    Choose the smoothing method.                (DEPENDS ON THE LIBRARY)
         smooth_val      (int, optional):  The coefficient of the smoothing method.      (DEPENDS ON THE LIBRARY)
@@ -75,6 +85,26 @@ def generate_from_nii(
         # -----------------------------------------------------------------------------------------------------------------------------------------
         info_doc        (bool, optional):   If true, creates a document containing useful information. (Volume, file size, volumetric error, ...)
         visualize       (bool, optional):   If true, opens a wintow to visualize the 3D mesh after creating it.
+        native_dtype    (bool, optional):   If true, the label-map keeps its on-disk dtype (uint8, int16, ...) instead of float64, and .nii files are memory-mapped.
+        crop            (bool, optional):   If true, the marching cubes only runs on the bounding box of the label (plus 1 voxel). Used by every library.
+        cache_dir       (str, optional):    If given, the marching cubes results are cached in this folder : a new run on the same label-map
+                                            (with other smoothing / simplification settings) skips the marching cubes. (pymeshlab only)
+        cache_size      (int, optional):    Size limit of the cache folder in MB. The least recently used results are removed first.
+        mc_workers      (int, optional):    If above 1, the marching cubes runs on blocks of the label-map on that many worker processes,
+                                            welded into the same mesh as the serial marching cubes. (pymeshlab only)
+        distances       (bool, optional):   If true, also measures the Hausdorff, 95th-percentile and mean surface distances between
+                                            the mesh and the boundary of the label-map. (nii2mesh : only when grid_scale is None)
+        distance_workers (int, optional):   Threads of the distance queries. Defaults to -1 (all cores) : the worker processes
+                                            of batch_mesh_gen, serve_mesh_gen and warm_mesh_gen use 1.
+        stages_file     (str, optional):    If given, the record of every stage of the run is appended to this file as a JSON line.
+        on_stage        (callable, optional): If given, called with the record of every stage (a dict) when it ends.
+    
+    Returns:
+        MeshResult: Vertex / face arrays and path of the mesh. Its "metrics" hold label_volume, mesh_volume, error, size,
+                    elapsed_time (up to the saved mesh) and peak_memory of the run, and the metrics of source/mesh_metrics.py
+                    (surface area, bounding box, Euler characteristic, boundary / non-manifold edges, components).
+                    Its "stages" hold the wall time, CPU time and vertex / face counts of each stage (load, crop, marching_cubes,
+                    transform, simplify, smooth, write, metrics, distances, doc, visualize), see source/mesh_stages.py.
     
     /!\ If you want to know the (depends on the library) specifications :
         --> Check the README.md file 
@@ -85,32 +115,30 @@ def generate_from_nii(
     # INITIALIZATION
     # ------------------------------
 
-    # Define the paths
-    dir_path = Path(__file__).resolve().parent
-    nii2mesh_path = dir_path / "source" / "nii2mesh" / "src"
     mesh_path = None
     initial_time = time.time()
     
     # Validate input parameters
-    if simply_val < 5 or simply_val > 100:
-        raise ValueError("simply_val must be between 5 and 100. simply_val = 100 creates a mesh with no simplification.")
-    if smooth_val < 0 or smooth_val > 10:
-        raise ValueError("smooth_val must be between 0 and 10. smooth_val = 0 creates a mesh with no smoothing.")
+    check_values(simply_val, smooth_val)
     
-    # Calculate NIFTI volume
-    nifti_array = nib.load(nii_dir).get_fdata()
-    nbVoxels = count_nonzero(nifti_array)
-    ax,ay,az = grid_scale
-    volVoxels = nbVoxels*ax*ay*az
-
     # Create output file's name if not provided
     if out_name == "":
-        mesh_name_parts = ["mesh", str(library)]
-        if simply_val < 100:
-            mesh_name_parts.append(f"simp={simply_val}")
-        if smooth_val > 0:
-            mesh_name_parts.append(f"smooth={smooth_val}")
-        out_name = "_".join(mesh_name_parts)
+        out_name = default_name(library, simply_val, smooth_val)
+    
+    # Times every stage of the run (see source/mesh_stages.py)
+    from uuid import uuid4
+    recorder = StageRecorder(stages_file, on_stage, run=uuid4().hex, library=library, out_name=out_name)
+    
+    # Load the NIFTI once : the same volume is shared by the volume calculation and the backends
+    with recorder.stage("load") as record:
+        volume = load_volume(nii_dir, native_dtype=native_dtype)
+        recorder.context.update(input=volume.name)
+        # Counting the voxels reads (and decompresses) the whole label-map
+        nbVoxels = volume.voxel_count()
+        record.update(voxels=nbVoxels, shape=volume.shape)
+    
+    # Calculate NIFTI volume (voxel volume of the header, or of grid_scale)
+    volVoxels = nbVoxels*volume.voxel_volume(grid_scale)
         
     # Create output folder if it doesn't exist
     makedirs(out_dir, exist_ok=True)
@@ -119,41 +147,26 @@ def generate_from_nii(
     # CREATE THE MESH
     # ------------------------------
     
-    if library == "pymeshlab":
-        print("\n--------------------\n     PYMESHLAB      \n--------------------\n")
-        mesh_path = mesh_gen_pylab(
-            input_file = nii_dir, 
-            out_name = out_name, 
-            out_dir = out_dir, 
-            out_type = out_type, 
-            simplify = simplify,
-            simply_val = simply_val,
-            smoothing = smoothing,
-            smooth_val = smooth_val,
-            grid_scale = grid_scale)
-        
-    elif library == "nii2mesh":
-        print("\n--------------------\n      NII2MESH      \n--------------------\n")
-        mesh_path = mesh_gen_nii2mesh(
-                nii2mesh_path = str(nii2mesh_path),  
-                input_file = nii_dir, 
-                out_name = out_name, 
-                out_dir = out_dir, 
-                out_type = out_type, 
-                simply_val = simply_val,
-                smooth_val = smooth_val,
-                verbose = True)
-        
-    elif library == "vtk":
-        print("\n--------------------\n        VTK        \n--------------------\n")
-        mesh_path = mesh_gen_vtk(
-                input_file = nii_dir, 
-                out_name = out_name, 
-                out_dir = out_dir)
-    else:
-        raise ValueError("Wrong Library Name")
-    if mesh_path == None:
+    # The backends record their stages (crop, marching cubes, ...) in the recorder of this run
+    with recorder.activate():
+        mesh = create_mesh(
+            volume      = volume,
+            library     = library,
+            simplify    = simplify,
+            simply_val  = simply_val,
+            smoothing   = smoothing,
+            smooth_val  = smooth_val,
+            grid_scale  = grid_scale,
+            out_type    = out_type,
+            out_dir     = out_dir,
+            out_name    = out_name,
+            crop        = crop,
+            cache_dir   = cache_dir,
+            cache_size  = cache_size,
+            mc_workers  = mc_workers)
+    if mesh is None:
         raise TypeError("Mesh did not generate successfully")
+    mesh_path = mesh.mesh_path
 
     # ------------------------------
     # SHOW THE MESH
@@ -161,13 +174,23 @@ def generate_from_nii(
     
     elapsed_time = time.time() - initial_time
     
+    # Computed from the arrays of the mesh : the saved file is not read back
+    from source.mesh_metrics import mesh_metrics, mesh_distance, label_surface_points
     print("Calculating volume...")
-    volMesh = vol_obj(mesh_path)
+    # A file-only mesh (nii2mesh executable) is read here
+    with recorder.stage("metrics") as record:
+        metrics = mesh_metrics(mesh.verts, mesh.faces)
+        record.update(verts_in=mesh.vertex_number, faces_in=mesh.face_number)
+    volMesh = abs(metrics["volume"])
     print("Mesh Volume : ", volMesh )
+    peak_memory = peak_rss()
+    if peak_memory is not None:
+        print("Peak memory : ", round(peak_memory, 1), "MB")
     
     if visualize:
         print("Showing generated Mesh...")
-        show_obj(mesh_path)
+        with recorder.stage("visualize", mesh.verts, mesh.faces):
+            show_mesh(mesh.verts, mesh.faces, title=mesh_path)
     
     # ------------------------------
     # SAVE MESH DATA
@@ -175,23 +198,211 @@ def generate_from_nii(
     
     if info_doc:
         print("Saving Mesh info...")
-        doc_obj(
-            output_folder   = out_dir,
-            name = path.basename(mesh_path),
-            mesh_file       = path.basename(mesh_path),
-            nifti_file      = path.basename(nii_dir),
-            mesh_path       = mesh_path,
-            label_volume    = volVoxels,
-            mesh_volume     = volMesh,
-            error           = abs(volVoxels-volMesh)/volVoxels,
-            size            = path.getsize(mesh_path),
-            library         = library,
-            smoothing       = smoothing,
-            smooth_val      = smooth_val,
-            simplify        = simplify,
-            simply_val      = simply_val,
-            elapsed_time    = elapsed_time )
+        with recorder.stage("doc"):
+            doc_obj(
+                output_folder   = out_dir,
+                name = path.basename(mesh_path),
+                mesh_file       = path.basename(mesh_path),
+                nifti_file      = volume.name,
+                mesh_path       = mesh_path,
+                label_volume    = volVoxels,
+                mesh_volume     = volMesh,
+                error           = abs(volVoxels-volMesh)/volVoxels,
+                size            = path.getsize(mesh_path),
+                library         = library,
+                smoothing       = smoothing,
+                smooth_val      = smooth_val,
+                simplify        = simplify,
+                simply_val      = simply_val,
+                elapsed_time    = elapsed_time,
+                peak_memory     = peak_memory )
+    
+    mesh.metrics.update(metrics)
+    
+    # nii2mesh always meshes in world coordinates
+    if distances and (library != "nii2mesh" or grid_scale is None):
+        print("Calculating surface distances...")
+        with recorder.stage("distances", mesh.verts, mesh.faces):
+            # Boundary of the label-map, in the coordinates of the mesh
+            cropped = volume.crop()
+            reference = transform_points(
+                label_surface_points(cropped.mask(), cropped.spacing(grid_scale)), cropped.mesh_matrix(grid_scale))
+            mesh.metrics.update(mesh_distance(mesh.verts, mesh.faces, reference, workers=distance_workers))
+        print("Hausdorff distance : ", mesh.metrics["hausdorff"])
+    mesh.metrics.update(
+        label_volume    = volVoxels,
+        mesh_volume     = volMesh,
+        error           = abs(volVoxels-volMesh)/volVoxels,
+        size            = path.getsize(mesh_path),
+        elapsed_time    = elapsed_time,
+        peak_memory     = peak_memory)
+    mesh.stages = recorder.stages
+    print("Stages : " + " | ".join(f"{name} {round(seconds, 3)} s" for name, seconds in stage_totals(mesh.stages).items()))
+    return mesh
+
+def generate_labels_from_nii(
+        nii_dir,
+        labels      = None,
+        grid_scale  = None,
+        library     = "pymeshlab",
+        simplify    = "",
+        simply_val  = 100,
+        smoothing   = "",
+        smooth_val  = 0,
+        info_doc    = True,
+        bundle      = False,
+        workers     = None,
+        out_type    = "obj",
+        out_dir     = ".",
+        out_name    = "",
+        native_dtype = True ):
+    """
+    Generates one Mesh per label value of a multi-label .nii file, reading the file only once.
+    Args:
+        nii_dir         (str):              Location of the NIFTI file. An already-loaded numpy array, nibabel image or NiiVolume is also accepted.
+        labels          (list, optional):   Label values to mesh. If None, every label value present in the file is meshed.
+        bundle          (bool, optional):   If true, also bundles every mesh into one multi-object .obj file.
+        workers         (int, optional):    Number of worker processes. Defaults to the number of CPUs.
+        info_doc        (bool, optional):   If true, saves a per-label volume table (.tsv) instead of the single-label TXT document.
+        (Other parameters : see generate_from_nii)
+    Returns:
+        list of dict: One row of the volume table per label.
+    
+    /!\ On Windows, call this function under a 'if __name__ == "__main__":' block (worker processes).
+    """
+    
+    initial_time = time.time()
+    check_values(simply_val, smooth_val)
+    
+    # Load the NIFTI once, then find every label and its bounding box in one pass
+    volume = load_volume(nii_dir, native_dtype=native_dtype)
+    boxes = label_boxes(volume.array)
+    if labels is not None:
+        missing = [value for value in labels if value not in boxes]
+        if missing:
+            raise ValueError(f"Labels not found in the file : {missing}")
+        boxes = {value: boxes[value] for value in labels}
+    print(f"{len(boxes)} labels found : {list(boxes)}")
+    
+    if out_name == "":
+        out_name = default_name(library, simply_val, smooth_val)
+    makedirs(out_dir, exist_ok=True)
+    
+    # Each worker only receives the (small) cropped mask of its label
+    params = dict(
+        library     = library,
+        simplify    = simplify,
+        simply_val  = simply_val,
+        smoothing   = smoothing,
+        smooth_val  = smooth_val,
+        grid_scale  = grid_scale,
+        out_type    = out_type,
+        out_dir     = out_dir,
+        crop        = False,
+        banner      = False)
+    voxel_volume = volume.voxel_volume(grid_scale)
+    rows = []
+    meshes = []
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = {}
+        for value, box in boxes.items():
+            label_volume = volume.label(value, box)
+            jobs[value] = (label_volume.voxel_count(), pool.submit(
+                _mesh_label, label_volume, out_name=f"{out_name}_label{value}", **params))
+        for value, (nbVoxels, job) in jobs.items():
+            mesh, elapsed_time = job.result()
+            volVoxels = nbVoxels*voxel_volume
+            volMesh = vol_mesh(mesh.verts, mesh.faces)
+            meshes.append((mesh.verts, mesh.faces))
+            rows.append(dict(
+                label           = value,
+                voxels          = nbVoxels,
+                label_volume    = volVoxels,
+                mesh_volume     = volMesh,
+                error           = abs(volVoxels-volMesh)/volVoxels,
+                size            = path.getsize(mesh.mesh_path),
+                elapsed_time    = elapsed_time,
+                mesh_file       = path.basename(mesh.mesh_path)))
+    
+    if bundle:
+        bundle_obj(
+            meshes          = meshes,
+            object_names    = [f"label_{row['label']}" for row in rows],
+            out_file        = path.join(out_dir, out_name + "_labels.obj"))
+    
+    if info_doc:
+        doc_table(output_folder=out_dir, name=out_name + "_labels", rows=rows)
+    
+    print(f"{len(rows)} meshes generated in {round(time.time() - initial_time, 2)} s")
+    return rows
 
+def _mesh_label(label_volume, **params):
+    # Runs in a worker process
+    initial_time = time.time()
+    mesh = create_mesh(label_volume, **params)
+    # The arrays are sent back with the result (a file-only mesh is read here, in the worker)
+    return mesh.load(), time.time() - initial_time
+
+def check_values(simply_val, smooth_val):
+    """
+    Validates the simplification and smoothing coefficients shared by every library.
+    """
+    if simply_val < 5 or simply_val > 100:
+        raise ValueError("simply_val must be between 5 and 100. simply_val = 100 creates a mesh with no simplification.")
+    if smooth_val < 0 or smooth_val > 10:
+        raise ValueError("smooth_val must be between 0 and 10. smooth_val = 0 creates a mesh with no smoothing.")
+
+def default_name(library, simply_val, smooth_val):
+    """
+    Creates the output file's name from the parameters, when no name is given.
+    """
+    mesh_name_parts = ["mesh", str(library)]
+    if simply_val < 100:
+        mesh_name_parts.append(f"simp={simply_val}")
+    if smooth_val > 0:
+        mesh_name_parts.append(f"smooth={smooth_val}")
+    return "_".join(mesh_name_parts)
+
+def create_mesh(
+        volume,
+        library     = "pymeshlab",
+        simplify    = "",
+        simply_val  = 100,
+        smoothing   = "",
+        smooth_val  = 0,
+        grid_scale  = None,
+        out_type    = "obj",
+        out_dir     = ".",
+        out_name    = "",
+        crop        = True,
+        cache_dir   = None,
+        cache_size  = 1024,
+        mc_workers  = None,
+        banner      = True):
+    """
+    Runs the chosen library on an already-loaded volume and returns the mesh (MeshResult).
+    (Parameters : see generate_from_nii)
+    """
+    
+    # The backend (and its libraries) is only imported now, on its first use
+    run_backend = get_backend(library)
+    if banner:
+        print(f"\n--------------------\n{library.upper():^20}\n--------------------\n")
+    return run_backend(
+        volume      = volume,
+        out_name    = out_name,
+        out_dir     = out_dir,
+        out_type    = out_type,
+        simplify    = simplify,
+        simply_val  = simply_val,
+        smoothing   = smoothing,
+        smooth_val  = smooth_val,
+        grid_scale  = grid_scale,
+        crop        = crop,
+        cache_dir   = cache_dir,
+        cache_size  = cache_size,
+        mc_workers  = mc_workers)
 
 
 """
@@ -209,9 +420,13 @@ ____LIBRARY = "pymeshlab"___
     --> The most useful one, but the simplification may be a bit too intense
         --> simply_val not needed
         
-"edqe" = Edge Decimation Quadratic Edge Collapse (~ USELESS)  
-    --> Empirically useless - mesh is not simplified - maybe it's useful for non-marching cubes meshes
-        --> simply_val not needed
+"qec"  = Quadric Edge Collapse (source/mesh_decimation.py, on the vertex / face arrays)
+    --> Collapses the cheapest edges first (quadric error), keeps the topology
+        --> simply_val = percentage of the faces kept (same meaning as nii2mesh's and VTK's simply_val)
+        --> example : simply_val = 20  # means 20% of the faces are kept
+
+"edqe" = Edge Decimation Quadratic Edge Collapse (pymeshlab)
+    --> simply_val = percentage of the faces kept (no simplification with simply_val = 100)
 
 "mdc"  = Meshing Decimation Clustering            
     --> Simplification is too intense, mesh loses its volume properties
@@ -229,13 +444,16 @@ ___ --> no simplification (RECOMMENDED)
         --> smooth_val = number of iterations
         --> example : smooth_val = 5 # means 5 iterations of smoothing
     
-"hc" = Laplacian Coordinate Smoothing - HC method (~ USELESS)  
-    --> Empirically useless - mesh is not smoothed - maybe it's useful for non-marching cubes meshes
-        --> smooth_val not needed
+"hc" = Laplacian Coordinate Smoothing - HC method
+    --> Smooths while pushing the vertices back towards their original place : keeps the volume
+        --> smooth_val = number of iterations
     
-"tau"  = Taubin Coordinate Smoothing (~ USELESS)      
-    --> Empirically useless - mesh is not smoothed - maybe it's useful for non-marching cubes meshes
-        --> smooth_val not needed
+"tau"  = Taubin Coordinate Smoothing (lambda = 0.5 / mu = -0.53)
+    --> Each iteration shrinks then inflates the mesh : keeps the volume
+        --> smooth_val = number of iterations
+
+--> The 3 methods run on the vertex arrays (source/mesh_smoothing.py) with a sparse (scipy) operator
+    built once per mesh : every iteration is one sparse matrix product, without copying the mesh into pymeshlab.
         
 ___ --> no smoothing 
 
@@ -245,17 +463,28 @@ ___ --> no smoothing
     --> The most understandable mesh format
     --> Present in every 3D software
     
-"stl" = Stereolithography
+"stl" = Stereolithography (binary)
     --> Very compressed (50% reduction)
     --> File is not understandable by an human
 
+"ply" = Polygon File Format (binary little-endian)
+    --> The smallest and fastest file to write and to read back
+
+"glb" = Binary glTF 2.0
+    --> Opened by web viewers and game engines (coordinates written as they are)
+
+--> "obj" / "stl" / "ply" / "glb" are written from the vertex / face arrays (source/mesh_writers.py) :
+    binary files straight from the NumPy buffers, OBJ text formatted by chunks (much faster than a per-face writer).
+    Any other type known by pymeshlab ("off", ...) is saved by pymeshlab.
+
 ----- GRID SCALE -----
 
-Default -> (0.55, 0.55, 0.55). 
+Default -> None : the voxel spacing (zooms) and the affine of the NIFTI header are used.
+    --> The mesh is in the world coordinates of the header, like nii2mesh's meshes (anisotropic scans are handled).
+Forced spacing -> (0.55, 0.55, 0.55) for example : the mesh stays in grid coordinates, scaled by grid_scale.
 Without normalization -> (1,1,1).
 
---> This parameter is only used in Pymeshlab
---> VTK and Nii2mesh libraries have their own way to get the normalization of the labelmap, so grid_scale is not needed.
+--> Used by Pymeshlab and VTK. Nii2mesh always reads the header.
 
 ____________________________
 ____LIBRARY = "nii2mesh"____
@@ -264,8 +493,8 @@ ____LIBRARY = "nii2mesh"____
 
 "(anything)" = Quadratic Mesh Simplification 
     --> The most popular simplification method
-        --> simply_val = percentage of simplification
-        --> example : simply_val = 5  # means 5% of simplification
+        --> simply_val = percentage of the faces kept (nii2mesh's -r option)
+        --> example : simply_val = 5  # means 5% of the faces are kept
 
 ""  --> no simplification 
         --> Quadratic Mesh Simplification has a pretty good 
@@ -282,11 +511,40 @@ ___ --> no smoothing
 
 ------- OUTPUT -------
 
-"obj" / "stl" / "ply" / "fbx"
+"obj" / "stl" / "ply" / "gii" / "mz3" / "off" / "vtk" / ... (written by nii2mesh)
+"glb" --> nii2mesh writes a .ply, converted from its arrays (source/mesh_writers.py)
+
+------- IN-PROCESS -------
+
+On Linux / Mac OS, nii2mesh runs in-process through its shared library (source/nii2mesh_lib.py, built once with "make lib"
+in source/nii2mesh/src, automatically on first use) : the voxels are given as a buffer and the mesh comes back as arrays,
+no NIFTI file or mesh file goes through the disk. Used for "obj" / "stl" / "ply" / "glb", the executable for the other types.
+
+------- PARALLEL JOBS -------
+
+The executable is started with an argument list (no shell) and writes into a temporary folder of its own inside out_dir :
+the finished file is moved under its final name without replacing another one ("<out_name>_1", ...), so nii2mesh jobs run
+in parallel like the other libraries (generate_labels_from_nii, generate_batch).
+A cohort can also be given to a pool of nii2mesh processes (source/nii2mesh_pool.py) :
+
+    from source.nii2mesh_pool import Nii2meshPool
+    with Nii2meshPool(workers=8, timeout=600) as pool:
+        for job, mesh in pool.map([dict(input_file=f, out_dir="output_files", out_name=nii_stem(f), smooth_val=5) for f in nii_files]):
+            print(job["input_file"], mesh)      # MeshResult, or the exception of a failed job (stderr of nii2mesh, timeout)
+
+workers = largest number of nii2mesh processes at the same time (default: number of CPUs), timeout = time limit of each job in seconds.
+
+------- STAGES -------
+
+nii2mesh smooths and simplifies inside its own run : its "marching_cubes" stage (see source/mesh_stages.py) covers the whole
+nii2mesh pipeline, and no "simplify" / "smooth" stage is recorded. With the executable, it also covers writing the mesh
+(no "write" stage), and the vertex / face counts are only known at the "metrics" stage, where the file is read.
+
 _________________________
 _____LIBRARY = "vtk"_____
 
---> This library has not been completely researched, so library-specific parameters are unused
---> Only exports to ".obj"
+--> This library has not been completely researched, so most library-specific parameters are unused
+--> simply_val < 100 decimates the mesh (vtkQuadricDecimation) : simply_val = percentage of the faces kept
+--> Exports to "obj" / "stl" / "ply" / "glb", from the arrays (source/mesh_writers.py)
 
 """
\ No newline at end of file
@@ -0,0 +1,407 @@
+"""
+Authors: Sacha Cruz, Mario Espinoza
+________________________________
+|                              |
+|   NIFTI -> MESH GENERATION   |
+|             ---              |
+|      serve_mesh_gen.py       |
+|______________________________|
+
+Job queue for services that mesh label-maps as they are produced : jobs are submitted to a local HTTP server
+(TCP port or Unix socket), queued, run on a bounded number of worker processes, and their results are fetched later.
+Nothing blocks the caller, nothing is printed on its console and no window is opened (visualize is always False).
+
+    POST   /jobs                JSON parameters of generate_from_nii ("nii_dir" required)   --> 202 {"id", "status"}
+                                (503 + Retry-After when the queue is full : the client retries later)
+    GET    /jobs                Queue state (counts of queued / running / finished jobs)
+    GET    /jobs/<id>           Status of a job : queued / running / done / error / cancelled
+    GET    /jobs/<id>/result    Mesh path and metrics of a finished job (409 while it is queued or running)
+    DELETE /jobs/<id>           Cancels a job (a running job's process is stopped)
+
+Usage (CLI):
+    python serve_mesh_gen.py -o output_files --port 8765 --workers 4 --queue-size 200
+    python serve_mesh_gen.py -o output_files --socket /tmp/mesh_gen.sock
+    curl -X POST localhost:8765/jobs -d '{"nii_dir": "input_files/sartorius.nii.gz", "smoothing": "lap", "smooth_val": 5}'
+    curl localhost:8765/jobs/1/result
+
+Usage (Python, inside an asyncio program, without HTTP):
+    from serve_mesh_gen import MeshJobQueue
+    queue = MeshJobQueue(out_dir="output_files", workers=4)
+    await queue.start()
+    job_id = queue.submit({"nii_dir": "input_files/sartorius.nii.gz"})
+    row = await queue.wait(job_id)
+
+    /!\ Start the asyncio program under a 'if __name__ == "__main__":' block, on every OS : the job processes come from
+        a server process (forkserver, spawn on Windows) that imports the main module again.
+
+Each job runs in a process of its own (started from a process preloaded with the libraries on Linux / Mac OS), so a job
+can be cancelled while it runs and a crash only fails its own job.
+"""
+
+from os import makedirs, path, remove
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import asyncio
+import inspect
+import itertools
+import json
+import multiprocessing
+import re
+import sys
+import time
+
+from batch_mesh_gen import _init_worker, _run_file, nii_stem
+from nii_mesh_gen import generate_from_nii, default_name
+from source.worker_threads import single_threaded
+
+# Parameters a job can't choose : the queue decides where the meshes go (and where the cache is), the threads of a job,
+# and never opens a window
+# (the stages of a job come back in its result, not in a file or a callback of the server)
+SERVER_PARAMS = ("visualize", "out_dir", "cache_dir", "distance_workers", "stages_file", "on_stage")
+JOB_PARAMS = [name for name in inspect.signature(generate_from_nii).parameters if name not in SERVER_PARAMS]
+
+FINISHED = ("done", "error", "cancelled")
+
+# Imported once by the server process the jobs are forked from (Linux / Mac OS). nii_mesh_gen loads its libraries on first use
+# (source/backends.py), so the backend modules and their libraries are listed themselves (the missing ones are skipped)
+FORKSERVER_PRELOAD = [
+    "nii_mesh_gen", "numpy", "nibabel", "scipy.sparse", "skimage.measure._marching_cubes_lewiner", "pymeshlab", "vtk",
+    "source.mesh_gen_python", "source.mesh_gen_c", "source.nii2mesh_lib", "source.mesh_smoothing", "source.mesh_decimation",
+    "source.mesh_metrics", "source.mesh_writers"]
+
+class QueueFull(Exception):
+    """
+    Raised by MeshJobQueue.submit when the queue already holds max_queue jobs.
+    """
+
+class MeshJob:
+    """
+    One submitted mesh generation and its state.
+    """
+
+    def __init__(self, job_id, params):
+        self.id         = job_id
+        self.params     = params
+        self.status     = "queued"
+        self.submitted  = time.time()
+        self.started    = None
+        self.finished   = None
+        self.row        = None
+        self.process    = None
+        self.done       = asyncio.Event()
+
+    def state(self):
+        return dict(
+            id          = self.id,
+            status      = self.status,
+            input       = self.params["nii_dir"],
+            submitted   = self.submitted,
+            started     = self.started,
+            finished    = self.finished)
+
+class MeshJobQueue:
+    """
+    Bounded queue of mesh generations, run on "workers" processes at most.
+    Args:
+        out_dir     (str, optional):    Output folder of every mesh.
+        workers     (int, optional):    Largest number of jobs running at the same time. Defaults to the number of CPUs.
+        max_queue   (int, optional):    Largest number of jobs waiting. submit raises QueueFull beyond it (backpressure).
+        timeout     (float, optional):  Time limit of a job in seconds (its process is stopped). Defaults to None.
+        keep        (int, optional):    Number of finished jobs whose results are kept (the oldest are forgotten first).
+    """
+
+    def __init__(self, out_dir=".", workers=None, max_queue=100, timeout=None, keep=1000):
+        self.out_dir    = out_dir
+        self.workers    = workers or multiprocessing.cpu_count()
+        self.max_queue  = max_queue
+        self.timeout    = timeout
+        self.keep       = keep
+        self.jobs       = {}
+        self._ids       = itertools.count(1)
+        self._waiting   = 0
+        self._queue     = None
+        self._tasks     = []
+        self._context   = None
+        self._threads   = None
+
+    async def start(self):
+        """
+        Starts the workers. Must be called from the running event loop.
+        """
+        makedirs(self.out_dir, exist_ok=True)
+        # Unbounded : the backpressure counts the waiting jobs, so a cancelled job frees its place at once
+        self._queue = asyncio.Queue()
+        if sys.platform == "win32":
+            self._context = multiprocessing.get_context("spawn")
+        else:
+            # Every job process is forked from a server process that has already imported the libraries
+            self._context = multiprocessing.get_context("forkserver")
+            self._context.set_forkserver_preload(FORKSERVER_PRELOAD)
+        # One thread per worker waits for the result of its job process
+        self._threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="mesh_job")
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        Cancels every queued and running job and stops the workers.
+        """
+        for job in list(self.jobs.values()):
+            self.cancel(job.id)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._threads.shutdown(wait=False)
+
+    def submit(self, params):
+        """
+        Queues a job. "params" are parameters of generate_from_nii ("nii_dir" required, none of SERVER_PARAMS).
+        "out_name" is reduced to a plain file name : the mesh is always written in out_dir.
+        Returns the id of the job. Raises ValueError (wrong parameters) or QueueFull.
+        """
+        params = dict(params)
+        if "nii_dir" not in params:
+            raise ValueError("nii_dir is required")
+        unknown = [name for name in params if name not in JOB_PARAMS]
+        if unknown:
+            raise ValueError(f"Unknown parameters : {unknown} (available : {JOB_PARAMS})")
+        if "out_name" in params:
+            params["out_name"] = safe_name(params["out_name"])
+        if self._waiting >= self.max_queue:
+            raise QueueFull(f"{self._waiting} jobs are already waiting")
+        job = MeshJob(next(self._ids), params)
+        self._queue.put_nowait(job)
+        self._waiting += 1
+        self.jobs[job.id] = job
+        self._forget()
+        return job.id
+
+    def status(self, job_id):
+        """
+        State of a job (id, status, input, times). Raises KeyError for an unknown job.
+        """
+        return self.jobs[job_id].state()
+
+    def result(self, job_id):
+        """
+        Row of a finished job (mesh path and metrics, or error), or None while it is queued or running.
+        """
+        job = self.jobs[job_id]
+        return {**job.row, **job.state()} if job.status in FINISHED else None
+
+    async def wait(self, job_id):
+        """
+        Waits for a job to finish and returns its result.
+        """
+        await self.jobs[job_id].done.wait()
+        return self.result(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancels a job : a queued job is skipped, a running job's process is stopped. Returns False if it had already finished.
+        """
+        job = self.jobs[job_id]
+        if job.status in FINISHED:
+            return False
+        if job.status == "queued":
+            # Its entry stays in the queue, but is skipped by the workers
+            self._waiting -= 1
+        if job.status == "running" and job.process is not None:
+            job.process.terminate()
+        self._finish(job, "cancelled", dict(status="cancelled"))
+        return True
+
+    def summary(self):
+        """
+        Counts of the jobs per status, and the limits of the queue.
+        """
+        counts = {status: 0 for status in ("queued", "running") + FINISHED}
+        for job in self.jobs.values():
+            counts[job.status] += 1
+        return dict(counts, workers=self.workers, max_queue=self.max_queue)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            try:
+                # A cancelled job is skipped without being run
+                if job.status == "queued":
+                    self._waiting -= 1
+                    await self._run(loop, job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, loop, job):
+        params = dict(job.params)
+        nii_dir = params.pop("nii_dir")
+        out_name = params.pop("out_name", "") or f"{nii_stem(str(nii_dir))}_{default_name(params.get('library', 'pymeshlab'), params.get('simply_val', 100), params.get('smooth_val', 0))}"
+        receiver, sender = self._context.Pipe(duplex=False)
+        job.process = self._context.Process(target=_run_job, args=(sender, nii_dir, self.out_dir, out_name, params), daemon=True)
+        job.status, job.started = "running", time.time()
+        # The job process (and the fork server, started with the first job) loads the libraries with the thread
+        # variables set (see source/worker_threads.py)
+        with single_threaded():
+            job.process.start()
+        sender.close()
+        try:
+            # The pipe is read in a thread : the event loop keeps serving the other requests
+            row = await asyncio.wait_for(loop.run_in_executor(self._threads, _receive, receiver), self.timeout)
+        except asyncio.TimeoutError:
+            job.process.terminate()
+            row = dict(status="error", error=f"Timeout after {self.timeout} s")
+        finally:
+            receiver.close()
+            await loop.run_in_executor(self._threads, job.process.join)
+        if job.status == "running":
+            if row is None:
+                row = dict(status="error", error=f"Worker process ended with code {job.process.exitcode}")
+            self._finish(job, "done" if row["status"] == "ok" else "error", row)
+        job.process = None
+
+    def _finish(self, job, status, row):
+        job.status, job.row, job.finished = status, row, time.time()
+        job.done.set()
+
+    def _forget(self):
+        finished = [job for job in self.jobs.values() if job.status in FINISHED]
+        for job in finished[:max(0, len(finished) - self.keep)]:
+            del self.jobs[job.id]
+
+def safe_name(out_name):
+    """
+    Plain file name from a client's "out_name" : no folder, no ".." (the characters other than letters, digits, "-", "_", "."
+    and "=" are replaced by "_"). An empty result gives the default name.
+    """
+    name = re.split(r"[\\/]", str(out_name))[-1]
+    name = re.sub(r"[^\w.=-]", "_", name).lstrip(".")
+    return name
+
+def _run_job(sender, nii_dir, out_dir, out_name, params):
+    # Runs in the job process : the row (mesh path and metrics, or error) goes back through the pipe
+    _init_worker()
+    sender.send(_run_file(nii_dir, out_dir, out_name, False, params))
+    sender.close()
+
+def _receive(receiver):
+    # None if the process ended without sending (cancelled, crashed)
+    try:
+        return receiver.recv()
+    except (EOFError, OSError):
+        return None
+
+# ------------------------------
+# HTTP SERVER
+# ------------------------------
+
+REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 503: "Service Unavailable"}
+MAX_BODY = 1 << 20
+
+async def handle_request(queue, reader, writer):
+    """
+    Serves one HTTP/1.1 request (JSON in, JSON out) on the job queue.
+    """
+    headers = {}
+    try:
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            if len(request_line) < 2:
+                raise ValueError("Malformed request line")
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY:
+                code, answer = 413, dict(error="Request too large")
+            else:
+                body = await reader.readexactly(length) if length else b""
+                code, answer = route(queue, request_line[0], request_line[1], body)
+        except (ValueError, IndexError, asyncio.IncompleteReadError):
+            code, answer = 400, dict(error="Malformed request")
+        data = json.dumps(answer, default=str).encode()
+        extra = "Retry-After: 5\r\n" if code == 503 else ""
+        writer.write(f"HTTP/1.1 {code} {REASONS[code]}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                     f"{extra}Connection: close\r\n\r\n".encode() + data)
+        await writer.drain()
+    finally:
+        writer.close()
+
+def route(queue, method, target, body=b""):
+    """
+    Answers a request : returns (HTTP code, JSON answer).
+    """
+    parts = [part for part in target.split("?")[0].split("/") if part]
+    if not parts or parts[0] != "jobs" or len(parts) > 3:
+        return 404, dict(error="Unknown path")
+    if len(parts) == 1:
+        if method == "GET":
+            return 200, queue.summary()
+        if method != "POST":
+            return 405, dict(error="Use GET or POST on /jobs")
+        try:
+            job_id = queue.submit(json.loads(body or b"{}"))
+        except QueueFull as e:
+            return 503, dict(error=str(e))
+        except (ValueError, TypeError) as e:
+            return 400, dict(error=str(e))
+        return 202, queue.status(job_id)
+    try:
+        job_id = int(parts[1])
+        queue.status(job_id)
+    except (ValueError, KeyError):
+        return 404, dict(error="Unknown job")
+    if len(parts) == 3:
+        if parts[2] != "result" or method != "GET":
+            return 404, dict(error="Unknown path")
+        result = queue.result(job_id)
+        return (409, queue.status(job_id)) if result is None else (200, result)
+    if method == "GET":
+        return 200, queue.status(job_id)
+    if method == "DELETE":
+        queue.cancel(job_id)
+        return 200, queue.status(job_id)
+    return 405, dict(error="Use GET or DELETE on /jobs/<id>")
+
+async def serve(out_dir=".", host="127.0.0.1", port=8765, socket_path=None, workers=None, max_queue=100, timeout=None):
+    """
+    Runs the job queue behind a local HTTP server (TCP host:port, or the Unix socket socket_path) until it is stopped.
+    """
+    queue = MeshJobQueue(out_dir=out_dir, workers=workers, max_queue=max_queue, timeout=timeout)
+    await queue.start()
+    handler = lambda reader, writer: handle_request(queue, reader, writer)
+    if socket_path is not None:
+        if path.exists(socket_path):
+            remove(socket_path)
+        server = await asyncio.start_unix_server(handler, path=socket_path)
+        print(f"Mesh job queue listening on {socket_path} ({queue.workers} workers)")
+    else:
+        server = await asyncio.start_server(handler, host, port)
+        print(f"Mesh job queue listening on http://{host}:{port} ({queue.workers} workers)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await queue.stop()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serves a queue of mesh generation jobs over local HTTP.")
+    parser.add_argument("-o", "--out-dir", default=".", help="output folder of the meshes")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("-p", "--port", type=int, default=8765, help="TCP port")
+    parser.add_argument("--socket", default=None, help="Unix socket to listen on instead of a TCP port")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="largest number of running jobs (default: number of CPUs)")
+    parser.add_argument("-q", "--queue-size", type=int, default=100, help="largest number of waiting jobs")
+    parser.add_argument("-t", "--timeout", type=float, default=None, help="time limit of a job in seconds")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.out_dir, args.host, args.port, args.socket, args.workers, args.queue_size, args.timeout))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
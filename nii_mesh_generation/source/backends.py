@@ -0,0 +1,144 @@
+# backends.py
+
+"""
+Registry of the mesh generation libraries ("backends") of generate_from_nii.
+
+A backend is registered by name with the modules it needs and a runner : nothing is imported when it is registered,
+its modules are only imported the first time it is used. available_backends tells which backends can run on this
+machine without importing them (the modules are only looked up).
+
+A new engine is added with register_backend : its runner receives the loaded volume and the options of generate_from_nii
+(out_name, out_dir, out_type, simplify, simply_val, smoothing, smooth_val, grid_scale, crop, cache_dir, cache_size, mc_workers)
+and returns a MeshResult.
+
+    register_backend("my_engine", "source.my_engine:run_my_engine", requires=("my_engine_lib",))
+    generate_from_nii("label.nii.gz", library="my_engine")
+"""
+
+from os import path
+import importlib
+import importlib.util
+import shutil
+import sys
+
+NII2MESH_PATH = path.join(path.dirname(path.abspath(__file__)), "nii2mesh", "src")
+
+class Backend:
+    """
+    A registered backend.
+    Attributes:
+        name        (str):      Name given to generate_from_nii (library = name).
+        runner      (str):      "module:function" of the runner, imported on first use (or the function itself).
+        requires    (tuple):    Top-level modules the backend imports (looked up by available_backends, not imported).
+        check       (callable): Extra availability test (no argument, returns a bool), for engines that are not Python modules.
+    """
+
+    def __init__(self, name, runner, requires=(), check=None):
+        self.name       = name
+        self.runner     = runner
+        self.requires   = tuple(requires)
+        self.check      = check
+
+    def available(self):
+        """
+        True if the modules of the backend are installed (and its extra test passes). Nothing is imported.
+        """
+        if any(importlib.util.find_spec(module) is None for module in self.requires):
+            return False
+        return self.check is None or bool(self.check())
+
+    def load(self):
+        """
+        Imports the runner (once) and returns it.
+        """
+        if isinstance(self.runner, str):
+            module, function = self.runner.split(":")
+            self.runner = getattr(importlib.import_module(module), function)
+        return self.runner
+
+    def __repr__(self):
+        return f"Backend({self.name!r}, requires={self.requires})"
+
+BACKENDS = {}
+
+def register_backend(name, runner, requires=(), check=None):
+    """
+    Registers (or replaces) a backend. "runner" is a "module:function" string (imported on first use) or a function.
+    """
+    BACKENDS[name] = Backend(name, runner, requires, check)
+    return BACKENDS[name]
+
+def get_backend(name):
+    """
+    Returns the runner of a backend, importing its modules if it is the first use.
+    Raises ValueError for an unknown name.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Wrong Library Name : {name} (available : {', '.join(BACKENDS)})")
+    return BACKENDS[name].load()
+
+def available_backends():
+    """
+    Availability of every registered backend ({name: bool}), found without importing them.
+    """
+    return {name: backend.available() for name, backend in BACKENDS.items()}
+
+# ------------------------------
+# BUILT-IN BACKENDS
+# ------------------------------
+
+def run_pymeshlab(volume, out_name, out_dir, out_type, simplify="", simply_val=100, smoothing="", smooth_val=0,
+                  grid_scale=None, crop=True, cache_dir=None, cache_size=1024, mc_workers=None):
+    from source.mesh_gen_python import mesh_gen_pylab
+    return mesh_gen_pylab(
+        input_file = volume,
+        out_name = out_name,
+        out_dir = out_dir,
+        out_type = out_type,
+        simplify = simplify,
+        simply_val = simply_val,
+        smoothing = smoothing,
+        smooth_val = smooth_val,
+        grid_scale = grid_scale,
+        crop = crop,
+        cache_dir = cache_dir,
+        cache_size = cache_size,
+        mc_workers = mc_workers)
+
+def run_nii2mesh(volume, out_name, out_dir, out_type, simplify="", simply_val=100, smoothing="", smooth_val=0,
+                 grid_scale=None, crop=True, cache_dir=None, cache_size=1024, mc_workers=None):
+    from source.mesh_gen_c import mesh_gen_nii2mesh
+    return mesh_gen_nii2mesh(
+        nii2mesh_path = NII2MESH_PATH,
+        input_file = volume,
+        out_name = out_name,
+        out_dir = out_dir,
+        out_type = out_type,
+        simply_val = simply_val,
+        smooth_val = smooth_val,
+        crop = crop)
+
+def run_vtk(volume, out_name, out_dir, out_type, simplify="", simply_val=100, smoothing="", smooth_val=0,
+            grid_scale=None, crop=True, cache_dir=None, cache_size=1024, mc_workers=None):
+    from source.mesh_gen_python import mesh_gen_vtk
+    return mesh_gen_vtk(
+        input_file = volume,
+        out_name = out_name,
+        out_dir = out_dir,
+        crop = crop,
+        grid_scale = grid_scale,
+        simply_val = simply_val,
+        out_type = out_type)
+
+def nii2mesh_available():
+    """
+    True if nii2mesh can run : its shared library or executable is there, or the library can be built (make and a C compiler).
+    """
+    names = ("libnii2mesh.so", "nii2mesh", "nii2mesh.exe")
+    if any(path.isfile(path.join(NII2MESH_PATH, name)) for name in names) or shutil.which("nii2mesh"):
+        return True
+    return sys.platform != "win32" and shutil.which("make") is not None and shutil.which("cc") is not None
+
+register_backend("pymeshlab", run_pymeshlab, requires=("numpy", "nibabel", "skimage", "pymeshlab"))
+register_backend("nii2mesh", run_nii2mesh, requires=("numpy", "nibabel"), check=nii2mesh_available)
+register_backend("vtk", run_vtk, requires=("numpy", "nibabel", "vtk"))
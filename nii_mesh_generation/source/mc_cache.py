@@ -0,0 +1,88 @@
+# mc_cache.py
+
+from os import makedirs, path, listdir, replace, remove, utime, getpid
+import hashlib
+import re
+
+CACHE_EXTENSION = ".npz"
+# Entries are named "mc_<key>.npz" : eviction only touches these files, never other .npz files of the folder
+CACHE_PREFIX = "mc_"
+ENTRY_NAME = re.compile(re.escape(CACHE_PREFIX) + r"[0-9a-f]{40}" + re.escape(CACHE_EXTENSION) + "$")
+# Changed when the meaning of the stored arrays changes (2 : vertices before the crop offset / affine)
+CACHE_VERSION = 2
+
+def cache_key(volume, level, spacing, crop):
+    """
+    Key of a marching cubes result : hash of the voxel data (after the crop) and of the marching cubes parameters.
+    Args:
+        volume (NiiVolume): Volume given to the marching cubes (already cropped if crop is true).
+        level (float): Iso-value of the marching cubes.
+        spacing (tuple): Voxel spacing given to the marching cubes.
+        crop (bool): Whether the volume was cropped.
+    """
+    from numpy import ascontiguousarray
+    array = ascontiguousarray(volume.array)
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr((CACHE_VERSION, str(array.dtype), array.shape, volume.offset, float(level),
+                        tuple(float(s) for s in spacing), bool(crop))).encode())
+    digest.update(memoryview(array).cast("B"))
+    return digest.hexdigest()
+
+def entry_path(cache_dir, key):
+    """
+    File of the entry of a key in the cache folder.
+    """
+    return path.join(cache_dir, CACHE_PREFIX + key + CACHE_EXTENSION)
+
+def load_cached(cache_dir, key):
+    """
+    Returns the cached (verts, faces) arrays of a key, or None if they are not in the cache.
+    """
+    import numpy as np
+    file = entry_path(cache_dir, key)
+    try:
+        with np.load(file) as data:
+            verts, faces = data["verts"], data["faces"]
+    except (FileNotFoundError, OSError, KeyError, ValueError):
+        return None
+    # Least recently used : a hit makes the entry young again
+    utime(file)
+    return verts, faces
+
+def save_cached(cache_dir, key, verts, faces, max_size=1024):
+    """
+    Stores the (verts, faces) arrays of a key (uncompressed .npz), then evicts the least recently used entries
+    until the cache is smaller than "max_size" MB.
+    """
+    import numpy as np
+    makedirs(cache_dir, exist_ok=True)
+    file = entry_path(cache_dir, key)
+    # Written under a temporary name, then renamed : parallel runs never read a half-written entry
+    tmp_file = path.join(cache_dir, f"{CACHE_PREFIX}{key}.{getpid()}.tmp")
+    with open(tmp_file, "wb") as out:
+        np.savez(out, verts=verts, faces=faces)
+    replace(tmp_file, file)
+    evict(cache_dir, max_size)
+
+def evict(cache_dir, max_size):
+    """
+    Removes the least recently used entries of the cache until it is smaller than "max_size" MB.
+    Only the cache entries count ("mc_<key>.npz") : the other files of the folder are neither counted nor removed.
+    """
+    entries = []
+    for name in listdir(cache_dir):
+        if ENTRY_NAME.match(name):
+            file = path.join(cache_dir, name)
+            try:
+                entries.append((path.getmtime(file), path.getsize(file), file))
+            except FileNotFoundError:
+                pass
+    total = sum(size for _, size, _ in entries)
+    for _, size, file in sorted(entries):
+        if total <= max_size * 1024 * 1024:
+            break
+        try:
+            remove(file)
+        except FileNotFoundError:
+            pass
+        total -= size
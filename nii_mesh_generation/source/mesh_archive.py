@@ -0,0 +1,353 @@
+# mesh_archive.py
+
+"""
+Compact mesh archive (.nma) : many meshes (the variants of a sweep, the labels of a scan, ...) in one file.
+
+Each mesh is encoded on its own :
+    - the vertices are renumbered in the order the faces use them, and the faces are sorted,
+      so the indices of neighbouring faces are close to each other,
+    - the vertex coordinates are quantized to "bits" bits per axis inside the bounding box of the mesh
+      (largest error : half a quantization step, stored in the index),
+    - the quantized vertices and the face indices are delta-encoded, then written as varints (7 bits per byte),
+    - the result is compressed with zstd if the "zstandard" package is installed, zlib otherwise (see default_codec).
+The reader decodes straight into NumPy arrays (no text parsing). The decoded mesh has the same faces, with
+the vertices in another order.
+
+Layout of the file :
+    b"NIIMESHA" + version (uint32), then the encoded meshes one after the other,
+    then the index (JSON : name -> offset, size, counts, bounding box, bits, codec, metadata),
+    then the offset of the index (uint64) and b"NMAINDEX".
+An archive opened to add meshes is changed in a temporary copy, renamed over the archive by close() :
+an interrupted run leaves the archive as it was (and a "<archive>.<pid>.tmp" file to delete).
+"""
+
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b"NIIMESHA"
+FOOTER = b"NMAINDEX"
+VERSION = 1
+CODECS = ("zlib", "zstd", "none")
+
+def default_codec():
+    """
+    "zstd" if the zstandard package is installed, "zlib" otherwise.
+    """
+    import importlib.util
+    return "zstd" if importlib.util.find_spec("zstandard") is not None else "zlib"
+
+# ------------------------------------------------------------------------------
+#   VARINTS
+# ------------------------------------------------------------------------------
+
+def zigzag(values):
+    """
+    Signed -> unsigned integers (0, -1, 1, -2, ... -> 0, 1, 2, 3, ...), so small values stay small.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+def unzigzag(values):
+    values = np.asarray(values, dtype=np.uint64)
+    return (values >> np.uint64(1)).view(np.int64) ^ -(values & np.uint64(1)).view(np.int64)
+
+def varint_encode(values):
+    """
+    Writes unsigned integers as varints : 7 bits per byte, the high bit set on every byte but the last one.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while np.any(rest):
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    out = np.empty(int(ends[-1]) if len(values) else 0, dtype=np.uint8)
+    for k in range(int(lengths.max()) if len(values) else 0):
+        index = np.flatnonzero(lengths > k)
+        byte = (values[index] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (lengths[index] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[index] + k] = byte | more
+    return out.tobytes()
+
+def varint_decode(data, count):
+    """
+    Reads "count" varints from the start of a buffer. Returns the uint64 array and the number of bytes read.
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(data < 0x80)[:count] + 1
+    if len(ends) < count:
+        raise ValueError("Truncated varint stream")
+    starts = np.concatenate(([0], ends[:-1]))
+    lengths = ends - starts
+    values = np.zeros(count, dtype=np.uint64)
+    for k in range(int(lengths.max()) if count else 0):
+        index = np.flatnonzero(lengths > k)
+        values[index] |= (data[starts[index] + k] & 0x7F).astype(np.uint64) << np.uint64(7 * k)
+    return values, int(ends[-1]) if count else 0
+
+# ------------------------------------------------------------------------------
+#   MESH ENCODING
+# ------------------------------------------------------------------------------
+
+def reorder_mesh(verts, faces):
+    """
+    Renumbers the vertices in the order the faces use them (unused vertices last), rotates every face so that
+    its smallest index comes first (same orientation), and sorts the faces.
+    """
+    faces = np.asarray(faces, dtype=np.int64)
+    vertex_number = len(verts)
+    order = np.full(vertex_number, -1, dtype=np.int64)
+    flat = faces.ravel()
+    first_use = np.unique(flat, return_index=True)[1]
+    used = flat[np.sort(first_use)]
+    order[used] = np.arange(len(used))
+    unused = np.flatnonzero(order < 0)
+    order[unused] = len(used) + np.arange(len(unused))
+    new_verts = np.empty_like(np.asarray(verts))
+    new_verts[order] = verts
+    faces = order[faces]
+    shift = faces.argmin(axis=1)
+    faces = np.take_along_axis(faces, (shift[:, None] + np.arange(3)) % 3, axis=1)
+    faces = faces[np.lexsort(faces.T[::-1])]
+    return new_verts, faces
+
+def _compress(data, codec, level):
+    if codec == "zlib":
+        import zlib
+        return zlib.compress(data, level)
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return data
+
+def _decompress(data, codec):
+    if codec == "zlib":
+        import zlib
+        return zlib.decompress(data)
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+def encode_mesh(verts, faces, bits=16, codec=None, level=6):
+    """
+    Encodes a mesh (see the top of this file).
+    Args:
+        bits (int, optional): Quantization bits per axis (1 to 32). 16 bits keep the vertices of a 300 mm mesh within 0.003 mm.
+        codec (str, optional): "zlib", "zstd" (needs the zstandard package) or "none". Defaults to default_codec().
+        level (int, optional): Compression level.
+    Returns:
+        (bytes, dict): The encoded mesh and its header (counts, bounding box, bits, codec, largest error).
+    """
+    if not 1 <= bits <= 32:
+        raise ValueError("bits must be between 1 and 32")
+    if codec is None:
+        codec = default_codec()
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec : {codec} (available : {', '.join(CODECS)})")
+    verts, faces = reorder_mesh(np.asarray(verts, dtype=np.float64), faces)
+    low = verts.min(axis=0) if len(verts) else np.zeros(3)
+    high = verts.max(axis=0) if len(verts) else np.zeros(3)
+    steps = (1 << bits) - 1
+    scale = np.where(high > low, (high - low) / steps, 1.0)
+    quantized = np.rint((verts - low) / scale).astype(np.int64)
+
+    # Delta streams : vertices along the renumbered order, first corners along the sorted faces,
+    # the 2 other corners relative to the first one
+    vertex_deltas = np.diff(quantized, axis=0, prepend=np.zeros((1, 3), dtype=np.int64))
+    first_deltas = np.diff(faces[:, 0], prepend=0)
+    others = faces[:, 1:] - faces[:, :1]
+    payload = (varint_encode(zigzag(vertex_deltas.ravel()))
+               + varint_encode(first_deltas.astype(np.uint64))
+               + varint_encode(zigzag(others.ravel())))
+    header = dict(
+        vertices    = len(verts),
+        faces       = len(faces),
+        bits        = bits,
+        codec       = codec,
+        low         = low.tolist(),
+        scale       = scale.tolist(),
+        max_error   = float(np.max(scale) / 2) if len(verts) else 0.0)
+    return _compress(payload, codec, level), header
+
+def decode_mesh(data, header):
+    """
+    Decodes a mesh encoded by encode_mesh. Returns the (verts, faces) arrays (float64, int64).
+    """
+    payload = _decompress(data, header["codec"])
+    vertex_number, face_number = header["vertices"], header["faces"]
+    vertex_deltas, used = varint_decode(payload, 3 * vertex_number)
+    first_deltas, size = varint_decode(payload[used:], face_number)
+    used += size
+    others, _ = varint_decode(payload[used:], 2 * face_number)
+    quantized = np.cumsum(unzigzag(vertex_deltas).reshape(-1, 3), axis=0)
+    verts = quantized * np.asarray(header["scale"]) + np.asarray(header["low"])
+    first = np.cumsum(first_deltas.view(np.int64))
+    faces = np.empty((face_number, 3), dtype=np.int64)
+    faces[:, 0] = first
+    faces[:, 1:] = unzigzag(others).reshape(-1, 2) + first[:, None]
+    return verts, faces
+
+# ------------------------------------------------------------------------------
+#   ARCHIVE
+# ------------------------------------------------------------------------------
+
+class MeshArchive:
+    """
+    Archive of encoded meshes, read or extended (in a temporary copy, see the top of this file). Use it as a context manager :
+
+        with MeshArchive("sweep.nma", "a") as archive:
+            archive.add("edmc_lap5", verts, faces, simplify="edmc", smooth_val=5)
+        with MeshArchive("sweep.nma") as archive:
+            verts, faces = archive.read("edmc_lap5")
+
+    Args:
+        file (str): Location of the archive.
+        mode (str, optional): "r" (read), "a" (read and add, created if missing) or "w" (new archive).
+    """
+
+    def __init__(self, file, mode="r"):
+        from os import path, getpid, remove
+        import shutil
+        if mode not in ("r", "a", "w"):
+            raise ValueError("mode must be 'r', 'a' or 'w'")
+        self.file = file
+        self.mode = mode
+        self.index = {}
+        self._tmp_file = None
+        if mode == "r":
+            self._handle = open(file, "rb")
+            self._read_index()
+            self._changed = False
+            return
+        # The changes go to a temporary copy : the archive itself is only replaced by close()
+        self._tmp_file = f"{file}.{getpid()}.tmp"
+        if mode == "a" and path.isfile(file):
+            shutil.copyfile(file, self._tmp_file)
+            self._handle = open(self._tmp_file, "r+b")
+            try:
+                self._read_index()
+            except ValueError:
+                self._handle.close()
+                remove(self._tmp_file)
+                raise
+            self._changed = False
+        else:
+            self._handle = open(self._tmp_file, "w+b")
+            self._handle.write(MAGIC + struct.pack("<I", VERSION))
+            self._end = self._handle.tell()
+            self._changed = True
+
+    def _read_index(self):
+        handle = self._handle
+        if handle.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{self.file} is not a mesh archive")
+        index_end = handle.seek(-16, 2)
+        index_offset, footer = struct.unpack("<Q8s", handle.read(16))
+        if footer != FOOTER:
+            raise ValueError(f"{self.file} has no index (incomplete archive)")
+        handle.seek(index_offset)
+        self.index = json.loads(handle.read(index_end - index_offset).decode("utf-8"))
+        self._end = index_offset
+
+    def names(self):
+        return list(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def info(self, name):
+        """
+        Header and metadata of a mesh (counts, bounding box, bits, codec, largest error, encoded size, ...).
+        """
+        return dict(self.index[name])
+
+    def add(self, name, verts, faces, bits=16, codec=None, level=6, **metadata):
+        """
+        Encodes a mesh and appends it to the archive. "metadata" (JSON values) is kept in the index.
+        """
+        data, header = encode_mesh(verts, faces, bits, codec, level)
+        return self.add_encoded(name, data, header, **metadata)
+
+    def add_encoded(self, name, data, header, **metadata):
+        """
+        Appends a mesh already encoded by encode_mesh (in a worker process, for example).
+        """
+        if self.mode == "r":
+            raise ValueError("The archive is open in read mode")
+        if name in self.index:
+            raise ValueError(f"{name} is already in the archive")
+        self._handle.seek(self._end)
+        self._handle.write(data)
+        self.index[name] = dict(header, offset=self._end, size=len(data), **metadata)
+        self._end += len(data)
+        self._changed = True
+        return self.index[name]
+
+    def read(self, name):
+        """
+        Decodes a mesh of the archive. Returns the (verts, faces) arrays.
+        """
+        entry = self.index[name]
+        self._handle.seek(entry["offset"])
+        return decode_mesh(self._handle.read(entry["size"]), entry)
+
+    def close(self):
+        """
+        Writes the index and replaces the archive by the temporary copy (if meshes were added).
+        The meshes added before an exception are kept : only complete meshes are in the index.
+        """
+        from os import remove, replace
+        if self._handle.closed:
+            return
+        try:
+            if self._changed:
+                # The index goes after the last mesh (over the previous index, in the copy)
+                handle = self._handle
+                handle.seek(self._end)
+                handle.write(json.dumps(self.index).encode("utf-8"))
+                handle.write(struct.pack("<Q8s", self._end, FOOTER))
+                handle.truncate()
+            self._handle.close()
+            if self._tmp_file is not None:
+                if self._changed:
+                    replace(self._tmp_file, self.file)
+                else:
+                    remove(self._tmp_file)
+        except BaseException:
+            # The archive stays as it was
+            self._handle.close()
+            if self._tmp_file is not None:
+                remove(self._tmp_file)
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        return f"MeshArchive({self.file!r}, {len(self.index)} meshes)"
+
+def pack_meshes(mesh_files, out_file, bits=16, codec=None, level=6):
+    """
+    Stores existing mesh files (any type pymeshlab reads) in an archive, each one under its file name without extension.
+    Returns the index of the archive.
+    """
+    from os import path
+    from source.mesh_result import MeshResult
+    with MeshArchive(out_file, "a") as archive:
+        for mesh_file in mesh_files:
+            mesh = MeshResult(mesh_path=mesh_file).load()
+            name = path.splitext(path.basename(mesh_file))[0]
+            archive.add(name, mesh.verts, mesh.faces, bits, codec, level, source=path.basename(mesh_file))
+        print(f"{out_file} : {len(archive)} meshes")
+        return dict(archive.index)
@@ -0,0 +1,319 @@
+# mesh_decimation.py
+
+"""
+Quadric edge-collapse decimation (Garland & Heckbert) computed directly on the (verts, faces) arrays.
+
+The collapse queue is processed by rounds instead of one edge at a time : at each round, the edges are ranked by
+their quadric error, and every edge that is the cheapest of its neighbourhood (no face shares vertices of two
+chosen edges) is collapsed at once, with batched NumPy operations. The cheapest edges are always collapsed first,
+like with a heap, but a 5M-face mesh is handled in a few dozen rounds instead of millions of Python steps.
+Between two rounds, only the costs of the edges around the collapsed vertices are computed again, and the selection
+of a round only looks at its queue and at the 1-rings of its ends.
+
+    verts   (ndarray):  (V, 3) vertex coordinates.
+    faces   (ndarray):  (F, 3) triangle vertex indices.
+"""
+
+import numpy as np
+
+from source.mesh_metrics import edge_counts
+
+# Upper triangle of the symmetric 4x4 quadric : a2 ab ac ad b2 bc bd c2 cd d2
+_QUADRIC_PAIRS = ((0, 0), (0, 1), (0, 2), (0, 3), (1, 1), (1, 2), (1, 3), (2, 2), (2, 3), (3, 3))
+
+# Faces / edges per block of the batched operations on the whole mesh : the temporaries stay in the CPU cache
+BLOCK = 1 << 14
+
+def face_quadrics(verts, faces):
+    """
+    Quadric of the plane of every face, weighted by the face area. Returns a (F, 10) array.
+    """
+    columns = [np.ascontiguousarray(verts[:, axis], dtype=np.float64) for axis in range(3)]
+    quadrics = np.empty((len(faces), 10))
+    for start in range(0, len(faces), BLOCK):
+        block = faces[start:start + BLOCK]
+        x0, y0, z0 = (column.take(block[:, 0]) for column in columns)
+        ux, uy, uz = (column.take(block[:, 1]) for column in columns)
+        wx, wy, wz = (column.take(block[:, 2]) for column in columns)
+        ux -= x0; uy -= y0; uz -= z0
+        wx -= x0; wy -= y0; wz -= z0
+        nx = uy*wz; nx -= uz*wy
+        ny = uz*wx; ny -= ux*wz
+        nz = ux*wy; nz -= uy*wx
+        double_area = np.sqrt(nx*nx + ny*ny + nz*nz)
+        norm = np.maximum(double_area, 1e-30)
+        nx /= norm; ny /= norm; nz /= norm
+        offset = nx*x0
+        offset += ny*y0
+        offset += nz*z0
+        offset *= -1
+        plane = (nx, ny, nz, offset)
+        weights = double_area
+        weights /= 2
+        out = quadrics[start:start + BLOCK]
+        for k, (i, j) in enumerate(_QUADRIC_PAIRS):
+            np.multiply(plane[i], plane[j], out=out[:, k])
+            out[:, k] *= weights
+    return quadrics
+
+def vertex_quadrics(verts, faces):
+    """
+    Sum of the quadrics of the faces around every vertex. Returns a (V, 10) array.
+    """
+    from scipy.sparse import csr_matrix
+    # Face -> vertex incidence matrix (3 corners per row) : one sparse product sums the 10 coefficients
+    face_number = len(faces)
+    incidence = csr_matrix((np.ones(3 * face_number), faces.ravel(), np.arange(0, 3 * face_number + 1, 3)),
+                           shape=(face_number, len(verts)))
+    return np.asarray(incidence.T @ face_quadrics(verts, faces))
+
+def quadric_error(quadrics, points):
+    """
+    Error v^T Q v of every point (N, 3) for its quadric (N, 10).
+    """
+    x, y, z = points[:, 0], points[:, 1], points[:, 2]
+    a2, ab, ac, ad, b2, bc, bd, c2, cd, d2 = quadrics.T
+    # Horner form : fewer temporary arrays
+    error = ab*y
+    error += ac*z
+    error += ad
+    error *= 2
+    error += a2*x
+    error *= x
+    part = bc*z
+    part += bd
+    part *= 2
+    part += b2*y
+    part *= y
+    error += part
+    part = c2*z
+    part += 2*cd
+    part *= z
+    error += part
+    error += d2
+    return error
+
+def optimal_points(quadrics, fallback):
+    """
+    Points minimizing the quadrics (solution of the 3x3 systems). "fallback" is kept where the system is singular
+    (flat or straight regions) or where it does not lower the error.
+    """
+    a2, ab, ac, ad, b2, bc, bd, c2, cd, d2 = quadrics.T
+    matrices = np.stack((np.stack((a2, ab, ac), axis=1),
+                         np.stack((ab, b2, bc), axis=1),
+                         np.stack((ac, bc, c2), axis=1)), axis=1)
+    det = np.linalg.det(matrices)
+    scale = np.maximum(np.abs(matrices).max(axis=(1, 2)), 1e-30) ** 3
+    solvable = np.abs(det) > 1e-6 * scale
+    points = fallback.copy()
+    if np.any(solvable):
+        solved = np.linalg.solve(matrices[solvable], -np.stack((ad, bd, cd), axis=1)[solvable][:, :, None])[:, :, 0]
+        better = quadric_error(quadrics[solvable], solved) <= quadric_error(quadrics[solvable], fallback[solvable])
+        index = np.flatnonzero(solvable)[better]
+        points[index] = solved[better]
+    return points
+
+def _independent_edges(rank, a, b, vertex_number, ring_a, ring_b):
+    """
+    Candidate edges (a - b, ranked by "rank") with the lowest rank of every candidate touching the 1-ring of both
+    of their ends. No face then holds vertices of 2 of these edges, so they can all be collapsed at the same time.
+    "ring_a" - "ring_b" are the edges of the mesh touching an end of a candidate (the 1-rings of these ends).
+    """
+    none = len(rank)
+    vertex_min = np.full(vertex_number, none, dtype=np.int64)
+    np.minimum.at(vertex_min, a, rank)
+    np.minimum.at(vertex_min, b, rank)
+    ring_min = vertex_min.copy()
+    np.minimum.at(ring_min, ring_a, vertex_min[ring_b])
+    np.minimum.at(ring_min, ring_b, vertex_min[ring_a])
+    return np.flatnonzero((rank < none) & (rank == ring_min[a]) & (rank == ring_min[b]))
+
+def _flipping_collapses(verts, faces, a, b, new_points, vertex_number, min_cosine=0.1):
+    """
+    Mask of the collapses (independent edges a - b moved to new_points) that would flip a face around them,
+    and the faces around them (a smaller "faces" for another test of some of these collapses).
+    "faces" only needs to hold the faces around the ends of the edges.
+    """
+    moved = np.full(vertex_number, -1, dtype=np.int64)
+    moved[a] = np.arange(len(a))
+    moved[b] = np.arange(len(a))
+    # Faces with one moving corner (the 2 faces of the edge itself disappear)
+    corners = (moved >= 0).view(np.int8)[faces]
+    touched = np.flatnonzero((corners[:, 0] + corners[:, 1] + corners[:, 2]) == 1)
+    faces = faces[touched]
+    moving = moved[faces]
+    owner = moving.max(axis=1)
+    old_corners = verts[faces]
+    new_corners = np.where((moving >= 0)[:, :, None], new_points[owner][:, None, :], old_corners)
+    old_normals = np.cross(old_corners[:, 1] - old_corners[:, 0], old_corners[:, 2] - old_corners[:, 0])
+    new_normals = np.cross(new_corners[:, 1] - new_corners[:, 0], new_corners[:, 2] - new_corners[:, 0])
+    dot = np.einsum("ij,ij->i", old_normals, new_normals)
+    old_norms = np.linalg.norm(old_normals, axis=1)
+    # A face that turns too much, or becomes degenerate, flips (faces that were already degenerate can't)
+    flipped = (dot <= min_cosine * old_norms * np.linalg.norm(new_normals, axis=1)) & (old_norms > 0)
+    refused = np.zeros(len(a), dtype=bool)
+    refused[owner[flipped]] = True
+    return refused, faces
+
+def _edge_quadrics(quadrics, verts, a, b):
+    # Summed quadrics and middles of the edges a - b
+    edge_quadrics = quadrics[a]
+    edge_quadrics += quadrics[b]
+    middles = verts[a]
+    middles += verts[b]
+    middles /= 2
+    return edge_quadrics, middles
+
+def edge_costs(quadrics, verts, a, b):
+    """
+    Quadric error of every edge a - b at its middle.
+    """
+    cost = np.empty(len(a))
+    for start in range(0, len(a), BLOCK):
+        block = slice(start, start + BLOCK)
+        cost[block] = quadric_error(*_edge_quadrics(quadrics, verts, a[block], b[block]))
+    return cost
+
+def decimate(verts, faces, target_faces=None, max_error=None, max_rounds=200, passes=4, seed=0):
+    """
+    Simplifies a mesh by quadric edge collapses, until it has "target_faces" faces or until the cheapest
+    collapse costs more than "max_error". Boundary and non-manifold edges are kept, and a collapse is refused
+    when it would flip a face or break the topology (link condition).
+    Args:
+        target_faces (int, optional): Number of faces to reach. If None, only max_error stops the decimation.
+        max_error (float, optional): Largest quadric error of a collapse (squared distance, in the unit of the vertices).
+        max_rounds (int, optional): Largest number of collapse rounds.
+        passes (int, optional): Number of selections per round : the edges refused by a selection leave room
+                                to their neighbours in the next one.
+        seed (int, optional): Seed of the priority of the collapses (the result is the same for the same seed).
+    Returns:
+        (verts, faces): The simplified mesh (unused vertices removed). The input arrays are not modified.
+    """
+    from scipy.sparse import csr_matrix
+    if target_faces is None and max_error is None:
+        raise ValueError("target_faces or max_error must be given")
+    verts = np.array(verts, dtype=np.float64)
+    faces = np.array(faces, dtype=np.int64)
+    vertex_number = len(verts)
+    quadrics = vertex_quadrics(verts, faces)
+    target = target_faces if target_faces is not None else 0
+    # When the cheapest edges can't be collapsed, the next round looks at every edge
+    widen = False
+    rng = np.random.default_rng(seed)
+    # Edges and costs of the previous round, and the vertices its collapses moved or removed
+    a = b = cost = None
+    dirty = np.zeros(vertex_number, dtype=bool)
+
+    for _ in range(max_rounds):
+        if len(faces) <= target:
+            break
+        previous_a, previous_b = a, b
+        edges, counts = edge_counts(faces, vertex_number)
+        a, b = edges[:, 0], edges[:, 1]
+        # Vertices of boundary / non-manifold edges never move
+        locked = np.zeros(vertex_number, dtype=bool)
+        locked[edges[counts != 2].ravel()] = True
+
+        # Cost of every edge : quadric error at its middle (the optimal point is only solved for the chosen collapses).
+        # Only the edges around the vertices of the last collapses are computed again : the other edges, and their
+        # quadrics, did not change, and edge_counts lists them in the same (sorted) order
+        if cost is None:
+            cost = edge_costs(quadrics, verts, a, b)
+        else:
+            stale = dirty[a] | dirty[b]
+            new_cost = np.empty(len(edges))
+            new_cost[~stale] = cost[~(dirty[previous_a] | dirty[previous_b])]
+            new_cost[stale] = edge_costs(quadrics, verts, a[stale], b[stale])
+            cost = new_cost
+        dirty[:] = False
+        available = ~(locked[a] | locked[b])
+        if max_error is not None:
+            available &= cost <= max_error
+        # Each collapse removes 2 faces
+        needed = (len(faces) - target + 1) // 2
+        if target_faces is not None and not widen:
+            # Collapse queue of this round : about the cheapest edges still needed
+            if needed < np.count_nonzero(available):
+                threshold = np.partition(cost[available], needed - 1)[needed - 1]
+                available &= cost <= threshold
+        queue = np.flatnonzero(available)
+        if queue.size == 0:
+            break
+
+        # Everything else in the round only looks at the queue and at the 1-rings of its ends
+        queue_a, queue_b = a[queue], b[queue]
+        ends = np.zeros(vertex_number, dtype=bool)
+        ends[queue_a] = ends[queue_b] = True
+        ring = np.flatnonzero(ends[a] | ends[b])
+        ring_a, ring_b = a[ring], b[ring]
+        ring_faces = faces[np.flatnonzero(ends[faces].any(axis=1))]
+        # The edges are sorted : the upper half of the adjacency matrix is built directly, without another sort
+        indptr = np.zeros(vertex_number + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ring_a, minlength=vertex_number), out=indptr[1:])
+        adjacency = csr_matrix((np.ones(len(ring), dtype=np.int8), ring_b, indptr), shape=(vertex_number, vertex_number))
+        adjacency = adjacency + adjacency.T.tocsr()
+        # Inside the queue, the collapses that can run together are drawn by a random priority : the costs vary
+        # smoothly along the surface, so their local minima alone would be too few
+        rank = rng.permutation(len(queue))
+        live = np.ones(len(queue), dtype=bool)
+        accepted, accepted_points = [], []
+        for _ in range(passes):
+            chosen = _independent_edges(np.where(live, rank, len(queue)), queue_a, queue_b, vertex_number, ring_a, ring_b)
+            if chosen.size == 0:
+                break
+            chosen_a, chosen_b = queue_a[chosen], queue_b[chosen]
+            # Link condition : the 2 ends must share exactly 2 neighbours (the 2 faces of the edge)
+            common = np.asarray(adjacency[chosen_a].multiply(adjacency[chosen_b]).sum(axis=1)).ravel()
+            refused = common != 2
+            edge_quadrics, middles = _edge_quadrics(quadrics, verts, chosen_a, chosen_b)
+            new_points = optimal_points(edge_quadrics, middles)
+            flipped, around = _flipping_collapses(verts, ring_faces, chosen_a, chosen_b, new_points, vertex_number)
+            flipped = np.flatnonzero(flipped)
+            # Second chance at the middle of the edge (only the faces around the chosen edges can flip)
+            new_points[flipped] = middles[flipped]
+            refused[flipped] |= _flipping_collapses(verts, around, chosen_a[flipped], chosen_b[flipped], middles[flipped],
+                                                    vertex_number)[0]
+            live[chosen[refused]] = False
+            chosen, new_points = chosen[~refused], new_points[~refused]
+            accepted.append(chosen)
+            accepted_points.append(new_points)
+            # The next selection stays away from the faces of the accepted collapses
+            moved = np.zeros(vertex_number, dtype=bool)
+            moved[queue_a[chosen]] = moved[queue_b[chosen]] = True
+            near = moved.copy()
+            near[ring_a[moved[ring_b]]] = True
+            near[ring_b[moved[ring_a]]] = True
+            live &= ~(near[queue_a] | near[queue_b])
+            if target_faces is not None and sum(map(len, accepted)) >= needed:
+                break
+        # The chosen collapses are independent : any part of them can be applied
+        chosen = np.concatenate(accepted)[:needed] if target_faces is not None else np.concatenate(accepted)
+        if chosen.size == 0:
+            if widen:
+                break
+            widen = True
+            continue
+        widen = chosen.size < 0.01 * len(edges)
+        new_points = np.concatenate(accepted_points)[:chosen.size]
+
+        # Collapse : b is merged into a
+        keep, gone = queue_a[chosen], queue_b[chosen]
+        verts[keep] = new_points
+        quadrics[keep] += quadrics[gone]
+        dirty[keep] = dirty[gone] = True
+        remap = np.arange(vertex_number)
+        remap[gone] = keep
+        faces = remap[faces]
+        faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])]
+
+    # Remove the merged vertices
+    used = np.zeros(vertex_number, dtype=bool)
+    used[faces.ravel()] = True
+    new_index = np.cumsum(used) - 1
+    return verts[used], new_index[faces]
+
+def decimate_ratio(verts, faces, simply_val):
+    """
+    Keeps "simply_val" percent of the faces (the meaning of simply_val for every library, like nii2mesh's -r option).
+    """
+    return decimate(verts, faces, target_faces=int(round(len(faces) * simply_val / 100)))
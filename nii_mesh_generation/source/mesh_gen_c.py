@@ -3,6 +3,14 @@
 import subprocess
 import os
 import shutil
+import tempfile
+
+from source.nii_volume import load_volume
+from source.mesh_result import MeshResult
+from source.mesh_stages import stage
+
+# Mesh types written by nii2mesh itself (the other types of source/mesh_writers.py are converted from a .ply)
+NII2MESH_TYPES = ("gii", "jmsh", "json", "mz3", "obj", "off", "ply", "stl", "vtk", "x3d")
 
 def mesh_gen_nii2mesh(nii2mesh_path, 
                       input_file, 
@@ -11,25 +19,38 @@ def mesh_gen_nii2mesh(nii2mesh_path,
                       out_type, 
                       smooth_val = 0, 
                       simply_val = 100, 
-                      verbose = False):
+                      verbose = False,
+                      crop = True,
+                      in_process = None,
+                      timeout = None):
     """    
     Generates a mesh using nii2mesh code, made on C.
     
     Args:
         nii2mesh_path (str): The path to the nii2mesh executable.
-        input_file (str): The input file for generating the mesh.
+        input_file (str): The input file for generating the mesh. Can also be a numpy array, a nibabel image or a NiiVolume.
         out_name (str): The name of the output file.
         out_dir (str): The directory where the output file will be saved.
-        out_type (str): The file type of the output file.
+        out_type (str): The file type of the output file. Types nii2mesh can't write ("glb") are converted from its .ply.
         smoothing (str, optional): The smoothing parameter for the mesh generation. Defaults to "".
         smooth_val (int, optional): The value for the smoothing parameter. Defaults to 1.
         simplify (str, optional): The simplification parameter for the mesh generation. Defaults to "".
         simply_val (int, optional): The value for the simplification parameter. Defaults to 1.
         verbose (bool, optional): Whether to show verbose output. Defaults to False.
+        crop (bool, optional): Whether to give nii2mesh only the bounding box of the label (plus 1 voxel). Defaults to True.
+        in_process (bool, optional): Whether to run nii2mesh in-process through its shared library (source/nii2mesh_lib.py)
+            instead of the executable. Defaults to None : the library is used when it can be loaded (or built) and the
+            output type is written from arrays ("obj" / "stl" / "ply" / "glb"), the executable otherwise.
+        timeout (float, optional): Time limit of the nii2mesh executable in seconds (subprocess.TimeoutExpired). Defaults to None.
     
     Raises:
         FileNotFoundError: If the nii2mesh executable is not found.
-        subprocess.CalledProcessError: If the nii2mesh command fails to execute.
+        subprocess.CalledProcessError: If the nii2mesh command fails to execute (its output and stderr are in the exception).
+        subprocess.TimeoutExpired: If the nii2mesh command takes longer than timeout (it is killed).
+    
+    Returns:
+        MeshResult: Path of the saved mesh. The executable only gives a file, so the arrays are read from it on first use
+                    (the in-process library gives the arrays directly).
     
     Notes:
         - This function may not work properly for different issues:
@@ -40,45 +61,77 @@ def mesh_gen_nii2mesh(nii2mesh_path,
         - Link to the source code: https://github.com/neurolabusc/nii2mesh
     """
     
-    param = ""
+    if in_process is None:
+        from source.mesh_writers import WRITERS
+        from source.nii2mesh_lib import library_available
+        in_process = out_type in WRITERS and library_available()
+    if in_process:
+        from source.mesh_writers import save_mesh
+        from source.nii2mesh_lib import nii2mesh_arrays
+        verts, faces = nii2mesh_arrays(input_file, smooth_val, simply_val, crop=crop, verbose=verbose)
+        new_file_path = save_mesh(verts, faces, out_dir, out_name, out_type)
+        return MeshResult(verts, faces, new_file_path)
+    if out_type not in NII2MESH_TYPES:
+        from source.mesh_writers import save_mesh
+        with tempfile.TemporaryDirectory() as tmp_out:
+            mesh = mesh_gen_nii2mesh(nii2mesh_path, input_file, out_name, tmp_out, "ply",
+                                     smooth_val, simply_val, verbose, crop, in_process=False, timeout=timeout).load()
+        new_file_path = save_mesh(mesh.verts, mesh.faces, out_dir, out_name, out_type)
+        return MeshResult(mesh.verts, mesh.faces, new_file_path)
+    # The executable runs the whole pipeline (marching cubes, smoothing, simplification, writing) : one stage
+    if isinstance(input_file, (str, os.PathLike)) and not crop:
+        with stage("marching_cubes") as record:
+            record.update(in_process=False, smooth_val=smooth_val, simply_val=simply_val)
+            return _run_nii2mesh(nii2mesh_path, str(input_file), out_name, out_dir, out_type, smooth_val, simply_val, verbose, timeout)
+    volume = load_volume(input_file)
+    if crop:
+        # The affine of the cropped volume keeps the mesh at its place in the original grid
+        with stage("crop") as record:
+            volume = volume.crop()
+            record.update(shape=volume.shape)
+    with tempfile.TemporaryDirectory() as tmp_dir, stage("marching_cubes") as record:
+        record.update(in_process=False, smooth_val=smooth_val, simply_val=simply_val)
+        # nii2mesh reads from disk : a volume loaded in memory (or cropped) is written once, uncompressed
+        return _run_nii2mesh(nii2mesh_path, volume.as_file(tmp_dir), out_name, out_dir, out_type, smooth_val, simply_val, verbose, timeout)
+
+def nii2mesh_executable(nii2mesh_path):
+    """
+    Location of the nii2mesh executable : in the nii2mesh_path folder ("nii2mesh" built with "make", or "nii2mesh.exe"),
+    else on the PATH.
+    """
+    for name in ("nii2mesh", "nii2mesh.exe"):
+        candidate = os.path.join(nii2mesh_path, name)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    found = shutil.which("nii2mesh")
+    if found is None:
+        raise FileNotFoundError(f"nii2mesh executable not found in {nii2mesh_path} or on the PATH.")
+    return found
+
+def _run_nii2mesh(nii2mesh_path, input_file, out_name, out_dir, out_type, smooth_val, simply_val, verbose, timeout=None):
     
-    param += f"-s {str(smooth_val)} "       # Value between 1 and 10
-    param += f"-r {str(simply_val/100)} "   # Value between 0.05 and 1
+    args = [nii2mesh_executable(nii2mesh_path), input_file]
+    args += ["-s", str(smooth_val)]         # Value between 1 and 10
+    args += ["-r", str(simply_val/100)]     # Value between 0.05 and 1
     if verbose :
-        param += "-v 1"
+        args += ["-v", "1"]
     
-    print(param)
-    command = f'nii2mesh "{input_file}" {param} "{out_name}{"." + out_type}"'
-    full_command = f'cd {nii2mesh_path} && {command}'
+    print(" ".join(args[2:]))
     
-    try:
-        subprocess.run(full_command, shell=True, check=True, cwd=nii2mesh_path)
-    except FileNotFoundError:
-        raise FileNotFoundError("nii2mesh executable not found.")
-    except subprocess.CalledProcessError as e:
-        raise subprocess.CalledProcessError(e.returncode, e.cmd, output=e.output, stderr=e.stderr) from None
-
-    file_name = f'{out_name}{"." + out_type}'
-    file_path = os.path.join(nii2mesh_path, file_name)
-    
-    # Saving the file
-    # Handles duplicates by creating "suffixes" of already existing names
-    try:
-        shutil.move(file_path, out_dir)
-        new_file_path = os.path.join(out_dir, file_name)
-    except shutil.Error:
-        suffix = 1
-        new_file_name = f"{out_name}_{suffix}.{out_type}" 
-        new_file_path = os.path.join(out_dir, new_file_name) 
-        while os.path.exists(new_file_path):
-            suffix += 1
-            new_file_name = f"{out_name}_{suffix}.{out_type}" 
-            new_file_path = os.path.join(out_dir, new_file_name) 
-        shutil.move(file_path, new_file_path)
-
-    return new_file_path
-
-
-
-
+    from source.mesh_writers import claim_path
+    # Written in a folder of its own inside out_dir, then moved under its final name (same disk : a rename, not a copy)
+    with tempfile.TemporaryDirectory(prefix=".nii2mesh_", dir=out_dir) as tmp_out:
+        tmp_file = os.path.join(tmp_out, f"{out_name}.{out_type}")
+        try:
+            result = subprocess.run(args + [tmp_file], capture_output=True, text=True, timeout=timeout)
+        except FileNotFoundError:
+            raise FileNotFoundError("nii2mesh executable not found.") from None
+        failed = result.returncode != 0 or not os.path.isfile(tmp_file)
+        if verbose or failed:
+            # nii2mesh explains its errors on stdout
+            print(result.stdout + result.stderr)
+        if failed:
+            raise subprocess.CalledProcessError(result.returncode, args, output=result.stdout, stderr=result.stderr)
+        new_file_path = claim_path(tmp_file, out_dir, out_name, out_type)
 
+    return MeshResult(mesh_path=new_file_path)
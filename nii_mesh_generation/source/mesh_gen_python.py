@@ -1,4 +1,7 @@
-from os import path, getcwd, chdir
+from source.nii_volume import load_volume, transform_mesh
+from source.mesh_result import MeshResult
+from source.mesh_stages import stage
+from source.mesh_writers import WRITERS, save_mesh, write_new_file
 
 def mesh_gen_pylab(
     input_file,
@@ -9,108 +12,241 @@ def mesh_gen_pylab(
     out_type    = "obj",
     out_dir     = ".",
     out_name    = "",
-    grid_scale  = (0.55, 0.55, 0.55)):
+    grid_scale  = None,
+    crop        = True,
+    cache_dir   = None,
+    cache_size  = 1024,
+    mc_workers  = None):
+    """
+    Generates a mesh using pymeshlab. "input_file" can be a NIFTI location, a numpy array, a nibabel image or a NiiVolume.
+    If "crop" is true, the marching cubes only runs on the bounding box of the label (plus 1 voxel).
+    The mesh is in the world coordinates of the header, unless "grid_scale" is given (see marching_cubes).
+    If "cache_dir" is given, the marching cubes result is cached there (see marching_cubes).
+    If "mc_workers" is given, the marching cubes runs on that many workers (see marching_cubes).
+    Returns a MeshResult (arrays and path of the saved mesh).
+    """
     
-    import pymeshlab
-    import nibabel as nib
+    verts, faces = marching_cubes(input_file, crop=crop, grid_scale=grid_scale, cache_dir=cache_dir, cache_size=cache_size,
+                                  workers=mc_workers)
+    verts, faces = process_pylab(verts, faces, simplify, simply_val, smoothing, smooth_val)
+    new_file = save_pylab(verts, faces, out_dir, out_name, out_type)
+    return MeshResult(verts, faces, new_file)
+
+def marching_cubes(input_file, crop=True, level=0.5, grid_scale=None, cache_dir=None, cache_size=1024, workers=None):
+    """
+    Runs the marching cubes (skimage) on a label-map and returns the (verts, faces) arrays.
+    The voxel spacing of the header goes straight into the marching cubes, then the affine of the header
+    (rotation, flips, origin) is applied in one matrix product : the mesh is in world coordinates, like nii2mesh's.
+    If "grid_scale" is given, it is used as the spacing instead and only the crop offset is applied (grid coordinates).
+    If "cache_dir" is given, the result is stored there (key = hash of the voxels and of the parameters),
+    and a later run on the same label-map reads it back instead of running the marching cubes again.
+    "cache_size" is the size limit of the cache folder in MB (least recently used entries are removed).
+    If "workers" is above 1, the mask is split into blocks meshed in parallel and welded back together
+    (see source/mesh_parallel.py) : same vertices and faces as the serial marching cubes.
+    """
     from skimage import measure
     
-    print("Marching Cubes")
+    # Read the nii file (only if it was not already loaded)
+    volume = load_volume(input_file)
+    if crop:
+        with stage("crop") as record:
+            volume = volume.crop()
+            record.update(shape=volume.shape)
+    spacing = volume.spacing(grid_scale)
     
-    # Read the nii file
-    nifti_array = nib.load(input_file).get_fdata()
-    # Marching Cubes
-    verts, faces, normals, values = measure.marching_cubes(nifti_array)
-    # Create Mesh
-    mesh = pymeshlab.Mesh(verts, faces)
-    # Create Meshset
-    mset = pymeshlab.MeshSet()
-    mset.add_mesh(mesh)
+    cached = None
+    if cache_dir is not None:
+        from source.mc_cache import cache_key, load_cached, save_cached
+        key = cache_key(volume, level, spacing, crop)
+        cached = load_cached(cache_dir, key)
+    
+    with stage("marching_cubes") as record:
+        if cached is not None:
+            print("Marching Cubes (cached)")
+            verts, faces = cached
+        else:
+            if workers is not None and workers > 1:
+                from source.mesh_parallel import parallel_marching_cubes
+                print(f"Marching Cubes ({workers} workers)")
+                verts, faces = parallel_marching_cubes(volume.mask(), spacing, workers, level=level)
+            else:
+                print("Marching Cubes")
+                # Marching Cubes (on the binary mask, so the float32 copy made by skimage is the only big one)
+                verts, faces, normals, values = measure.marching_cubes(volume.mask(), level=level, spacing=spacing)
+            if cache_dir is not None:
+                save_cached(cache_dir, key, verts, faces, cache_size)
+        record.output(verts, faces)
+        record.update(cached=cached is not None, workers=workers or 1)
+    
+    # Back to the original grid / world coordinates
+    with stage("transform", verts, faces) as record:
+        verts, faces = transform_mesh(verts, faces, volume.mesh_matrix(grid_scale))
+        record.output(verts, faces)
+    return verts, faces
+
+def process_pylab(
+    verts,
+    faces,
+    simplify    = "", 
+    simply_val  = 100,
+    smoothing   = "", 
+    smooth_val  = 0,
+    operator    = None):
+    """
+    Simplifies (pymeshlab, or source/mesh_decimation.py for "qec") and smooths (source/mesh_smoothing.py, on the arrays)
+    a marching cubes mesh. Returns the (verts, faces) arrays : a pymeshlab MeshSet is only built for its simplification filters.
+    The vertices are already scaled by marching_cubes : no scaling pass is made here.
+    The input arrays are not modified, so the same marching cubes mesh can be processed several times.
+    "operator" is the umbrella operator of the input mesh (see umbrella_operator), when it is reused for several smoothings.
+    """
+    from source.mesh_smoothing import smooth_mesh
     
     # ------- SIMPLIFY -------
 
-    if simplify == "edmc":
-        print("Edge Decimation for Marching Cubes Meshes")
-        mset.meshing_decimation_edge_collapse_for_marching_cube_meshes()
-    elif simplify == "edqe":
-        print("Edge Decimation Quadratic Edge Collapse")
-        mset.meshing_decimation_quadric_edge_collapse()
-    elif simplify == "mdc":
-        print("Meshing Decimation Clustering : ", simply_val, "%")
-        mset.meshing_decimation_clustering(threshold = pymeshlab.Percentage(simply_val))
+    if simplify == "qec":
+        from source.mesh_decimation import decimate_ratio
+        print("Quadric Edge Collapse : ", simply_val, "% of the faces kept")
+        with stage("simplify", verts, faces) as record:
+            verts, faces = decimate_ratio(verts, faces, simply_val)
+            record.output(verts, faces)
+            record.update(method=simplify)
+        # The connectivity changed : the operator of the input mesh can't be used
+        operator = None
+    elif simplify in ("edmc", "edqe", "mdc"):
+        import pymeshlab
+        with stage("simplify", verts, faces) as record:
+            mset = pymeshlab.MeshSet()
+            mset.add_mesh(pymeshlab.Mesh(verts, faces))
+            if simplify == "edmc":
+                print("Edge Decimation for Marching Cubes Meshes")
+                mset.meshing_decimation_edge_collapse_for_marching_cube_meshes()
+            elif simplify == "edqe":
+                print("Edge Decimation Quadratic Edge Collapse : ", simply_val, "% of the faces kept")
+                if simply_val < 100:
+                    mset.meshing_decimation_quadric_edge_collapse(targetfacenum = int(round(len(faces) * simply_val / 100)))
+                else:
+                    mset.meshing_decimation_quadric_edge_collapse()
+            else:
+                print("Meshing Decimation Clustering : ", simply_val, "%")
+                mset.meshing_decimation_clustering(threshold = pymeshlab.Percentage(simply_val))
+            mesh = mset.current_mesh()
+            verts, faces = mesh.vertex_matrix(), mesh.face_matrix()
+            record.output(verts, faces)
+            record.update(method=simplify)
+        # The connectivity changed : the operator of the input mesh can't be used
+        operator = None
     else:
         print("No simplification")
     
     # ------- SMOOTHING -------
 
-    if smoothing == "lap":
-        print("Laplacian Coordinate Smoothing : ", smooth_val, " iterations")
-        mset.apply_coord_laplacian_smoothing(stepsmoothnum = smooth_val) 
-    elif smoothing == "tau":
-        print("Taubin Coordinate Smoothing")
-        mset.apply_coord_taubin_smoothing()
-    elif smoothing == "hc":
-        print("Laplacian Coordinate Smoothing - HC method")
-        mset.apply_coord_hc_laplacian_smoothing() 
+    if smoothing in ("lap", "tau", "hc"):
+        if smoothing == "lap":
+            print("Laplacian Coordinate Smoothing : ", smooth_val, " iterations")
+        elif smoothing == "tau":
+            print("Taubin Coordinate Smoothing : ", smooth_val, " iterations")
+        else:
+            print("Laplacian Coordinate Smoothing - HC method : ", smooth_val, " iterations")
+        with stage("smooth", verts, faces) as record:
+            verts = smooth_mesh(verts, faces, smoothing, smooth_val, operator)
+            record.output(verts, faces)
+            record.update(method=smoothing, iterations=smooth_val)
     else:
         print("No smoothing")
     
-    # ------- SAVING -------
-    
-    # Grid Scale Normalization
-    ax,ay,az = grid_scale
-    mset.compute_matrix_from_scaling_or_normalization(axisx=ax, axisy=ay, axisz=az)
-    
-    # Handles duplicates by creating "suffixes" of already existing names
-    new_file = path.join(out_dir, out_name + "." + out_type)
-    suffix = 0
-    while path.isfile(new_file):    
-        suffix += 1
-        new_file = path.join(out_dir, out_name + "_" + str(suffix) + "." + out_type)
-    mset.save_current_mesh(new_file)
+    return verts, faces
+
+def save_pylab(verts, faces, out_dir=".", out_name="", out_type="obj"):
+    """
+    Saves a mesh and returns its path.
+    "obj", "stl", "ply" and "glb" are written from the arrays (source/mesh_writers.py), the other types by pymeshlab
+    (the only case where a MeshSet is built to save the mesh).
+    """
+    if out_type in WRITERS:
+        return save_mesh(verts, faces, out_dir, out_name, out_type)
+    import pymeshlab
+    mset = pymeshlab.MeshSet()
+    mset.add_mesh(pymeshlab.Mesh(verts, faces))
+    with stage("write", verts, faces) as record:
+        # Handles duplicates by creating "suffixes" of already existing names
+        new_file = write_new_file(mset.save_current_mesh, out_dir, out_name, out_type)
+        record.update(mesh_path=new_file, out_type=out_type)
     print(new_file + " saved successfully")
     return new_file
     
-def mesh_gen_vtk(input_file, out_dir = ".", out_name = ""):
+def vtk_image(volume, spacing=None):
+    """
+    Wraps a loaded NiiVolume into a vtkImageData, so VTK does not read the NIFTI file again.
+    The image starts at the origin with the given spacing (zooms of the header by default) : the crop offset
+    and the affine are applied afterwards, with NiiVolume.mesh_matrix.
+    """
+    import vtk
+    from vtk.util.numpy_support import numpy_to_vtk
+    from numpy import ravel
+    image = vtk.vtkImageData()
+    image.SetDimensions(*volume.shape)
+    image.SetSpacing(*(spacing or volume.zooms))
+    # VTK stores the x index fastest, like the NIFTI file itself
+    scalars = numpy_to_vtk(ravel(volume.mask(), order="F"), deep=True)
+    image.GetPointData().SetScalars(scalars)
+    return image
+
+def mesh_gen_vtk(input_file, out_dir = ".", out_name = "", crop = True, grid_scale = None, simply_val = 100, out_type = "obj"):
+    """
+    Generates a mesh using VTK. "input_file" can be a NIFTI location, a numpy array, a nibabel image or a NiiVolume.
+    If "crop" is true, the marching cubes only runs on the bounding box of the label (plus 1 voxel).
+    If "simply_val" is below 100, the mesh is decimated (vtkQuadricDecimation) to keep simply_val % of the faces.
+    The mesh is in the world coordinates of the header, unless "grid_scale" is given (see marching_cubes).
+    The mesh is saved from its arrays (source/mesh_writers.py) : "obj", "stl", "ply" or "glb".
+    Returns a MeshResult (arrays and path of the saved mesh).
+    """
     import vtk
-    from os import getcwd, path, chdir
-    # Keep the initial directory in memory
-    initial_dir = getcwd()
-    # Read the NIFTI file
-    nifti_vtk = vtk.vtkNIFTIImageReader()
-    nifti_vtk.SetFileName(input_file)
-    nifti_vtk.Update()
+    from vtk.util.numpy_support import vtk_to_numpy
+    # Read the NIFTI file (only if it was not already loaded)
+    volume = load_volume(input_file)
+    if crop:
+        with stage("crop") as record:
+            volume = volume.crop()
+            record.update(shape=volume.shape)
     # Marching Cubes
-    model_vtk = vtk.vtkMarchingCubes()
-    model_vtk.SetInputConnection(nifti_vtk.GetOutputPort())
-    model_vtk.SetValue(0, 0.5)
-    # Create a 3D model from the mesh
-    mapper = vtk.vtkPolyDataMapper()
-    mapper.SetInputConnection(model_vtk.GetOutputPort())
-    # Create an actor for the model
-    actor = vtk.vtkActor()
-    actor.SetMapper(mapper)
-    # Create a renderer for the scene
-    renderer = vtk.vtkRenderer()
-    renderer.AddActor(actor)
-    # Create a render window for the scene
-    render_window = vtk.vtkRenderWindow()
-    render_window.AddRenderer(renderer)
-    # Handles duplicates by creating "suffixes" of already existing names
-    new_file_name = out_name
-    new_file = path.join(out_dir, new_file_name)
-    suffix = 0
-    while path.isfile(new_file + ".obj"):    
-        suffix += 1
-        new_file_name = out_name + "_" + str(suffix)
-        new_file = path.join(out_dir, new_file_name)
-    # Create an exporter object
-    chdir(out_dir)
-    export_vtk = vtk.vtkOBJExporter()
-    export_vtk.SetInput(render_window)
-    # Remove the '.obj' extension when setting the file prefix
-    export_vtk.SetFilePrefix(new_file)
-    export_vtk.Write()
-    chdir(initial_dir)
-    print(new_file + ".obj saved successfully")
-    return new_file + ".obj"
\ No newline at end of file
+    marching_cubes_vtk = vtk.vtkMarchingCubes()
+    marching_cubes_vtk.SetValue(0, 0.5)
+    # Back to the original grid / world coordinates, in one transform
+    matrix = volume.mesh_matrix(grid_scale)
+    transform = vtk.vtkTransform()
+    transform.SetMatrix(matrix.ravel().tolist())
+    model_vtk = vtk.vtkTransformPolyDataFilter()
+    model_vtk.SetTransform(transform)
+    model_vtk.SetInputConnection(marching_cubes_vtk.GetOutputPort())
+    if transform.GetMatrix().Determinant() < 0:
+        # A flipping affine turns the faces inside out : reverse them back
+        reverse = vtk.vtkReverseSense()
+        reverse.ReverseCellsOn()
+        reverse.ReverseNormalsOff()
+        reverse.SetInputConnection(model_vtk.GetOutputPort())
+        model_vtk = reverse
+    # Each filter is updated on its own, so each stage is timed (an up-to-date filter is not run again downstream)
+    with stage("marching_cubes") as record:
+        marching_cubes_vtk.SetInputData(vtk_image(volume, volume.spacing(grid_scale)))
+        marching_cubes_vtk.Update()
+        polydata = marching_cubes_vtk.GetOutput()
+        record.output(polydata.GetNumberOfPoints(), polydata.GetNumberOfPolys())
+    with stage("transform", polydata.GetNumberOfPoints(), polydata.GetNumberOfPolys()) as record:
+        model_vtk.Update()
+        polydata = model_vtk.GetOutput()
+        record.output(polydata.GetNumberOfPoints(), polydata.GetNumberOfPolys())
+    if simply_val < 100:
+        decimation = vtk.vtkQuadricDecimation()
+        decimation.SetTargetReduction(1 - simply_val / 100)
+        decimation.SetInputConnection(model_vtk.GetOutputPort())
+        with stage("simplify", polydata.GetNumberOfPoints(), polydata.GetNumberOfPolys()) as record:
+            decimation.Update()
+            polydata = decimation.GetOutput()
+            record.output(polydata.GetNumberOfPoints(), polydata.GetNumberOfPolys())
+            record.update(method="quadric")
+    # The marching cubes output only holds triangles
+    verts = vtk_to_numpy(polydata.GetPoints().GetData())
+    faces = vtk_to_numpy(polydata.GetPolys().GetConnectivityArray()).reshape(-1, 3)
+    # Saved from the arrays : no render window, no exporter
+    new_file = save_mesh(verts, faces, out_dir, out_name, out_type)
+    return MeshResult(verts, faces, new_file)
\ No newline at end of file
@@ -0,0 +1,262 @@
+# mesh_metrics.py
+
+"""
+Mesh metrics computed directly on the (verts, faces) arrays, the same way for every library and every output format.
+Every metric is a batched NumPy operation (no loop over the faces), run block by block on the large meshes.
+
+    verts   (ndarray):  (V, 3) vertex coordinates.
+    faces   (ndarray):  (F, 3) triangle vertex indices.
+"""
+
+import numpy as np
+
+# Faces per block of _volume_area (4 times more for the edge keys) : the temporaries of a block stay in the CPU cache
+BLOCK_FACES = 1 << 14
+
+def _corners(verts, faces):
+    # Coordinates of the 3 corners of every face, one contiguous array per axis
+    faces = np.asarray(faces)
+    columns = [np.ascontiguousarray(verts[:, axis], dtype=np.float64) for axis in range(3)]
+    return [[np.take(column, faces[:, corner]) for column in columns] for corner in range(3)]
+
+def _volume_area(verts, faces):
+    # Signed volume and area in one pass over the faces, block by block.
+    # With n = (v1 - v0) x (v2 - v0) : v0 . n = v0 . (v1 x v2) (6 times the signed volume of the tetrahedron
+    # (origin, v0, v1, v2)) and |n| = 2 times the area of the triangle
+    faces = np.asarray(faces)
+    columns = [np.ascontiguousarray(verts[:, axis], dtype=np.float64) for axis in range(3)]
+    volume = area = 0.0
+    for start in range(0, len(faces), BLOCK_FACES):
+        block = faces[start:start + BLOCK_FACES]
+        x0, y0, z0 = (column.take(block[:, 0]) for column in columns)
+        ux, uy, uz = (column.take(block[:, 1]) for column in columns)
+        wx, wy, wz = (column.take(block[:, 2]) for column in columns)
+        ux -= x0; uy -= y0; uz -= z0
+        wx -= x0; wy -= y0; wz -= z0
+        nx = uy*wz; nx -= uz*wy
+        ny = uz*wx; ny -= ux*wz
+        nz = ux*wy; nz -= uy*wx
+        volume += float(x0 @ nx + y0 @ ny + z0 @ nz)
+        nx *= nx; ny *= ny; nz *= nz
+        nx += ny; nx += nz
+        area += float(np.sqrt(nx, out=nx).sum())
+    return volume / 6, area / 2
+
+def signed_volume(verts, faces):
+    """
+    Signed volume of a closed mesh : sum of the signed volumes of the tetrahedra (origin, v0, v1, v2).
+    Positive when the faces are oriented outwards.
+    """
+    return _volume_area(np.asarray(verts), faces)[0]
+
+def surface_area(verts, faces):
+    """
+    Total area of the triangles.
+    """
+    return _volume_area(np.asarray(verts), faces)[1]
+
+def bounding_box(verts):
+    """
+    Returns the (min, max) corners of the bounding box of the vertices.
+    """
+    return verts.min(axis=0), verts.max(axis=0)
+
+def edge_counts(faces, vertex_number):
+    """
+    Lists the undirected edges of a mesh and the number of faces using each one.
+    (1 = boundary edge, 2 = manifold edge, 3 or more = non-manifold edge)
+    Returns:
+        edges (ndarray): (E, 2) vertex indices, smallest index first, sorted.
+        counts (ndarray): (E,) number of faces per edge.
+    """
+    faces = np.asarray(faces)
+    face_number = len(faces)
+    if face_number == 0:
+        return np.empty((0, 2), dtype=np.int64), np.empty(0, dtype=np.int64)
+    # One integer key per undirected edge : (smallest index << 32) + largest index = smallest * (2^32 - 1) + start + end.
+    # Built block by block (the temporaries stay in the CPU cache), then sorted once, in place
+    keys = np.empty(3 * face_number, dtype=np.int64)
+    for first_face in range(0, face_number, 4 * BLOCK_FACES):
+        block = faces[first_face:first_face + 4 * BLOCK_FACES]
+        for corner in range(3):
+            start, end = block[:, corner], block[:, (corner + 1) % 3]
+            offset = corner * face_number + first_face
+            out = keys[offset:offset + len(block)]
+            np.minimum(start, end, out=out)
+            out *= 0xFFFFFFFF
+            out += start
+            out += end
+    keys.sort()
+    first = np.empty(keys.size, dtype=bool)
+    first[0] = True
+    np.not_equal(keys[1:], keys[:-1], out=first[1:])
+    starts = np.flatnonzero(first)
+    counts = np.diff(starts, append=keys.size)
+    unique_keys = keys[starts]
+    # Shifts instead of divisions to split the keys
+    edges = np.empty((len(unique_keys), 2), dtype=np.int64)
+    np.right_shift(unique_keys, 32, out=edges[:, 0])
+    np.bitwise_and(unique_keys, 0xFFFFFFFF, out=edges[:, 1])
+    return edges, counts
+
+def connected_components(edges, vertex_number, used=None):
+    """
+    Number of connected components of a mesh, counting only the vertices used by a face.
+    Args:
+        edges (ndarray): Sorted (E, 2) edges, as given by edge_counts.
+        vertex_number (int): Number of vertices.
+        used (ndarray, optional): Mask of the vertices used by a face. If None, every vertex is counted.
+    """
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components as graph_components
+    # The edges of edge_counts are sorted : the CSR graph is built directly, without another sort.
+    # 32-bit indices when they fit : scipy would convert them otherwise
+    index_type = np.int32 if max(vertex_number, len(edges)) < 2**31 else np.int64
+    indptr = np.zeros(vertex_number + 1, dtype=index_type)
+    np.cumsum(np.bincount(edges[:, 0], minlength=vertex_number), out=indptr[1:])
+    graph = csr_matrix((np.ones(len(edges), dtype=np.int8), edges[:, 1].astype(index_type), indptr),
+                       shape=(vertex_number, vertex_number))
+    count, labels = graph_components(graph, directed=False)
+    if used is None:
+        return count
+    # Each unused vertex is a component of its own
+    return count - int(vertex_number - np.count_nonzero(used))
+
+def weld_vertices(verts, faces):
+    """
+    Merges the vertices having exactly the same coordinates (STL files store 3 vertices per face).
+    Returns the new (verts, faces) arrays.
+    """
+    unique_verts, inverse = np.unique(verts, axis=0, return_inverse=True)
+    return unique_verts, inverse.reshape(-1)[faces]
+
+def mesh_metrics(verts, faces, topology=True):
+    """
+    Computes every metric of a mesh.
+    Args:
+        verts (ndarray): (V, 3) vertex coordinates.
+        faces (ndarray): (F, 3) triangle vertex indices.
+        topology (bool, optional): If false, only the geometric metrics are computed (volume, area, bounding box).
+    Returns:
+        dict: vertices, faces, volume (signed), surface_area, bbox_min, bbox_max, and if topology is true :
+              edges, euler, boundary_edges, nonmanifold_edges, components.
+    """
+    verts = np.asarray(verts)
+    faces = np.asarray(faces)
+    metrics = dict(vertices=len(verts), faces=len(faces))
+    if len(faces) == 0:
+        return metrics
+    bbox_min, bbox_max = bounding_box(verts)
+    volume, area = _volume_area(verts, faces)
+    metrics.update(
+        volume          = volume,
+        surface_area    = area,
+        bbox_min        = bbox_min.tolist(),
+        bbox_max        = bbox_max.tolist())
+    if topology:
+        edges, counts = edge_counts(faces, len(verts))
+        used = np.bincount(faces.ravel(), minlength=len(verts)) > 0
+        used_number = int(np.count_nonzero(used))
+        metrics.update(
+            edges               = len(edges),
+            euler               = used_number - len(edges) + len(faces),
+            boundary_edges      = int(np.count_nonzero(counts == 1)),
+            nonmanifold_edges   = int(np.count_nonzero(counts > 2)),
+            components          = connected_components(edges, len(verts), used))
+    return metrics
+
+# ----------------------------------
+# Surface distances (accuracy)
+
+def face_areas(verts, faces):
+    """
+    Area of every triangle.
+    """
+    (x0, y0, z0), (x1, y1, z1), (x2, y2, z2) = _corners(verts, faces)
+    ux, uy, uz = x1 - x0, y1 - y0, z1 - z0
+    wx, wy, wz = x2 - x0, y2 - y0, z2 - z0
+    nx, ny, nz = uy*wz - uz*wy, uz*wx - ux*wz, ux*wy - uy*wx
+    return np.sqrt(nx*nx + ny*ny + nz*nz) / 2
+
+def sample_surface(verts, faces, count, seed=0):
+    """
+    Draws "count" points uniformly on the surface of a mesh (faces chosen by area).
+    The cost of the distances then depends on "count", not on the size of the mesh.
+    """
+    verts = np.asarray(verts, dtype=np.float64)
+    faces = np.asarray(faces)
+    if len(faces) == 0:
+        return np.empty((0, 3))
+    rng = np.random.default_rng(seed)
+    areas = face_areas(verts, faces)
+    chosen = np.searchsorted(np.cumsum(areas), rng.random(count) * areas.sum())
+    chosen = np.minimum(chosen, len(faces) - 1)
+    # Uniform barycentric coordinates
+    r1, r2 = np.sqrt(rng.random(count)), rng.random(count)
+    v0, v1, v2 = (verts[faces[chosen, corner]] for corner in range(3))
+    return v0 * (1 - r1)[:, None] + v1 * (r1 * (1 - r2))[:, None] + v2 * (r1 * r2)[:, None]
+
+def label_surface_points(mask, spacing=(1.0, 1.0, 1.0), offset=(0, 0, 0)):
+    """
+    Points of the boundary of a binary label-map : the middle of every voxel edge going from inside to outside.
+    This is where a marching cubes (level 0.5) places its vertices. These points are as far apart as the voxels :
+    a mesh sampled more densely than that is at about half a voxel from them even when it is exact,
+    so use the unprocessed mesh as reference (mesh_distance with a (verts, faces) tuple) to measure small changes.
+    Args:
+        mask (ndarray): Binary 3D array (bool or 0 / 1).
+        spacing (tuple, optional): Voxel size, to get the points in the same unit as the mesh.
+        offset (tuple, optional): Voxel index of mask[0, 0, 0] (see NiiVolume.offset).
+    """
+    mask = np.asarray(mask, dtype=bool)
+    # Outside of the grid counts as background
+    mask = np.pad(mask, 1)
+    points = []
+    for axis in range(3):
+        lower = [slice(None)] * 3
+        upper = [slice(None)] * 3
+        lower[axis] = slice(0, -1)
+        upper[axis] = slice(1, None)
+        index = np.argwhere(mask[tuple(lower)] != mask[tuple(upper)]).astype(np.float64)
+        index[:, axis] += 0.5
+        points.append(index)
+    points = np.concatenate(points) - 1 + np.asarray(offset, dtype=np.float64)
+    return points * np.asarray(spacing, dtype=np.float64)
+
+def surface_distance(points, reference_points, percentile=95, reference_tree=None, workers=-1):
+    """
+    Symmetric distances between two point clouds, with KD-tree queries.
+    Args:
+        points (ndarray): (N, 3) points of the mesh (see sample_surface).
+        reference_points (ndarray): (M, 3) points of the reference (label_surface_points, or another mesh).
+        percentile (float, optional): Percentile of the "hd95" distance. Defaults to 95.
+        reference_tree (cKDTree, optional): KD-tree of reference_points, when it is reused for several meshes.
+        workers (int, optional): Threads of the queries. Defaults to -1 (all cores) : give 1 in a worker process.
+    Returns:
+        dict: hausdorff, hd95 (percentile Hausdorff) and mean_distance (average symmetric surface distance).
+    """
+    from scipy.spatial import cKDTree
+    if reference_tree is None:
+        reference_tree = cKDTree(reference_points)
+    to_reference, _ = reference_tree.query(points, workers=workers)
+    to_mesh, _ = cKDTree(points).query(reference_points, workers=workers)
+    return dict(
+        hausdorff       = float(max(to_reference.max(), to_mesh.max())),
+        hd95            = float(max(np.percentile(to_reference, percentile), np.percentile(to_mesh, percentile))),
+        mean_distance   = float((to_reference.sum() + to_mesh.sum()) / (len(to_reference) + len(to_mesh))))
+
+def mesh_distance(verts, faces, reference, samples=200000, seed=0, workers=-1):
+    """
+    Accuracy of a mesh against a reference : its label-map boundary, or another mesh (for example the unsimplified one).
+    Args:
+        verts, faces (ndarray): The mesh.
+        reference (ndarray / tuple): (M, 3) reference points (label_surface_points), or (verts, faces) of a reference mesh.
+        samples (int, optional): Number of points drawn on each surface (by area, see sample_surface : the vertices
+                                 themselves are not added, so a thin spike can be missed). Defaults to 200000.
+        workers (int, optional): Threads of the KD-tree queries (see surface_distance).
+    Returns:
+        dict: hausdorff, hd95 and mean_distance (same unit as the vertices).
+    """
+    points = sample_surface(verts, faces, samples, seed)
+    if isinstance(reference, tuple):
+        reference = sample_surface(reference[0], reference[1], samples, seed + 1)
+    return surface_distance(points, reference, workers=workers)
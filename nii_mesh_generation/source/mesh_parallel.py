@@ -0,0 +1,83 @@
+# mesh_parallel.py
+
+"""
+Parallel marching cubes : the (cropped) mask is split into blocks, the blocks are meshed on a pool of workers,
+and the block meshes are merged into one watertight mesh.
+
+Two neighbouring blocks share one plane of voxels, so every marching cubes cell belongs to exactly one block
+and no face is made twice. Only the vertices of the shared planes are made twice : like in source/mesh_streaming.py,
+each vertex gets the integer key of its voxel edge and the copies are welded by these keys (exact, no tolerance).
+The merged mesh has the vertices and faces of the serial marching cubes (in another order).
+"""
+
+import numpy as np
+
+from source.mesh_streaming import edge_keys
+
+def block_slices(shape, workers, block_size=None):
+    """
+    Splits a grid of voxels into blocks of cells sharing one plane with their neighbours.
+    Args:
+        shape (tuple): Shape of the grid.
+        workers (int): Number of workers (the default split gives 2 z-slabs per worker).
+        block_size (int / tuple, optional): Number of cells of a block along each axis. Defaults to z-slabs.
+    Returns:
+        list of tuple of slices: The voxels read by each block.
+    """
+    cells = [max(n - 1, 1) for n in shape[:3]]
+    if block_size is None:
+        # z-slabs of at least 8 cells : the blocks stay large enough for the marching cubes to dominate
+        block_size = (cells[0], cells[1], max(-(-cells[2] // (2 * workers)), 8))
+    elif np.isscalar(block_size):
+        block_size = (block_size,) * 3
+    starts = [range(0, c, int(size)) for c, size in zip(cells, block_size)]
+    return [
+        tuple(slice(start, min(start + int(size), c) + 1) for start, size, c in zip(corner, block_size, cells))
+        for corner in ((x, y, z) for x in starts[0] for y in starts[1] for z in starts[2])]
+
+def _block_marching_cubes(block, origin, level):
+    # Runs in a worker
+    from skimage import measure
+    if not block.any() or block.all():
+        return np.empty((0, 3)), np.empty((0, 3), dtype=np.int64)
+    verts, faces, _, _ = measure.marching_cubes(block, level=level)
+    return verts.astype(np.float64) + origin, faces
+
+def parallel_marching_cubes(mask, spacing=(1.0, 1.0, 1.0), workers=None, block_size=None, level=0.5, threads=False):
+    """
+    Runs the marching cubes (skimage) on the blocks of a binary mask in parallel and welds the blocks together.
+    Args:
+        mask (ndarray): Binary mask (uint8), like NiiVolume.mask().
+        spacing (tuple, optional): Voxel spacing, applied to the vertices like the "spacing" of skimage.
+        workers (int, optional): Number of workers. Defaults to the number of CPUs.
+        block_size (int / tuple, optional): Number of cells of a block along each axis (see block_slices).
+        level (float, optional): Iso-level. Must lie strictly between 0 and 1 (the vertices are on edge middles for 0.5 only,
+                                 which the welding needs).
+        threads (bool, optional): If true, the blocks run on a thread pool instead of a process pool (no copy of the blocks,
+                                  but only parallel where skimage releases the GIL).
+    Returns:
+        (verts, faces): The welded mesh, in the voxel coordinates of the mask scaled by "spacing".
+    """
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    from os import cpu_count
+    if level != 0.5:
+        raise ValueError("The parallel marching cubes only supports level = 0.5 (binary masks)")
+    workers = workers or cpu_count() or 1
+    blocks = block_slices(mask.shape, workers, block_size)
+
+    executor = ThreadPoolExecutor if threads else ProcessPoolExecutor
+    with executor(max_workers=min(workers, len(blocks))) as pool:
+        jobs = [pool.submit(_block_marching_cubes, mask[box], tuple(b.start for b in box), level) for box in blocks]
+        results = [job.result() for job in jobs]
+
+    # Faces of every block, indexing the concatenated vertices
+    starts = np.cumsum([0] + [len(verts) for verts, _ in results])
+    grid_verts = np.concatenate([verts for verts, _ in results])
+    faces = np.concatenate([faces + start for (_, faces), start in zip(results, starts)])
+    if len(grid_verts) == 0:
+        return np.empty((0, 3)), np.empty((0, 3), dtype=np.int64)
+
+    # Welding : one vertex per voxel edge
+    _, first, index = np.unique(edge_keys(grid_verts, mask.shape), return_index=True, return_inverse=True)
+    verts = grid_verts[first] * np.asarray(spacing, dtype=np.float64)
+    return verts, index.ravel()[faces]
@@ -0,0 +1,72 @@
+# mesh_result.py
+
+class MeshResult:
+    """
+    Mesh returned by generate_from_nii and by every backend : the volume, the documentation and the
+    visualization run from its arrays, without reading the saved file back.
+
+    Attributes:
+        verts       (ndarray):  (V, 3) vertex coordinates.
+        faces       (ndarray):  (F, 3) triangle vertex indices.
+        mesh_path   (str):      Location of the saved mesh file.
+        metrics     (dict):     Figures of the run (volumes, error, size, time, ...). Filled by generate_from_nii.
+        stages      (list):     Wall / CPU time and vertex / face counts of each stage of the run (see source/mesh_stages.py).
+                                Filled by generate_from_nii.
+    """
+
+    def __init__(self, verts=None, faces=None, mesh_path=None, metrics=None, stages=None):
+        self._verts     = verts
+        self._faces     = faces
+        self.mesh_path  = mesh_path
+        self.metrics    = dict(metrics or {})
+        self.stages     = list(stages or [])
+
+    # A backend that only produces a file (nii2mesh) gives no arrays : the file is then read once, on first use
+    @property
+    def verts(self):
+        if self._verts is None:
+            self._read_file()
+        return self._verts
+
+    @property
+    def faces(self):
+        if self._faces is None:
+            self._read_file()
+        return self._faces
+
+    def load(self):
+        """
+        Makes sure the arrays are in memory (reads the file of a file-only mesh). Returns the mesh itself.
+        """
+        if self._verts is None or self._faces is None:
+            self._read_file()
+        return self
+
+    def _read_file(self):
+        if self.mesh_path is None:
+            raise ValueError("This mesh has neither arrays nor file")
+        import pymeshlab
+        mset = pymeshlab.MeshSet()
+        mset.load_new_mesh(self.mesh_path)
+        mesh = mset.current_mesh()
+        self._verts = mesh.vertex_matrix()
+        self._faces = mesh.face_matrix()
+
+    @property
+    def vertex_number(self):
+        return len(self.verts)
+
+    @property
+    def face_number(self):
+        return len(self.faces)
+
+    def as_dict(self):
+        """
+        Path and metrics of the mesh, without the arrays (for manifests and tables).
+        """
+        return dict(mesh_path=self.mesh_path, **self.metrics)
+
+    def __repr__(self):
+        if self._verts is None or self._faces is None:
+            return f"MeshResult({self.mesh_path!r})"
+        return f"MeshResult({self.mesh_path!r}, {len(self._verts)} vertices, {len(self._faces)} faces)"
@@ -0,0 +1,91 @@
+# mesh_smoothing.py
+
+"""
+Mesh smoothing computed directly on the (verts, faces) arrays, with a sparse (scipy CSR) umbrella operator.
+The operator only depends on the connectivity : it is built once per mesh, then every iteration is one sparse
+matrix product over the (V, 3) vertex array. The same operator can be reused by several smoothings of the same mesh
+(see sweep_mesh_gen.py).
+
+    verts       (ndarray):      (V, 3) vertex coordinates.
+    faces       (ndarray):      (F, 3) triangle vertex indices.
+    operator    (csr_matrix):   (V, V) umbrella operator : operator @ verts = average of the neighbours of each vertex.
+"""
+
+import numpy as np
+
+from source.mesh_metrics import edge_counts
+
+SMOOTHING_METHODS = ("lap", "tau", "hc")
+
+def umbrella_operator(faces, vertex_number):
+    """
+    Builds the umbrella operator of a mesh : row i holds 1 / degree(i) on the neighbours of vertex i.
+    A vertex without neighbours keeps its place (its row is the identity).
+    """
+    from scipy.sparse import csr_matrix
+    edges, _ = edge_counts(faces, vertex_number)
+    rows = np.concatenate((edges[:, 0], edges[:, 1]))
+    cols = np.concatenate((edges[:, 1], edges[:, 0]))
+    degree = np.bincount(rows, minlength=vertex_number)
+    isolated = np.flatnonzero(degree == 0)
+    rows = np.concatenate((rows, isolated))
+    cols = np.concatenate((cols, isolated))
+    weights = 1.0 / np.maximum(degree, 1)
+    return csr_matrix((weights[rows], (rows, cols)), shape=(vertex_number, vertex_number))
+
+def laplacian_smoothing(verts, operator, iterations, lambda_=0.5):
+    """
+    Laplacian smoothing : each vertex moves by "lambda_" towards the average of its neighbours, "iterations" times.
+    Shrinks the mesh a little at each iteration.
+    """
+    verts = np.array(verts, dtype=np.float64)
+    for _ in range(iterations):
+        verts += lambda_ * (operator @ verts - verts)
+    return verts
+
+def taubin_smoothing(verts, operator, iterations, lambda_=0.5, mu=-0.53):
+    """
+    Taubin (lambda / mu) smoothing : each iteration is a shrinking Laplacian step (lambda_ > 0)
+    followed by an inflating one (mu < -lambda_), so the volume is kept.
+    """
+    verts = np.array(verts, dtype=np.float64)
+    for _ in range(iterations):
+        verts += lambda_ * (operator @ verts - verts)
+        verts += mu * (operator @ verts - verts)
+    return verts
+
+def hc_smoothing(verts, operator, iterations, alpha=0.1, beta=0.6):
+    """
+    HC smoothing (Vollmer et al.) : a Laplacian step, then each vertex is pushed back by the difference between
+    its new place and its original / previous place, averaged with its neighbours'. Keeps the volume.
+    """
+    original = np.asarray(verts, dtype=np.float64)
+    verts = original.copy()
+    for _ in range(iterations):
+        previous = verts
+        verts = operator @ previous
+        difference = verts - (alpha * original + (1 - alpha) * previous)
+        verts -= beta * difference + (1 - beta) * (operator @ difference)
+    return verts
+
+def smooth_mesh(verts, faces, method, iterations, operator=None):
+    """
+    Smooths a mesh with one of the methods of SMOOTHING_METHODS.
+    Args:
+        method (str): "lap" (Laplacian), "tau" (Taubin) or "hc" (HC Laplacian).
+        iterations (int): Number of iterations.
+        operator (csr_matrix, optional): Umbrella operator of the mesh, if it was already built (see umbrella_operator).
+    Returns:
+        ndarray: The new (V, 3) vertices (float64). The faces don't change. The input arrays are not modified.
+    """
+    if method not in SMOOTHING_METHODS:
+        raise ValueError(f"Unknown smoothing method : {method}")
+    if iterations <= 0:
+        return np.array(verts, dtype=np.float64)
+    if operator is None:
+        operator = umbrella_operator(faces, len(verts))
+    if method == "lap":
+        return laplacian_smoothing(verts, operator, iterations)
+    if method == "tau":
+        return taubin_smoothing(verts, operator, iterations)
+    return hc_smoothing(verts, operator, iterations)
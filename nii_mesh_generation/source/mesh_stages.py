@@ -0,0 +1,140 @@
+# mesh_stages.py
+
+"""
+Per-stage instrumentation of the mesh generation : wall time, CPU time and vertex / face counts of each stage
+of a run (load, crop, marching_cubes, transform, simplify, smooth, write, metrics, distances, doc, visualize).
+
+generate_from_nii opens a StageRecorder for each run. The backends mark their stages with stage(name) : the stage is
+recorded by the recorder of the current run, and nothing is recorded when the backends are used on their own.
+
+    with stage("smooth", verts, faces) as record:
+        verts = smooth_mesh(verts, faces, "lap", 5)
+        record.output(verts, faces)
+
+Each record is a dict :
+    stage       (str):      Name of the stage.
+    wall_time   (float):    Elapsed time in s.
+    cpu_time    (float):    CPU time of the process in s (all its threads : above wall_time for multi-threaded stages).
+    verts_in, faces_in, verts_out, faces_out (int):  Vertex / face counts before and after the stage (None when they don't apply).
+    error       (str):      Only if the stage raised an exception.
+plus the fields of the stage itself (voxels, cached, workers, mesh_path, ...).
+"""
+
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from os import makedirs, path
+import json
+import time
+import warnings
+
+# Recorder of the run in progress (None outside generate_from_nii)
+_RECORDER = ContextVar("stage_recorder", default=None)
+
+def _count(items):
+    # Number of rows of an array (or an already counted number)
+    if items is None or isinstance(items, int):
+        return items
+    return len(items)
+
+class Stage:
+    """
+    Record of one stage, filled while it runs.
+    """
+
+    def __init__(self, name, verts=None, faces=None):
+        self.fields = dict(stage=name, wall_time=None, cpu_time=None,
+                           verts_in=_count(verts), faces_in=_count(faces), verts_out=None, faces_out=None)
+
+    def output(self, verts=None, faces=None):
+        """
+        Vertex / face counts at the end of the stage (arrays or numbers).
+        """
+        self.fields.update(verts_out=_count(verts), faces_out=_count(faces))
+
+    def update(self, **fields):
+        """
+        Extra fields of the record.
+        """
+        self.fields.update(fields)
+
+class StageRecorder:
+    """
+    Stages of one run.
+    Attributes:
+        stages      (list):     Records of the finished stages, in order.
+        stages_file (str):      If given, every record is appended to this file as a JSON line (with the context).
+        on_stage    (callable): If given, called with every record (with the context) when its stage ends. Its errors are only warnings.
+        context     (dict):     Fields added to the JSON lines and to the callback records (run, input, library, ...).
+    """
+
+    def __init__(self, stages_file=None, on_stage=None, **context):
+        self.stages         = []
+        self.stages_file    = stages_file
+        self.on_stage       = on_stage
+        self.context        = context
+        if stages_file is not None and path.dirname(stages_file):
+            makedirs(path.dirname(stages_file), exist_ok=True)
+
+    @contextmanager
+    def stage(self, name, verts=None, faces=None):
+        """
+        Times the code of the "with" block as the stage "name". "verts" and "faces" are its input (arrays or counts).
+        """
+        record = Stage(name, verts, faces)
+        wall_time, cpu_time = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        except BaseException as e:
+            record.update(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            record.update(wall_time=time.perf_counter() - wall_time, cpu_time=time.process_time() - cpu_time)
+            self.add(record.fields)
+
+    def add(self, fields):
+        """
+        Adds a finished record, and sends it to the JSON lines file and to the callback.
+        """
+        self.stages.append(fields)
+        if self.stages_file is None and self.on_stage is None:
+            return
+        line = dict(self.context, **fields)
+        if self.stages_file is not None:
+            # One write per line : the lines of parallel runs don't mix
+            with open(self.stages_file, "a") as file:
+                file.write(json.dumps(line, default=str) + "\n")
+        if self.on_stage is not None:
+            # A monitoring hook never fails the run
+            try:
+                self.on_stage(line)
+            except Exception as e:
+                warnings.warn(f"on_stage failed on the {fields.get('stage')} stage : {type(e).__name__}: {e}", RuntimeWarning)
+
+    @contextmanager
+    def activate(self):
+        """
+        Makes this recorder the one used by stage() in the "with" block.
+        """
+        token = _RECORDER.set(self)
+        try:
+            yield self
+        finally:
+            _RECORDER.reset(token)
+
+def stage(name, verts=None, faces=None):
+    """
+    Times a stage in the recorder of the current run (see StageRecorder.stage). Outside a run, the record is not kept.
+    """
+    recorder = _RECORDER.get()
+    if recorder is None:
+        return nullcontext(Stage(name, verts, faces))
+    return recorder.stage(name, verts, faces)
+
+def stage_totals(stages):
+    """
+    Wall time of each stage name, summed over the records ({name: seconds}, in the order of the stages).
+    """
+    totals = {}
+    for record in stages:
+        totals[record["stage"]] = totals.get(record["stage"], 0) + record["wall_time"]
+    return totals
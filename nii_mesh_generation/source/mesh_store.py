@@ -0,0 +1,99 @@
+# mesh_store.py
+
+"""
+Store of the (verts, faces) arrays of mesh files, as raw .npy files read through memory maps.
+
+The first load of a mesh file parses it (once) and stores its arrays in a sidecar folder (".mesh_store" next to the
+file by default). The next loads memory-map the .npy files : nothing is parsed or copied, the pages are only read
+when they are used, and every process opening the same mesh shares the same pages of the OS cache.
+An entry is tied to the size and modification time of its mesh file : a file written again is parsed again.
+"""
+
+from os import makedirs, path, listdir, replace, remove, stat, getpid
+import hashlib
+import re
+
+STORE_FOLDER = ".mesh_store"
+# Ends of the 2 files of an entry
+ENTRY_ENDS = (".verts.npy", ".faces.npy")
+
+def store_location(mesh_file, store_dir=None):
+    """
+    Location of the entry of a mesh file, without the ".verts.npy" / ".faces.npy" ends.
+    """
+    mesh_file = path.abspath(mesh_file)
+    if store_dir is None:
+        store_dir = path.join(path.dirname(mesh_file), STORE_FOLDER)
+    info = stat(mesh_file)
+    digest = hashlib.blake2b(repr((mesh_file, info.st_size, info.st_mtime_ns)).encode(), digest_size=8).hexdigest()
+    return path.join(store_dir, f"{path.basename(mesh_file)}.{digest}")
+
+def store_mesh(mesh_file, verts, faces, store_dir=None):
+    """
+    Stores the arrays of a mesh file (for example right after saving it), replacing the older entries of the file.
+    """
+    import numpy as np
+    entry = store_location(mesh_file, store_dir)
+    folder, name = path.split(entry)
+    makedirs(folder, exist_ok=True)
+    # Older entries of the same file (written before the file changed) : "<file name>.<digest>.verts.npy" and
+    # ".faces.npy" exactly, so the entries of "mesh.obj.bak" are not taken for entries of "mesh.obj"
+    entry_name = re.compile(re.escape(path.basename(mesh_file)) + r"\.[0-9a-f]{16}"
+                            + "(" + "|".join(map(re.escape, ENTRY_ENDS)) + ")$")
+    current = {name + end for end in ENTRY_ENDS}
+    for old in listdir(folder):
+        if entry_name.match(old) and old not in current:
+            try:
+                remove(path.join(folder, old))
+            except FileNotFoundError:
+                pass
+    # Written under temporary names, then renamed : parallel runs never read a half-written entry
+    for end, array in zip(ENTRY_ENDS, (verts, faces)):
+        tmp_file = f"{entry}.{getpid()}.tmp"
+        with open(tmp_file, "wb") as out:
+            np.save(out, np.ascontiguousarray(array))
+        replace(tmp_file, entry + end)
+
+def load_stored(mesh_file, store_dir=None, mmap=True):
+    """
+    Returns the stored (verts, faces) arrays of a mesh file (memory-mapped, read-only), or None if they are not stored.
+    """
+    import numpy as np
+    entry = store_location(mesh_file, store_dir)
+    try:
+        return tuple(np.load(entry + end, mmap_mode="r" if mmap else None) for end in ENTRY_ENDS)
+    except (FileNotFoundError, OSError, ValueError):
+        return None
+
+def read_mesh_file(mesh_file):
+    """
+    Parses a mesh file (any type pymeshlab reads). Returns the (verts, faces) arrays.
+    """
+    import pymeshlab
+    mset = pymeshlab.MeshSet()
+    mset.load_new_mesh(mesh_file)
+    mesh = mset.current_mesh()
+    return mesh.vertex_matrix(), mesh.face_matrix()
+
+def load_mesh(mesh_file, store_dir=None, reader=None, mmap=True):
+    """
+    Loads the (verts, faces) arrays of a mesh file through the store : parsed and stored on the first load,
+    memory-mapped from the store afterwards.
+    Args:
+        mesh_file (str): Location of the mesh file.
+        store_dir (str, optional): Folder of the store. Defaults to a ".mesh_store" folder next to the mesh file.
+        reader (callable, optional): Parser used on the first load (mesh_file -> (verts, faces)). Defaults to read_mesh_file.
+        mmap (bool, optional): If false, the stored arrays are read in memory instead of memory-mapped.
+    Returns:
+        (verts, faces): The arrays. Memory-mapped arrays are read-only.
+    """
+    stored = load_stored(mesh_file, store_dir, mmap)
+    if stored is not None:
+        return stored
+    verts, faces = (reader or read_mesh_file)(mesh_file)
+    try:
+        store_mesh(mesh_file, verts, faces, store_dir)
+    except OSError:
+        # Read-only folder : the mesh is still given, only the next load will parse it again
+        return verts, faces
+    return load_stored(mesh_file, store_dir, mmap) or (verts, faces)
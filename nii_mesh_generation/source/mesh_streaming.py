@@ -0,0 +1,126 @@
+# mesh_streaming.py
+
+"""
+Out-of-core marching cubes : the label-map is read in z-slabs (from the nibabel proxy or a memory-mapped .nii),
+each slab is meshed on its own and the mesh is given back chunk by chunk, so a writer can stream it to disk.
+The memory used depends on the slab size, not on the size of the volume.
+
+Two slabs share one plane of voxels (the top plane of a slab is the bottom plane of the next one).
+The vertices of a binary marching cubes (level 0.5) lie in the middle of a voxel edge : each one gets the integer
+key of its edge, and the vertices of the shared plane are welded to the ones of the previous slab by these keys.
+The welded mesh has exactly the vertices and faces of a marching cubes on the whole volume.
+"""
+
+import numpy as np
+
+from source.nii_volume import load_volume, transform_points
+
+def slab_bounding_box(array, slab_size=64, pad=1):
+    """
+    Bounding box of the nonzero voxels (plus "pad" voxels, clipped to the grid) and number of nonzero voxels,
+    reading the array one z-slab at a time.
+    Returns:
+        (tuple of slices, int): The box (None if the array is empty) and the voxel count.
+    """
+    nx, ny, nz = array.shape[:3]
+    xy = np.zeros((nx, ny), dtype=bool)
+    z_any = np.zeros(nz, dtype=bool)
+    count = 0
+    for z0 in range(0, nz, slab_size):
+        block = np.asarray(array[:, :, z0:z0 + slab_size]) != 0
+        xy |= block.any(axis=2)
+        z_any[z0:z0 + block.shape[2]] = block.any(axis=(0, 1))
+        count += int(np.count_nonzero(block))
+    xs, ys, zs = np.flatnonzero(xy.any(axis=1)), np.flatnonzero(xy.any(axis=0)), np.flatnonzero(z_any)
+    if xs.size == 0:
+        return None, 0
+    box = tuple(
+        slice(max(int(idx[0]) - pad, 0), min(int(idx[-1]) + 1 + pad, n))
+        for idx, n in zip((xs, ys, zs), (nx, ny, nz)))
+    return box, count
+
+def edge_keys(grid_verts, shape):
+    """
+    Integer key of the voxel edge holding every vertex (vertices in voxel index coordinates, on edge middles).
+    """
+    doubled = np.rint(np.asarray(grid_verts) * 2).astype(np.int64)
+    ny, nz = 2 * shape[1] + 1, 2 * shape[2] + 1
+    return (doubled[:, 0] * ny + doubled[:, 1]) * nz + doubled[:, 2]
+
+def stream_marching_cubes(input_file, slab_size=64, grid_scale=None, box=None):
+    """
+    Runs the marching cubes slab by slab and yields the mesh in chunks.
+    Args:
+        input_file (str / NiiVolume / ...): The label-map (see load_volume). A file is read through its proxy.
+        slab_size (int, optional): Number of voxel planes meshed at once. Defaults to 64.
+        grid_scale (tuple, optional): Voxel spacing forced instead of the header's (see marching_cubes).
+        box (tuple of slices, optional): Part of the grid to mesh (see slab_bounding_box). Defaults to the whole grid.
+    Yields:
+        (verts, faces): The new vertices of the slab (in mesh coordinates), and its faces, indexing the vertices
+                        of the whole mesh (vertices of the previous chunks included).
+    """
+    from skimage import measure
+    volume = load_volume(input_file, lazy=True)
+    if box is None:
+        box = tuple(slice(0, n) for n in volume.shape[:3])
+    (x0, x1), (y0, y1), (z_start, z_stop) = ((b.start, b.stop) for b in box)
+    spacing = np.asarray(volume.spacing(grid_scale))
+    matrix = volume.mesh_matrix(grid_scale)
+    flip = np.linalg.det(matrix[:3, :3]) < 0
+    # Vertices of the top plane of the previous slab, sorted by key
+    seam_keys = seam_index = np.empty(0, dtype=np.int64)
+    vertex_number = 0
+
+    for z0 in range(z_start, z_stop - 1, slab_size):
+        z1 = min(z0 + slab_size, z_stop - 1)
+        mask = (np.asarray(volume.array[x0:x1, y0:y1, z0:z1 + 1]) != 0).view(np.uint8)
+        if not mask.any() or mask.all():
+            # No surface in this slab (and none on its planes)
+            seam_keys = seam_index = np.empty(0, dtype=np.int64)
+            continue
+        verts, faces, _, _ = measure.marching_cubes(mask, level=0.5)
+        grid_verts = verts.astype(np.float64) + (x0, y0, z0)
+        keys = edge_keys(grid_verts, volume.shape)
+
+        # Welding : the vertices of the bottom plane were given by the previous slab
+        global_index = np.empty(len(verts), dtype=np.int64)
+        bottom = grid_verts[:, 2] == z0
+        if seam_keys.size and bottom.any():
+            global_index[bottom] = seam_index[np.searchsorted(seam_keys, keys[bottom])]
+        else:
+            bottom[:] = False
+        new = ~bottom
+        global_index[new] = vertex_number + np.arange(np.count_nonzero(new))
+        vertex_number += int(np.count_nonzero(new))
+
+        top = grid_verts[:, 2] == z1
+        order = np.argsort(keys[top])
+        seam_keys, seam_index = keys[top][order], global_index[top][order]
+
+        faces = global_index[faces]
+        if flip:
+            faces = faces[:, ::-1]
+        yield transform_points(grid_verts[new] * spacing, matrix), np.ascontiguousarray(faces)
+
+def save_obj_stream(chunks, out_file):
+    """
+    Writes the chunks of stream_marching_cubes to an .obj file as they come (vertices, then the faces of each chunk),
+    and measures the mesh on the way.
+    Returns:
+        dict: vertices, faces and volume (signed) of the mesh.
+    """
+    from source.mesh_metrics import signed_volume
+    from source.mesh_writers import write_obj_rows
+    vertex_number, face_number, volume = 0, 0, 0.0
+    # Vertices of the previous chunk : the faces of a chunk only use them and its own
+    previous, previous_start = np.empty((0, 3)), 0
+    with open(out_file, "w", buffering=1 << 20) as file:
+        for verts, faces in chunks:
+            # The faces index the vertices of the whole mesh : their OBJ index starts at 1
+            write_obj_rows(file, verts, faces, first_index=1)
+            window = np.concatenate((previous, verts))
+            volume += signed_volume(window, faces - previous_start)
+            previous, previous_start = verts, vertex_number
+            vertex_number += len(verts)
+            face_number += len(faces)
+    return dict(vertices=vertex_number, faces=face_number, volume=volume)
@@ -1,4 +1,24 @@
 from os import chdir, getcwd
+import sys
+
+def peak_rss():
+    """
+    Returns the peak resident memory of the current process in MB, or None if the OS does not provide it.
+    """
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux gives kilo-bytes, Mac OS gives bytes
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
 
 def show_obj(mesh_path):
     from vedo import load, Plotter
@@ -11,6 +31,28 @@ def show_obj(mesh_path):
     plt.show(interactive=True)
     plt.close()
     
+def show_mesh(verts, faces, title=""):
+    """
+    Shows a mesh from its arrays (the saved file is not read back).
+    """
+    from vedo import Mesh, Plotter
+    print("_____________________")
+    print(title)
+    mesh = Mesh([verts, faces]).color('gray')
+    plt = Plotter(bg='lightgray')
+    plt += mesh
+    plt.title=title
+    plt.show(interactive=True)
+    plt.close()
+
+def vol_mesh(verts, faces):
+    """
+    Volume of a closed triangle mesh, computed directly from its arrays (no file is read).
+    (See source/mesh_metrics.py for the other metrics.)
+    """
+    from source.mesh_metrics import signed_volume
+    return abs(signed_volume(verts, faces))
+
 def vol_obj(file_path):
     import vtk
     reader = vtk.vtkOBJReader()
@@ -38,7 +80,8 @@ def doc_obj(
     smooth_val,
     simplify,
     simply_val,
-    elapsed_time):
+    elapsed_time,
+    peak_memory = None):
     
     import datetime
     current_date_time = datetime.datetime.now().strftime("%m/%d/%Y - %H:%M:%S")
@@ -62,6 +105,8 @@ def doc_obj(
         file.write("simply_val\t: {}\n\n".format(simply_val))
         file.write("--- OTHER ---\n")
         file.write("\nElapsed time\t: {} s\n".format(elapsed_time))
+        if peak_memory is not None:
+            file.write("Peak memory\t: {} MB\n".format(round(peak_memory, 1)))
         file.write("Date\t: {}\n".format(current_date_time))
         file.write("\n{}".format(mesh_path))
     
@@ -69,3 +114,42 @@ def doc_obj(
     chdir(dir)
 
         
+
+def doc_table(output_folder, name, rows):
+    """
+    Saves a table of results as a .tsv file (per-label volumes of a multi-label run, variants of a sweep, ...).
+    Args:
+        output_folder (str): Folder of the table.
+        name (str): Name of the table (without extension).
+        rows (list of dict): One dictionary per line, with the same keys.
+    """
+    from os import path
+    if not rows:
+        return None
+    table_path = path.join(output_folder, name + ".tsv")
+    columns = list(rows[0].keys())
+    with open(table_path, "w") as file:
+        file.write("\t".join(columns) + "\n")
+        for row in rows:
+            file.write("\t".join(str(row[c]) for c in columns) + "\n")
+    print("table saved successfully as : \n" + table_path)
+    return table_path
+
+def bundle_obj(meshes, object_names, out_file):
+    """
+    Bundles several meshes into one multi-object .obj file (one "o" object per mesh).
+    Args:
+        meshes (list of tuple): (verts, faces) arrays of each mesh.
+        object_names (list of str): Name of each object.
+        out_file (str): Location of the bundled file.
+    """
+    from source.mesh_writers import write_obj_rows
+    # Every face index is shifted by the number of vertices of the previous meshes (and starts at 1)
+    count = 1
+    with open(out_file, "w", buffering=1 << 20) as out:
+        for (verts, faces), object_name in zip(meshes, object_names):
+            out.write(f"o {object_name}\n")
+            write_obj_rows(out, verts, faces, first_index=count)
+            count += len(verts)
+    print(out_file + " saved successfully")
+    return out_file
@@ -0,0 +1,174 @@
+# mesh_writers.py
+
+"""
+Mesh writers working directly on the (verts, faces) arrays, shared by every library (see save_mesh).
+The binary formats are written from NumPy buffers (tobytes) : no Python formatting per face.
+The OBJ text is formatted by chunks of rows, with one string formatting per chunk.
+
+    verts   (ndarray):  (V, 3) vertex coordinates.
+    faces   (ndarray):  (F, 3) triangle vertex indices.
+"""
+
+import json
+import os
+import struct
+import tempfile
+from os import path
+
+import numpy as np
+
+from source.mesh_stages import stage
+
+# Rows of the OBJ text formatted at once
+OBJ_CHUNK = 65536
+
+def write_obj_rows(file, verts, faces, first_index=1, chunk_size=OBJ_CHUNK):
+    """
+    Writes the "v" rows, then the "f" rows of a mesh in an open text file.
+    "first_index" is the OBJ index of verts[0] (1, or more after the vertices of other objects of the same file).
+    """
+    verts = np.asarray(verts, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64)
+    for start in range(0, len(verts), chunk_size):
+        chunk = verts[start:start + chunk_size]
+        file.write(("v %.6f %.6f %.6f\n" * len(chunk)) % tuple(chunk.ravel().tolist()))
+    for start in range(0, len(faces), chunk_size):
+        chunk = faces[start:start + chunk_size] + first_index
+        file.write(("f %d %d %d\n" * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+def write_obj(verts, faces, out_file, chunk_size=OBJ_CHUNK):
+    """
+    Wavefront OBJ (text, vertices and faces only).
+    """
+    with open(out_file, "w", buffering=1 << 20) as file:
+        write_obj_rows(file, verts, faces, chunk_size=chunk_size)
+    return out_file
+
+def face_normals(verts, faces):
+    """
+    Unit normal of every face (zero for degenerate faces). Returns a (F, 3) array.
+    """
+    v0, v1, v2 = (verts[faces[:, corner]] for corner in range(3))
+    normals = np.cross(v1 - v0, v2 - v0)
+    normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-30)[:, None]
+    return normals
+
+def write_stl(verts, faces, out_file):
+    """
+    Binary STL : 80-byte header, face count, then 50 bytes per face (normal, 3 corners, attribute).
+    """
+    verts = np.asarray(verts, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64)
+    records = np.zeros(len(faces), dtype=np.dtype([("normal", "<f4", (3,)), ("corners", "<f4", (3, 3)), ("attribute", "<u2")]))
+    records["normal"] = face_normals(verts, faces)
+    records["corners"] = verts[faces]
+    with open(out_file, "wb") as file:
+        file.write(b"binary STL".ljust(80, b" "))
+        file.write(struct.pack("<I", len(faces)))
+        file.write(memoryview(records).cast("B"))
+    return out_file
+
+def write_ply(verts, faces, out_file):
+    """
+    Binary little-endian PLY (float32 vertices, one uchar-counted int32 list per face).
+    """
+    vertex_records = np.ascontiguousarray(verts, dtype="<f4")
+    face_records = np.empty(len(faces), dtype=np.dtype([("count", "u1"), ("indices", "<i4", (3,))]))
+    face_records["count"] = 3
+    face_records["indices"] = faces
+    header = (
+        "ply\n"
+        "format binary_little_endian 1.0\n"
+        f"element vertex {len(vertex_records)}\n"
+        "property float x\n"
+        "property float y\n"
+        "property float z\n"
+        f"element face {len(face_records)}\n"
+        "property list uchar int vertex_indices\n"
+        "end_header\n")
+    with open(out_file, "wb") as file:
+        file.write(header.encode("ascii"))
+        file.write(vertex_records.tobytes())
+        file.write(face_records.tobytes())
+    return out_file
+
+def write_glb(verts, faces, out_file):
+    """
+    Binary glTF 2.0 (.glb) : one mesh, float32 positions and uint32 indices in a single binary buffer.
+    The coordinates are written as they are (glTF viewers expect meters, y up).
+    """
+    positions = np.ascontiguousarray(verts, dtype="<f4")
+    indices = np.ascontiguousarray(faces, dtype="<u4")
+    binary = positions.tobytes() + indices.tobytes()
+    gltf = {
+        "asset": {"version": "2.0", "generator": "nii_mesh_gen"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0}],
+        "meshes": [{"primitives": [{"attributes": {"POSITION": 0}, "indices": 1, "mode": 4}]}],
+        "buffers": [{"byteLength": len(binary)}],
+        "bufferViews": [
+            {"buffer": 0, "byteOffset": 0, "byteLength": positions.nbytes, "target": 34962},
+            {"buffer": 0, "byteOffset": positions.nbytes, "byteLength": indices.nbytes, "target": 34963}],
+        "accessors": [
+            {"bufferView": 0, "componentType": 5126, "count": len(positions), "type": "VEC3",
+             "min": positions.min(axis=0).tolist() if len(positions) else [0, 0, 0],
+             "max": positions.max(axis=0).tolist() if len(positions) else [0, 0, 0]},
+            {"bufferView": 1, "componentType": 5125, "count": indices.size, "type": "SCALAR"}]}
+    # Both chunks are padded to 4 bytes (spaces for the JSON, zeros for the binary buffer)
+    text = json.dumps(gltf, separators=(",", ":")).encode("utf-8")
+    text += b" " * (-len(text) % 4)
+    binary += b"\0" * (-len(binary) % 4)
+    with open(out_file, "wb") as file:
+        file.write(struct.pack("<III", 0x46546C67, 2, 12 + 8 + len(text) + 8 + len(binary)))
+        file.write(struct.pack("<II", len(text), 0x4E4F534A))
+        file.write(text)
+        file.write(struct.pack("<II", len(binary), 0x004E4942))
+        file.write(binary)
+    return out_file
+
+WRITERS = {"obj": write_obj, "stl": write_stl, "ply": write_ply, "glb": write_glb}
+
+def claim_path(tmp_file, out_dir, out_name, out_type):
+    """
+    Moves a finished file into out_dir as "<out_name>.<out_type>" (or "<out_name>_<n>.<out_type>" if it already exists),
+    without ever replacing a file : two jobs with the same name at the same time get two different files.
+    Returns the new location.
+    """
+    suffix = 0
+    while True:
+        new_file = path.join(out_dir, f"{out_name}.{out_type}" if suffix == 0 else f"{out_name}_{suffix}.{out_type}")
+        try:
+            if os.name == "nt":
+                # Fails if the file exists
+                os.rename(tmp_file, new_file)
+            else:
+                # A hard link fails if the file exists (a rename would replace it)
+                os.link(tmp_file, new_file)
+                os.remove(tmp_file)
+            return new_file
+        except FileExistsError:
+            suffix += 1
+
+def write_new_file(write, out_dir, out_name, out_type):
+    """
+    Writes a new file with write(location) under a temporary name inside out_dir, then moves it to
+    "<out_name>.<out_type>" (or "<out_name>_<n>.<out_type>", see claim_path). Returns the new location.
+    """
+    with tempfile.TemporaryDirectory(prefix=".mesh_", dir=out_dir or ".") as tmp_out:
+        tmp_file = path.join(tmp_out, f"{out_name}.{out_type}")
+        write(tmp_file)
+        return claim_path(tmp_file, out_dir, out_name, out_type)
+
+def save_mesh(verts, faces, out_dir=".", out_name="", out_type="obj"):
+    """
+    Saves a mesh with the writer of its type (see WRITERS) and returns its path.
+    An existing file is not overwritten : a suffix is added to the name instead.
+    """
+    if out_type not in WRITERS:
+        raise ValueError(f"Unknown mesh type : {out_type} (available : {', '.join(WRITERS)})")
+    with stage("write", verts, faces) as record:
+        new_file = write_new_file(lambda tmp_file: WRITERS[out_type](verts, faces, tmp_file), out_dir, out_name, out_type)
+        record.update(mesh_path=new_file, out_type=out_type)
+    print(new_file + " saved successfully")
+    return new_file
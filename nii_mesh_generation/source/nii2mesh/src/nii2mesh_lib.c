@@ -0,0 +1,73 @@
+// Shared library interface of nii2mesh : the same pipeline as nii2() in nii2mesh.c, on a voxel buffer
+// given by the caller, with the mesh given back as buffers instead of a file.
+// make lib  -->  libnii2mesh.so
+// gcc -O3 -fPIC -shared -DNII2MESH -DHAVE_ZLIB nii2mesh_lib.c MarchingCubes.c isolevel.c meshify.c quadric.c base64.c bwlabel.c radixsort.c -o libnii2mesh.so -lz -lm
+
+#include <stdbool.h>
+#include <stdlib.h>
+#include <stdio.h>
+#include <math.h>
+#include "meshify.h"
+#include "quadric.h"
+#include "isolevel.h"
+#include "meshtypes.h"
+
+#ifdef _WIN32
+	#define NII2MESH_API __declspec(dllexport)
+#else
+	#define NII2MESH_API __attribute__((visibility("default")))
+#endif
+
+#define NII2MESH_LIB_VERSION 1
+
+NII2MESH_API int nii2mesh_version(void) {
+	return NII2MESH_LIB_VERSION;
+}
+
+// img: voxels (x fastest, like the NIfTI file), dim[0]*dim[1]*dim[2] floats. Modified in place (smoothing, clustering).
+// srow: 3x4 voxel -> world matrix (srow_x, srow_y, srow_z of the header).
+// isolevel: NAN to choose it like the command line (Otsu, medium).
+// reduceFraction, preSmooth, onlyLargest, fillBubbles, postSmooth, quality, originalMC: see the -r -p -l -b -s -q -o options.
+// pts, tris: set to buffers of npt * 3 doubles and ntri * 3 ints, to be released with nii2mesh_free.
+// Returns 0 (EXIT_SUCCESS) or 1 (EXIT_FAILURE : no surface).
+NII2MESH_API int nii2mesh_run(float *img, const size_t dim[3], const float srow[12], float isolevel, float reduceFraction,
+		int preSmooth, int onlyLargest, int fillBubbles, int postSmooth, int quality, int originalMC, int verbose,
+		double **pts, int **tris, int *npt, int *ntri) {
+	vec3d *p = NULL;
+	vec3i *t = NULL;
+	int nt = 0, np = 0;
+	size_t d[3] = {dim[0], dim[1], dim[2]};
+	float srow_x[4] = {srow[0], srow[1], srow[2], srow[3]};
+	float srow_y[4] = {srow[4], srow[5], srow[6], srow[7]};
+	float srow_z[4] = {srow[8], srow[9], srow[10], srow[11]};
+	*pts = NULL;
+	*tris = NULL;
+	*npt = 0;
+	*ntri = 0;
+	if (isnan(isolevel))
+		isolevel = setThreshold(img, (int)(d[0] * d[1] * d[2]), 2);
+	if (meshify(img, d, originalMC, isolevel, &t, &p, &nt, &np, preSmooth, onlyLargest, fillBubbles, verbose) != EXIT_SUCCESS)
+		return EXIT_FAILURE;
+	apply_sform(t, p, nt, np, srow_x, srow_y, srow_z);
+	if (postSmooth > 0)
+		laplacian_smoothHC(p, t, np, nt, 0.1, 0.5, postSmooth, true);
+	if ((reduceFraction < 1.0) || (quality > 1)) {
+		double agressiveness = 7.0;
+		if (quality == 0)
+			agressiveness = 8.0;
+		if (quality == 2)
+			agressiveness = 5.0;
+		int target_count = round((float)nt * reduceFraction);
+		quadric_simplify_mesh(&p, &t, &np, &nt, target_count, agressiveness, verbose, (quality > 1));
+	}
+	// vec3d / vec3i are plain triplets : the buffers are given as they are
+	*pts = (double *) p;
+	*tris = (int *) t;
+	*npt = np;
+	*ntri = nt;
+	return EXIT_SUCCESS;
+}
+
+NII2MESH_API void nii2mesh_free(void *buffer) {
+	free(buffer);
+}
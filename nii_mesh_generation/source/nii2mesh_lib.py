@@ -0,0 +1,178 @@
+# nii2mesh_lib.py
+
+"""
+In-process nii2mesh : the C sources of nii2mesh (source/nii2mesh/src) built as a shared library (libnii2mesh.so,
+"make lib") and called through ctypes. The voxels are given as a buffer and the mesh comes back as NumPy arrays :
+no process, no NIFTI file written and read again, no mesh file moved around.
+The pipeline is the one of the nii2mesh command (pre-smoothing, largest cluster, marching cubes, sform,
+HC smoothing, quadric simplification). The GIL is released during the call.
+The C code prints on file descriptor 1, out of reach of sys.stdout : this output is captured and printed again,
+so that it follows redirect_stdout (the "log" of the warm daemon) like the output of the nii2mesh command.
+
+The library is built on first use when it is missing (needs make and a C compiler with zlib, Linux / Mac OS).
+"""
+
+import sys
+import threading
+from contextlib import contextmanager
+from os import path
+
+import numpy as np
+
+from source.mesh_stages import stage
+from source.nii_volume import load_volume
+
+SOURCE_DIR = path.join(path.dirname(path.abspath(__file__)), "nii2mesh", "src")
+LIBRARY_FILE = path.join(SOURCE_DIR, "libnii2mesh.so")
+LIBRARY_VERSION = 1
+
+# Loaded library (once per process)
+_library = None
+# File descriptor 1 is shared by the whole process : one capture at a time
+_output_lock = threading.Lock()
+
+def build_library(force=False):
+    """
+    Builds the shared library from the C sources ("make lib" in source/nii2mesh/src). Returns its location.
+    """
+    import subprocess
+    from os import getpid, replace
+    if sys.platform == "win32":
+        raise OSError("The nii2mesh library is only built on Linux / Mac OS (use nii2mesh.exe on Windows)")
+    if path.isfile(LIBRARY_FILE) and not force:
+        return LIBRARY_FILE
+    # Built under a name of its own, then renamed : worker processes building it at the same time never load a half-written file
+    tmp_name = f"libnii2mesh.{getpid()}.tmp.so"
+    try:
+        result = subprocess.run(["make", "lib", f"LIBNAME={tmp_name}"], cwd=SOURCE_DIR, capture_output=True, text=True)
+    except FileNotFoundError:
+        raise OSError("make is needed to build the nii2mesh library") from None
+    tmp_file = path.join(SOURCE_DIR, tmp_name)
+    if result.returncode != 0 or not path.isfile(tmp_file):
+        raise OSError(f"Unable to build the nii2mesh library :\n{result.stderr}")
+    replace(tmp_file, LIBRARY_FILE)
+    return LIBRARY_FILE
+
+def load_library(build=True):
+    """
+    Loads the shared library (building it first if "build" is true and it is missing). Returns the ctypes library.
+    """
+    global _library
+    if _library is not None:
+        return _library
+    import ctypes
+    if build:
+        build_library()
+    library = ctypes.CDLL(LIBRARY_FILE)
+    if library.nii2mesh_version() != LIBRARY_VERSION:
+        raise OSError("The nii2mesh library is out of date : rebuild it with build_library(force=True)")
+    c_int, c_float, c_void_p = ctypes.c_int, ctypes.c_float, ctypes.c_void_p
+    library.nii2mesh_run.restype = c_int
+    library.nii2mesh_run.argtypes = [
+        ctypes.POINTER(c_float), ctypes.POINTER(ctypes.c_size_t), ctypes.POINTER(c_float), c_float, c_float,
+        c_int, c_int, c_int, c_int, c_int, c_int, c_int,
+        ctypes.POINTER(ctypes.POINTER(ctypes.c_double)), ctypes.POINTER(ctypes.POINTER(c_int)),
+        ctypes.POINTER(c_int), ctypes.POINTER(c_int)]
+    library.nii2mesh_free.restype = None
+    library.nii2mesh_free.argtypes = [c_void_p]
+    _library = library
+    return library
+
+def library_available(build=True):
+    """
+    True if the in-process nii2mesh can be used (the library loads, after being built if needed).
+    """
+    try:
+        load_library(build)
+    except OSError:
+        return False
+    return True
+
+def nii2mesh_arrays(
+        input_file,
+        smooth_val      = 0,
+        simply_val      = 100,
+        crop            = True,
+        isolevel        = None,
+        pre_smooth      = True,
+        only_largest    = True,
+        fill_bubbles    = False,
+        quality         = 1,
+        original_mc     = False,
+        verbose         = False):
+    """
+    Runs nii2mesh in-process on a label-map.
+    Args:
+        input_file (str / NiiVolume / ...): The label-map (see load_volume). Its nonzero voxels are meshed.
+        smooth_val (int, optional): HC smoothing iterations (nii2mesh's -s option).
+        simply_val (float, optional): Percentage of the faces kept (nii2mesh's -r option, times 100).
+        crop (bool, optional): If true, only the bounding box of the label (plus 1 voxel) is given to nii2mesh.
+        isolevel (float, optional): Iso-level. Defaults to the one of the nii2mesh command (Otsu threshold).
+        pre_smooth, only_largest, fill_bubbles, quality, original_mc : nii2mesh's -p, -l, -b, -q and -o options.
+    Returns:
+        (verts, faces): The mesh, in the world coordinates of the header (like the nii2mesh command).
+    """
+    library = load_library()
+    volume = load_volume(input_file)
+    if crop:
+        with stage("crop") as record:
+            volume = volume.crop()
+            record.update(shape=volume.shape)
+    with stage("marching_cubes") as record:
+        verts, faces = _run_library(library, volume, smooth_val, simply_val, isolevel,
+                                    pre_smooth, only_largest, fill_bubbles, quality, original_mc, verbose)
+        # Smoothing and simplification run inside the library : they are part of this stage
+        record.output(verts, faces)
+        record.update(in_process=True, smooth_val=smooth_val, simply_val=simply_val)
+    return verts, faces
+
+def _run_library(library, volume, smooth_val, simply_val, isolevel,
+                 pre_smooth, only_largest, fill_bubbles, quality, original_mc, verbose):
+    import ctypes
+    # nii2mesh reads the voxels x fastest, like the NIFTI file
+    img = np.ravel(volume.mask(), order="F").astype(np.float32)
+    dim = (ctypes.c_size_t * 3)(*volume.shape[:3])
+    srow = np.ascontiguousarray(volume.file_affine()[:3], dtype=np.float32)
+    pts, tris = ctypes.POINTER(ctypes.c_double)(), ctypes.POINTER(ctypes.c_int)()
+    npt, ntri = ctypes.c_int(), ctypes.c_int()
+    with _captured_output():
+        status = library.nii2mesh_run(
+            img.ctypes.data_as(ctypes.POINTER(ctypes.c_float)), dim, srow.ctypes.data_as(ctypes.POINTER(ctypes.c_float)),
+            float("nan") if isolevel is None else isolevel, simply_val / 100,
+            int(pre_smooth), int(only_largest), int(fill_bubbles), int(smooth_val), int(quality), int(original_mc),
+            int(verbose), ctypes.byref(pts), ctypes.byref(tris), ctypes.byref(npt), ctypes.byref(ntri))
+    if status != 0:
+        raise ValueError("nii2mesh found no surface in the label-map")
+    try:
+        # Copied out of the C buffers, which are released right after
+        verts = np.ctypeslib.as_array(pts, shape=(npt.value, 3)).copy()
+        faces = np.ctypeslib.as_array(tris, shape=(ntri.value, 3)).astype(np.int64)
+    finally:
+        library.nii2mesh_free(pts)
+        library.nii2mesh_free(tris)
+    return verts, faces
+
+@contextmanager
+def _captured_output():
+    """
+    Sends file descriptor 1 to a temporary file in the "with" block, then prints what was written there.
+    """
+    import ctypes
+    import os
+    import tempfile
+    libc = ctypes.CDLL(None)
+    with _output_lock, tempfile.TemporaryFile() as capture:
+        sys.stdout.flush()
+        saved = os.dup(1)
+        os.dup2(capture.fileno(), 1)
+        try:
+            yield
+        finally:
+            # The C stdio buffer is emptied before file descriptor 1 is given back
+            libc.fflush(None)
+            os.dup2(saved, 1)
+            os.close(saved)
+        capture.seek(0)
+        text = capture.read().decode(errors="replace")
+    if text:
+        print(text, end="")
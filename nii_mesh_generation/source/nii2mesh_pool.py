@@ -0,0 +1,80 @@
+# nii2mesh_pool.py
+
+"""
+Pool of nii2mesh processes : a cohort of label-maps meshed by the nii2mesh executable, several at the same time.
+
+Each job is one nii2mesh process (argument list, no shell), started by a thread of the pool : the threads only prepare
+the input and wait for their process, the meshing runs in the processes. The number of threads is the concurrency limit.
+Each process writes into a temporary folder of its own inside out_dir, and the finished file is moved under its final
+name without ever replacing another one (see mesh_writers.claim_path) : jobs with the same out_name never race.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os import cpu_count, makedirs, path
+
+from source.mesh_gen_c import mesh_gen_nii2mesh
+
+NII2MESH_PATH = path.join(path.dirname(path.abspath(__file__)), "nii2mesh", "src")
+
+class Nii2meshPool:
+    """
+    Runs nii2mesh jobs on at most "workers" processes at the same time.
+    Args:
+        workers (int, optional): Largest number of nii2mesh processes at the same time. Defaults to the number of CPUs.
+        timeout (float, optional): Time limit of each job in seconds : the process is killed and the job raises
+                                   subprocess.TimeoutExpired. Defaults to None (no limit).
+        nii2mesh_path (str, optional): Folder of the nii2mesh executable. Defaults to source/nii2mesh/src (then the PATH).
+        verbose (bool, optional): Whether nii2mesh prints its steps (-v 1).
+
+    Usage:
+        with Nii2meshPool(workers=8, timeout=600) as pool:
+            jobs = [pool.submit(nii_file, out_dir="output_files", out_name=nii_stem(nii_file), smooth_val=5) for nii_file in nii_files]
+            meshes = [job.result() for job in jobs]
+    """
+
+    def __init__(self, workers=None, timeout=None, nii2mesh_path=NII2MESH_PATH, verbose=False):
+        self.workers = workers or cpu_count() or 1
+        self.timeout = timeout
+        self.nii2mesh_path = nii2mesh_path
+        self.verbose = verbose
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="nii2mesh")
+        self._futures = set()
+
+    def submit(self, input_file, out_dir=".", out_name="mesh_nii2mesh", out_type="obj", smooth_val=0, simply_val=100, crop=True):
+        """
+        Queues one job (parameters : see mesh_gen_nii2mesh). Returns a Future of its MeshResult.
+        A failed job raises from the Future : subprocess.CalledProcessError (with the output and stderr of nii2mesh),
+        subprocess.TimeoutExpired or FileNotFoundError.
+        """
+        makedirs(out_dir, exist_ok=True)
+        future = self._executor.submit(
+            mesh_gen_nii2mesh, self.nii2mesh_path, input_file, out_name, out_dir, out_type,
+            smooth_val, simply_val, self.verbose, crop, in_process=False, timeout=self.timeout)
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+        return future
+
+    def map(self, jobs):
+        """
+        Runs a list of jobs (dictionaries of submit parameters) and yields (job, MeshResult or exception)
+        as the jobs finish : one failed job does not stop the others.
+        """
+        futures = {self.submit(**job): job for job in jobs}
+        for future in as_completed(futures):
+            error = future.exception()
+            yield futures[future], future.result() if error is None else error
+
+    def close(self, wait=True):
+        """
+        Stops the pool. With wait=False, the queued jobs are cancelled (the running processes still finish).
+        """
+        if not wait:
+            for future in list(self._futures):
+                future.cancel()
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close(wait=exc[0] is None)
@@ -0,0 +1,253 @@
+# nii_volume.py
+
+from os import path
+
+class NiiVolume:
+    """
+    Label-map loaded once and shared by the volume calculation and every backend.
+
+    Attributes:
+        array   (ndarray):  Voxel data of the label-map.
+        zooms   (tuple):    Voxel spacing read from the header. (1, 1, 1) for raw arrays.
+        affine  (ndarray):  Voxel -> world affine of the header. None for raw arrays.
+        name    (str):      Name used in the reports (file name when loaded from disk).
+        file    (str):      Location of the NIFTI file on disk, if any.
+        offset  (tuple):    Voxel index of array[0, 0, 0] in the original grid. Not null after a crop.
+    """
+
+    def __init__(self, array, zooms=(1.0, 1.0, 1.0), affine=None, name="array", file=None, offset=(0, 0, 0)):
+        self.array  = array
+        self.zooms  = tuple(float(z) for z in zooms[:3])
+        self.affine = affine
+        self.name   = name
+        self.file   = file
+        self.offset = tuple(int(o) for o in offset)
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def voxel_count(self):
+        from numpy import count_nonzero
+        return int(count_nonzero(self.array))
+
+    def mask(self):
+        """
+        Binary mask (uint8, 0 / 1) of the label-map, used by the marching cubes with a level of 0.5.
+        Built from a bool array, so it costs 1 byte per voxel whatever the dtype of the label-map.
+        """
+        from numpy import uint8
+        return (self.array != 0).view(uint8)
+
+    def spacing(self, grid_scale=None):
+        """
+        Voxel spacing given to the marching cubes : "grid_scale" if it is given, otherwise the zooms of the header.
+        """
+        if grid_scale is not None:
+            return tuple(float(g) for g in grid_scale)
+        return self.zooms
+
+    def voxel_volume(self, grid_scale=None):
+        """
+        Volume of one voxel : |det| of the header affine (or the product of "grid_scale" if it is given).
+        """
+        from numpy import prod
+        from numpy.linalg import det
+        if grid_scale is None and self.affine is not None:
+            return float(abs(det(self.affine[:3, :3])))
+        return float(prod(self.spacing(grid_scale)))
+
+    def mesh_matrix(self, grid_scale=None):
+        """
+        4x4 matrix taking the marching cubes vertices of this volume (voxel index * spacing, from array[0, 0, 0])
+        to the mesh coordinates :
+            - grid_scale is None and the header has an affine : world coordinates of the header (rotation, flips, origin),
+              the same ones as nii2mesh.
+            - otherwise : grid coordinates scaled by the spacing, shifted by the crop offset.
+        """
+        import numpy as np
+        spacing = np.asarray(self.spacing(grid_scale))
+        matrix = np.eye(4)
+        if grid_scale is None and self.affine is not None:
+            # The spacing is already in the vertices : only the direction part of the affine is left
+            matrix[:3, :3] = self.affine[:3, :3] / spacing
+            matrix[:3, 3] = self.affine[:3, 3]
+        else:
+            matrix[:3, 3] = np.asarray(self.offset) * spacing
+        return matrix
+
+    def crop(self, pad=1):
+        """
+        Crops the volume to the bounding box of its nonzero voxels, plus "pad" voxels on each side.
+        The marching cubes then only scans the sub-array, and the vertices are shifted back by "offset".
+        Returns the volume itself if it is empty or if the box already fills the grid.
+        """
+        box = bounding_box(self.array, pad)
+        if box is None or all(b.stop - b.start == n for b, n in zip(box, self.shape)):
+            return self
+        return self.sub_volume(box)
+
+    def label(self, value, box=None):
+        """
+        Binary (uint8, 0 / 1) volume of a single label value, restricted to "box" (see label_boxes).
+        """
+        from numpy import uint8
+        if box is None:
+            box = tuple(slice(0, n) for n in self.shape)
+        label_volume = self.sub_volume(box)
+        label_volume.array = (label_volume.array == value).view(uint8)
+        label_volume.name = f"{self.name} (label {value})"
+        return label_volume
+
+    def sub_volume(self, box):
+        """
+        Part of the volume inside "box" (tuple of slices), keeping its place in the original grid.
+        """
+        start = tuple(b.start for b in box)
+        affine = self.affine
+        if affine is not None:
+            affine = affine.copy()
+            affine[:3, 3] += affine[:3, :3] @ start
+        return NiiVolume(
+            array   = self.array[box],
+            zooms   = self.zooms,
+            affine  = affine,
+            name    = self.name,
+            offset  = tuple(o + s for o, s in zip(self.offset, start)))
+
+    def as_file(self, folder):
+        """
+        Returns a NIFTI file holding this volume, for the backends that can only read from disk (nii2mesh).
+        The original file is reused when there is one, otherwise an uncompressed .nii is written in "folder".
+        """
+        if self.file is not None:
+            return self.file
+        import nibabel as nib
+        new_file = path.join(folder, "volume.nii")
+        nib.save(nib.Nifti1Image(self.array, self.file_affine()), new_file)
+        return new_file
+
+    def file_affine(self):
+        """
+        Voxel -> world affine of this volume as written in a NIFTI file : the header's, or the zooms
+        and the crop offset for raw arrays.
+        """
+        from numpy import eye
+        if self.affine is not None:
+            return self.affine
+        affine = eye(4)
+        affine[0, 0], affine[1, 1], affine[2, 2] = self.zooms
+        affine[:3, 3] = [o * z for o, z in zip(self.offset, self.zooms)]
+        return affine
+
+def transform_points(points, matrix):
+    """
+    Applies a 4x4 matrix (see NiiVolume.mesh_matrix) to (N, 3) points in one vectorized product.
+    """
+    import numpy as np
+    points = np.asarray(points, dtype=np.float64) @ matrix[:3, :3].T
+    points += matrix[:3, 3]
+    return points
+
+def transform_mesh(verts, faces, matrix):
+    """
+    Applies a 4x4 matrix (see NiiVolume.mesh_matrix) to a mesh.
+    If the matrix flips the space (negative determinant, as in most radiological affines), the faces are reversed
+    so that they stay oriented the same way.
+    Returns the new (verts, faces) arrays.
+    """
+    from numpy import ascontiguousarray
+    from numpy.linalg import det
+    if det(matrix[:3, :3]) < 0:
+        faces = ascontiguousarray(faces[:, ::-1])
+    return transform_points(verts, matrix), faces
+
+def bounding_box(array, pad=1):
+    """
+    Finds the bounding box of the nonzero voxels of a 3D array, in 2 passes over the data.
+    Args:
+        array (ndarray): 3D array.
+        pad (int, optional): Number of voxels added on each side (clipped to the grid). Defaults to 1.
+    Returns:
+        tuple of slices, or None if the array is empty.
+    """
+    from numpy import flatnonzero
+    # One pass for (x, y), one pass for z
+    xy = array.any(axis=2)
+    xs = flatnonzero(xy.any(axis=1))
+    if xs.size == 0:
+        return None
+    ys = flatnonzero(xy.any(axis=0))
+    zs = flatnonzero(array.any(axis=(0, 1)))
+    return tuple(
+        slice(max(int(idx[0]) - pad, 0), min(int(idx[-1]) + 1 + pad, n))
+        for idx, n in zip((xs, ys, zs), array.shape))
+
+def label_boxes(array, pad=1):
+    """
+    Finds every label value present in a label-map and its bounding box, in a single pass over the data.
+    Args:
+        array (ndarray): 3D label-map (integer values, 0 = background).
+        pad (int, optional): Number of voxels added on each side of the boxes (clipped to the grid). Defaults to 1.
+    Returns:
+        dict: {label value : tuple of slices}, sorted by label value.
+    """
+    from numpy import issubdtype, integer, int32
+    from scipy.ndimage import find_objects
+    if not issubdtype(array.dtype, integer):
+        # Label-maps loaded as float64 (native_dtype = False)
+        array = array.astype(int32)
+    if array.dtype.kind == "i" and array.size and array.min() < 0:
+        raise ValueError("Label values must be positive")
+    boxes = {}
+    for value, box in enumerate(find_objects(array), start=1):
+        if box is None:
+            continue
+        boxes[value] = tuple(
+            slice(max(b.start - pad, 0), min(b.stop + pad, n))
+            for b, n in zip(box, array.shape))
+    return boxes
+
+def load_volume(source, native_dtype=True, lazy=False):
+    """
+    Loads a label-map once, whatever the way it is given.
+    Args:
+        source (str / Path / ndarray / nibabel image / NiiVolume): The label-map, or its location.
+        native_dtype (bool, optional): If true, keeps the on-disk dtype (uint8, int16, ...) instead of converting to float64,
+                                       and memory-maps uncompressed .nii files. Defaults to True.
+        lazy (bool, optional): If true, "array" is the nibabel proxy of the file : nothing is read until it is sliced,
+                               and only the slice is read (see source/mesh_streaming.py). Defaults to False.
+    Returns:
+        NiiVolume: The loaded label-map. A NiiVolume is returned as it is.
+    """
+    if isinstance(source, NiiVolume):
+        return source
+
+    import numpy as np
+    if isinstance(source, np.ndarray):
+        return NiiVolume(source)
+
+    import nibabel as nib
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        file = str(source)
+        img = nib.load(file)
+    elif hasattr(source, "dataobj"):
+        img = source
+        file = img.get_filename()
+    else:
+        raise TypeError("source must be a NIFTI location, a numpy array, a nibabel image or a NiiVolume")
+
+    if lazy:
+        array = img.dataobj
+    elif native_dtype:
+        # No float64 copy : uncompressed .nii files are memory-mapped, .nii.gz are decompressed in their own dtype
+        array = np.asanyarray(img.dataobj)
+    else:
+        array = img.get_fdata()
+
+    return NiiVolume(
+        array   = array,
+        zooms   = img.header.get_zooms(),
+        affine  = img.affine,
+        name    = path.basename(file) if file else "image",
+        file    = file)
@@ -0,0 +1,101 @@
+# phantoms.py
+
+"""
+Analytic phantoms : synthetic label-maps whose exact volume is known, to measure the volume error of the libraries
+without private data. The voxels are 1 x 1 x 1 (the volumes are in voxels), and the phantoms are built slab by slab
+so that large grids (1024^3) only need the memory of the label-map itself.
+
+    sphere  : ball of radius 0.35 * size                                    V = 4/3 pi r^3
+    torus   : ring of radius 0.3 * size, tube radius 0.1 * size             V = 2 pi^2 R a^2
+    tube    : thin straight cylinder along z (radius size / 40, at least 1.5 voxels), flat ends     V = pi a^2 L
+    blob    : ball whose radius varies with the direction (smooth random bumps and smaller noise)   V = 1/3 integral of r^3
+"""
+
+import numpy as np
+
+PHANTOMS = ("sphere", "torus", "tube", "blob")
+
+# Planes of the label-map computed at once
+SLAB = 16
+
+def _build(size, inside):
+    # inside(x, y, z) -> bool array, with x, y, z centred coordinates broadcast over one slab
+    mask = np.zeros((size, size, size), dtype=np.uint8)
+    c = (size - 1) / 2
+    x = (np.arange(size, dtype=np.float32) - c)[:, None, None]
+    y = (np.arange(size, dtype=np.float32) - c)[None, :, None]
+    for z0 in range(0, size, SLAB):
+        z = (np.arange(z0, min(z0 + SLAB, size), dtype=np.float32) - c)[None, None, :]
+        mask[:, :, z0:z0 + SLAB] = inside(x, y, z)
+    return mask
+
+def sphere(size):
+    r = 0.35 * size
+    return _build(size, lambda x, y, z: x * x + y * y + z * z < r * r), 4 / 3 * np.pi * r ** 3
+
+def torus(size):
+    R, a = 0.3 * size, 0.1 * size
+    return _build(size, lambda x, y, z: (np.sqrt(x * x + y * y) - R) ** 2 + z * z < a * a), 2 * np.pi ** 2 * R * a * a
+
+def tube(size):
+    a = max(1.5, size / 40)
+    z0, z1 = round(0.1 * size), round(0.9 * size)
+    c = (size - 1) / 2
+    # The marching cubes puts the flat ends half-way between the first / last plane and the next one : the length is z1 - z0
+    inside = lambda x, y, z: (x * x + y * y < a * a) & (z + c >= z0) & (z + c < z1)
+    return _build(size, inside), np.pi * a * a * (z1 - z0)
+
+def _blob_bumps(seed):
+    # (amplitude, axis, frequency, phase) of each bump : a few smooth ones plus smaller, sharper ones
+    rng = np.random.default_rng(seed)
+    bumps = []
+    for amplitude, frequency, count in ((0.12, 2.0, 4), (0.03, 7.0, 8)):
+        axes = rng.normal(size=(count, 3))
+        axes /= np.linalg.norm(axes, axis=1, keepdims=True)
+        for axis, phase in zip(axes, rng.uniform(0, 2 * np.pi, count)):
+            bumps.append((amplitude / count, axis, frequency, phase))
+    return bumps
+
+def _blob_radius(dx, dy, dz, size, bumps):
+    # Radius of the blob in the direction (dx, dy, dz) (unit vectors, broadcast arrays)
+    radius = 1
+    for amplitude, axis, frequency, phase in bumps:
+        radius = radius + amplitude * np.cos(frequency * (dx * axis[0] + dy * axis[1] + dz * axis[2]) + phase)
+    return 0.3 * size * radius
+
+def blob(size, seed=0):
+    bumps = _blob_bumps(seed)
+    # Exact volume : V = 1/3 * integral over the directions of r^3, on a fine (theta, phi) grid
+    theta = ((np.arange(1024) + 0.5) * np.pi / 1024)[:, None]
+    phi = ((np.arange(2048) + 0.5) * 2 * np.pi / 2048)[None, :]
+    r = _blob_radius(np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta), size, bumps)
+    volume = float((r ** 3 * np.sin(theta)).sum() / 3 * (np.pi / 1024) * (2 * np.pi / 2048))
+
+    # The radius stays between these bounds : the bumps are only computed for the voxels in between
+    spread = sum(bump[0] for bump in bumps)
+    r_min, r_max = 0.3 * size * (1 - spread), 0.3 * size * (1 + spread)
+
+    def inside(x, y, z):
+        rho = np.sqrt(x * x + y * y + z * z)
+        result = rho < r_min
+        i, j, k = np.nonzero((rho >= r_min) & (rho < r_max))
+        sx, sy, sz, srho = x[i, 0, 0], y[0, j, 0], z[0, 0, k], rho[i, j, k]
+        result[i, j, k] = srho < _blob_radius(sx / srho, sy / srho, sz / srho, size, bumps)
+        return result
+    return _build(size, inside), volume
+
+def make_phantom(kind, size, seed=0):
+    """
+    Builds a phantom.
+    Args:
+        kind (str): "sphere" / "torus" / "tube" / "blob".
+        size (int): Number of voxels along each axis.
+        seed (int, optional): Seed of the bumps of the blob.
+    Returns:
+        (mask, volume): The (size, size, size) uint8 label-map and the exact volume of the shape (in voxels).
+    """
+    if kind == "blob":
+        return blob(size, seed)
+    if kind not in PHANTOMS:
+        raise ValueError(f"Unknown phantom : {kind} (available : {', '.join(PHANTOMS)})")
+    return globals()[kind](size)
@@ -0,0 +1,46 @@
+# worker_threads.py
+
+"""
+Thread limits of the worker processes (batch, warm daemon, job queue) : one process per core, so the numerical
+libraries (OpenMP, OpenBLAS, MKL) must not start their own threads on top of it.
+
+The libraries read their thread variables only once, when they are loaded : the variables must be set before the
+worker processes start (single_threaded), since a worker forked from a process that has already imported numpy,
+pymeshlab or vtk inherits their thread pools. limit_threads then limits these inherited pools through threadpoolctl,
+when it is installed. Only the standard library is imported here.
+"""
+
+from contextlib import contextmanager
+from os import environ
+
+# Variables read by the numerical libraries when they are loaded
+THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+@contextmanager
+def single_threaded():
+    """
+    Sets the thread variables to 1 in the "with" block, then restores them.
+    The worker processes (and the heavy imports they inherit) must be started in the block.
+    """
+    old = {variable: environ.get(variable) for variable in THREAD_VARIABLES}
+    environ.update(dict.fromkeys(THREAD_VARIABLES, "1"))
+    try:
+        yield
+    finally:
+        for variable, value in old.items():
+            if value is None:
+                environ.pop(variable, None)
+            else:
+                environ[variable] = value
+
+def limit_threads():
+    """
+    Limits the thread pools of the libraries already loaded in this process to 1 thread (needs threadpoolctl).
+    Returns False if threadpoolctl is not installed.
+    """
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return False
+    threadpool_limits(1)
+    return True
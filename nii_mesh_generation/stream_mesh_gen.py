@@ -0,0 +1,130 @@
+"""
+Authors: Sacha Cruz, Mario Espinoza
+________________________________
+|                              |
+|   NIFTI -> MESH GENERATION   |
+|             ---              |
+|      stream_mesh_gen.py      |
+|______________________________|
+
+Meshes label-maps larger than the memory (whole-body scans at high resolution) : the NIFTI file is read in z-slabs,
+the marching cubes runs slab by slab, and the mesh is written to the .obj file chunk by chunk.
+The peak memory depends on the slab size, not on the size of the volume. No simplification / smoothing
+(they need the whole mesh) : the output is the same mesh as the pymeshlab library gives without them.
+
+Usage (CLI):
+    python stream_mesh_gen.py input_files/whole_body.nii -o output_files --slab-size 32
+
+Usage (Python):
+    from stream_mesh_gen import generate_stream
+    mesh = generate_stream("input_files/whole_body.nii", out_dir="output_files", slab_size=32)
+
+/!\ Uncompressed .nii files are the fastest to stream. A .nii.gz file is decompressed sequentially,
+    twice (one pass for the bounding box, one for the marching cubes).
+"""
+
+from os import makedirs, path
+import argparse
+import time
+
+from source.nii_volume import load_volume
+from source.mesh_streaming import slab_bounding_box, stream_marching_cubes, save_obj_stream
+from source.mesh_result import MeshResult
+from source.mesh_tools import doc_obj, peak_rss
+
+def generate_stream(
+        nii_dir,
+        out_dir     = ".",
+        out_name    = "mesh_stream",
+        slab_size   = 64,
+        grid_scale  = None,
+        crop        = True,
+        info_doc    = True):
+    """
+    Generates a Mesh (.obj) from a .nii file, slab by slab.
+    Args:
+        nii_dir     (str):              Location of the NIFTI file. An already-loaded numpy array, nibabel image or NiiVolume is also accepted.
+        slab_size   (int, optional):    Number of voxel planes read and meshed at once.
+        crop        (bool, optional):   If true, only the bounding box of the label (plus 1 voxel) is meshed.
+        (Other parameters : see generate_from_nii)
+    Returns:
+        MeshResult: Path and metrics of the mesh (vertices, faces, volume, label_volume, mesh_volume, error, size,
+                    elapsed_time, peak_memory). The arrays are only read from the file if they are used.
+    """
+    initial_time = time.time()
+    makedirs(out_dir, exist_ok=True)
+    volume = load_volume(nii_dir, lazy=True)
+
+    # First pass : voxel count and bounding box
+    box, nbVoxels = slab_bounding_box(volume.array, slab_size)
+    if box is None:
+        raise ValueError("The label-map is empty")
+    if not crop:
+        box = None
+    volVoxels = nbVoxels*volume.voxel_volume(grid_scale)
+
+    # Second pass : marching cubes, written as it goes
+    print(f"Streaming Marching Cubes (slabs of {slab_size} planes)")
+    mesh_path = path.join(out_dir, out_name + ".obj")
+    metrics = save_obj_stream(stream_marching_cubes(volume, slab_size, grid_scale, box), mesh_path)
+    print(mesh_path + " saved successfully")
+
+    elapsed_time = time.time() - initial_time
+    volMesh = abs(metrics["volume"])
+    peak_memory = peak_rss()
+    print("Mesh Volume : ", volMesh)
+    if peak_memory is not None:
+        print("Peak memory : ", round(peak_memory, 1), "MB")
+
+    if info_doc:
+        doc_obj(
+            output_folder   = out_dir,
+            name            = path.basename(mesh_path),
+            mesh_file       = path.basename(mesh_path),
+            nifti_file      = volume.name,
+            mesh_path       = mesh_path,
+            label_volume    = volVoxels,
+            mesh_volume     = volMesh,
+            error           = abs(volVoxels-volMesh)/volVoxels,
+            size            = path.getsize(mesh_path),
+            library         = "stream",
+            smoothing       = "",
+            smooth_val      = 0,
+            simplify        = "",
+            simply_val      = 100,
+            elapsed_time    = elapsed_time,
+            peak_memory     = peak_memory)
+
+    metrics.update(
+        label_volume    = volVoxels,
+        mesh_volume     = volMesh,
+        error           = abs(volVoxels-volMesh)/volVoxels,
+        size            = path.getsize(mesh_path),
+        elapsed_time    = elapsed_time,
+        peak_memory     = peak_memory)
+    return MeshResult(mesh_path=mesh_path, metrics=metrics)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Meshes a NIFTI label-map slab by slab, without loading it in memory.")
+    parser.add_argument("input", help="NIFTI file")
+    parser.add_argument("-o", "--out-dir", default=".", help="output folder")
+    parser.add_argument("-n", "--out-name", default="mesh_stream", help="name of the .obj file (without extension)")
+    parser.add_argument("-s", "--slab-size", type=int, default=64, help="number of voxel planes meshed at once")
+    parser.add_argument("--grid-scale", type=float, nargs=3, default=None,
+                        help="voxel spacing forced instead of the header's (default: spacing and affine of the file)")
+    parser.add_argument("--no-crop", action="store_true", help="mesh the full grid")
+    parser.add_argument("--no-doc", action="store_true", help="do not save the TXT document")
+    args = parser.parse_args(argv)
+
+    generate_stream(
+        nii_dir     = args.input,
+        out_dir     = args.out_dir,
+        out_name    = args.out_name,
+        slab_size   = args.slab_size,
+        grid_scale  = args.grid_scale and tuple(args.grid_scale),
+        crop        = not args.no_crop,
+        info_doc    = not args.no_doc)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
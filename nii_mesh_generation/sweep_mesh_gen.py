@@ -0,0 +1,197 @@
+"""
+Authors: Sacha Cruz, Mario Espinoza
+________________________________
+|                              |
+|   NIFTI -> MESH GENERATION   |
+|             ---              |
+|       sweep_mesh_gen.py      |
+|______________________________|
+
+Compares many simplification / smoothing settings (pymeshlab) on the same label-map.
+The NIFTI file is read once and the marching cubes runs once : every variant starts from the same base mesh
+(and the unsimplified variants share its smoothing operator),
+the variants run in parallel, and a table (.tsv) gives the volume error, face count, file size and time of each one.
+
+Usage (Python):
+    from sweep_mesh_gen import generate_sweep
+    rows = generate_sweep(
+        "input_files/sartorius.nii.gz",
+        grid = {"simplify": ["", "edmc"], "smoothing": ["lap"], "smooth_val": [1, 5, 10]},
+        out_dir = "output_files/sweep")
+
+/!\ Call generate_sweep under a 'if __name__ == "__main__":' block, on every OS : the worker processes are not forked from
+    the calling process (it has already loaded numpy, scipy and pymeshlab with their thread pools), they start from a fresh
+    process that imports the main module again.
+"""
+
+from os import makedirs, path
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout, nullcontext
+import io
+import multiprocessing
+import sys
+import time
+
+from nii_mesh_gen import check_values
+from source.nii_volume import load_volume
+from source.mesh_gen_python import marching_cubes, process_pylab, save_pylab
+from source.mesh_tools import vol_mesh, doc_table
+from source.mesh_metrics import sample_surface, surface_distance
+from source.mesh_smoothing import umbrella_operator
+from source.mesh_archive import MeshArchive, encode_mesh
+from source.worker_threads import single_threaded, limit_threads
+
+VARIANT_KEYS = ("simplify", "simply_val", "smoothing", "smooth_val")
+VARIANT_DEFAULTS = dict(simplify="", simply_val=100, smoothing="", smooth_val=0)
+
+def sweep_variants(grid):
+    """
+    Lists the variants of a grid.
+    Args:
+        grid (dict / list): Either a dictionary of lists (every combination is used), for example :
+                                {"simplify": ["", "edmc"], "smoothing": ["lap"], "smooth_val": [1, 5, 10]}
+                            or a list of variants, each one a dictionary or a (simplify, simply_val, smoothing, smooth_val) tuple.
+                            Missing keys take the default values of generate_from_nii.
+    Returns:
+        list of dict: The variants, each one with the 4 keys.
+    """
+    if isinstance(grid, dict):
+        unknown = set(grid) - set(VARIANT_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown sweep parameters : {sorted(unknown)}")
+        values = [grid.get(key, [VARIANT_DEFAULTS[key]]) for key in VARIANT_KEYS]
+        variants = [dict(zip(VARIANT_KEYS, combination)) for combination in product(*values)]
+    else:
+        variants = [dict(VARIANT_DEFAULTS, **(v if isinstance(v, dict) else dict(zip(VARIANT_KEYS, v)))) for v in grid]
+    for variant in variants:
+        check_values(variant["simply_val"], variant["smooth_val"])
+    return variants
+
+def variant_name(variant):
+    """
+    File name suffix of a variant, for example "edmc_lap5" or "nosimp_nosmooth".
+    """
+    simp = (variant["simplify"] + (str(variant["simply_val"]) if variant["simply_val"] < 100 else "")) or "nosimp"
+    smooth = (variant["smoothing"] + str(variant["smooth_val"])) if variant["smoothing"] else "nosmooth"
+    return f"{simp}_{smooth}"
+
+def generate_sweep(
+        nii_dir,
+        grid,
+        grid_scale  = None,
+        workers     = None,
+        verbose     = False,
+        info_doc    = True,
+        out_type    = "obj",
+        out_dir     = ".",
+        out_name    = "mesh_pymeshlab",
+        crop        = True,
+        cache_dir   = None,
+        cache_size  = 1024,
+        mc_workers  = None,
+        distances   = True,
+        samples     = 100000,
+        archive     = None,
+        bits        = 16):
+    """
+    Generates one Mesh (pymeshlab) per variant of a grid of simplification / smoothing settings, with a single marching cubes.
+    Args:
+        nii_dir     (str):              Location of the NIFTI file. An already-loaded numpy array, nibabel image or NiiVolume is also accepted.
+        grid        (dict / list):      Variants to generate (see sweep_variants).
+        workers     (int, optional):    Number of worker processes. Defaults to the number of CPUs.
+        verbose     (bool, optional):   If false, the output of each variant is not printed.
+        info_doc    (bool, optional):   If true, saves the table as "<out_name>_sweep.tsv" in out_dir.
+        distances   (bool, optional):   If true, each row also gives the Hausdorff, 95th-percentile and mean surface distances
+                                        between the variant and the unprocessed marching cubes mesh.
+        samples     (int, optional):    Number of points drawn on each surface for the distances.
+        archive     (str, optional):    If given, the variants are stored in this mesh archive (.nma, see source/mesh_archive.py)
+                                        instead of one file each. Variants already in the archive can't be added again.
+        bits        (int, optional):    Quantization bits per axis of the archived vertices.
+        (Other parameters : see generate_from_nii)
+    Returns:
+        list of dict: One row per variant (parameters, faces, volume error, file size, time, mesh file).
+    """
+    variants = sweep_variants(grid)
+    makedirs(out_dir, exist_ok=True)
+    initial_time = time.time()
+
+    # Read the NIFTI and run the marching cubes only once
+    volume = load_volume(nii_dir)
+    volVoxels = volume.voxel_count()*volume.voxel_volume(grid_scale)
+    verts, faces = marching_cubes(volume, crop=crop, grid_scale=grid_scale, cache_dir=cache_dir, cache_size=cache_size,
+                                  workers=mc_workers)
+    mc_time = time.time() - initial_time
+    print(f"Marching cubes : {len(faces)} faces in {round(mc_time, 2)} s")
+    print(f"{len(variants)} variants")
+
+    # Reference of the distances : the unprocessed mesh (already in the coordinates of the variants)
+    reference = sample_surface(verts, faces, samples) if distances else None
+
+    # The base mesh (and the reference) is sent once to each worker, not once per variant.
+    # The workers start from a fresh process (forkserver) with the thread variables of single_threaded() : a fork of this
+    # process would inherit the thread pools of the libraries it has already loaded
+    rows = []
+    store = MeshArchive(archive, "a") if archive is not None else nullcontext()
+    context = multiprocessing.get_context("spawn" if sys.platform == "win32" else "forkserver")
+    with store, single_threaded(), ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_sweep,
+                                                       initargs=(verts, faces, reference)) as pool:
+        jobs = [pool.submit(_run_variant, variant, out_dir, f"{out_name}_{variant_name(variant)}", out_type, verbose, samples,
+                            bits if archive is not None else None)
+                for variant in variants]
+        for variant, job in zip(variants, jobs):
+            row = dict(variant)
+            row.update(job.result())
+            if archive is not None:
+                # Encoded in the worker, written here : only this process writes the archive
+                store.add_encoded(f"{out_name}_{variant_name(variant)}", row.pop("encoded"), row.pop("header"), **variant)
+                row["mesh_file"] = f"{path.basename(archive)}:{out_name}_{variant_name(variant)}"
+            row["error"] = abs(volVoxels-row["mesh_volume"])/volVoxels
+            rows.append(row)
+            print(f"{variant_name(variant)} : {row['faces']} faces, error {round(row['error']*100, 3)} %, {round(row['time'], 2)} s"
+                  + (f", hd95 {round(row['hd95'], 3)}" if distances else ""))
+
+    if info_doc:
+        doc_table(output_folder=out_dir, name=out_name + "_sweep", rows=rows)
+    print(f"Sweep done in {round(time.time() - initial_time, 2)} s (marching cubes : {round(mc_time, 2)} s)")
+    return rows
+
+# Base mesh of the worker processes, its smoothing operator and KD-tree of the distance reference (built once per worker)
+_base_mesh = None
+_operator = None
+_reference = None
+
+def _init_sweep(verts, faces, reference):
+    global _base_mesh, _operator, _reference
+    limit_threads()
+    _base_mesh = (verts, faces)
+    _operator = umbrella_operator(faces, len(verts))
+    if reference is not None:
+        from scipy.spatial import cKDTree
+        _reference = (reference, cKDTree(reference))
+
+def _run_variant(variant, out_dir, out_name, out_type, verbose, samples, bits=None):
+    # Runs in a worker process. When "bits" is given, the mesh is encoded for the archive instead of saved
+    archived = bits is not None
+    initial_time = time.time()
+    verts, faces = _base_mesh
+    with nullcontext() if verbose else redirect_stdout(io.StringIO()):
+        new_verts, new_faces = process_pylab(verts, faces, operator=_operator, **variant)
+        if archived:
+            encoded, header = encode_mesh(new_verts, new_faces, bits)
+        else:
+            mesh_path = save_pylab(new_verts, new_faces, out_dir, out_name, out_type)
+    elapsed_time = time.time() - initial_time
+    row = dict(
+        faces       = len(new_faces),
+        vertices    = len(new_verts),
+        mesh_volume = vol_mesh(new_verts, new_faces),
+        size        = len(encoded) if archived else path.getsize(mesh_path),
+        time        = elapsed_time,
+        mesh_file   = None if archived else path.basename(mesh_path))
+    if archived:
+        row.update(encoded=encoded, header=header)
+    if _reference is not None:
+        reference, reference_tree = _reference
+        row.update(surface_distance(sample_surface(new_verts, new_faces, samples), reference, reference_tree=reference_tree, workers=1))
+    return row
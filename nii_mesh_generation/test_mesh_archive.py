@@ -0,0 +1,90 @@
+import os
+import tempfile
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from source.mesh_archive import MeshArchive, decode_mesh, encode_mesh
+from source.mesh_gen_python import marching_cubes
+from source.phantoms import sphere, torus
+
+# ______________________________________________________________________________
+# Round trip of the encoding (within the quantization error) and bookkeeping of the archive file
+
+def oriented_faces(faces):
+    # Each face rotated to start with its smallest index, then the faces sorted : same array for the same triangles
+    shift = faces.argmin(axis=1)
+    rotated = faces[np.arange(len(faces))[:, None], (shift[:, None] + np.arange(3)) % 3]
+    return rotated[np.lexsort(rotated.T[::-1])]
+
+def assert_decoded(mesh, decoded, header):
+    (verts, faces), (new_verts, new_faces) = mesh, decoded
+    assert (len(new_verts), len(new_faces)) == (len(verts), len(faces)) == (header["vertices"], header["faces"])
+    # The decoded vertices come in another order : each one is matched with the nearest original vertex
+    _, match = cKDTree(verts).query(new_verts)
+    assert len(np.unique(match)) == len(verts)
+    error = np.abs(new_verts - verts[match])
+    assert np.all(error <= np.asarray(header["scale"]) / 2 + 1e-9)
+    assert error.max() <= header["max_error"] + 1e-9
+    np.testing.assert_array_equal(oriented_faces(match[new_faces]), oriented_faces(faces))
+
+def test_encode_round_trip():
+    mesh = marching_cubes(sphere(32)[0], crop=False)
+    for bits in (16, 10):
+        for codec in (None, "zlib", "none"):
+            data, header = encode_mesh(*mesh, bits=bits, codec=codec)
+            assert header["bits"] == bits
+            assert_decoded(mesh, decode_mesh(data, header), header)
+    # Fewer bits : a larger error, and a smaller file
+    fine, coarse = encode_mesh(*mesh, bits=16), encode_mesh(*mesh, bits=10)
+    assert coarse[1]["max_error"] > fine[1]["max_error"] and len(coarse[0]) < len(fine[0])
+
+def test_archive_index_and_append():
+    meshes = dict(sphere=marching_cubes(sphere(32)[0], crop=False), torus=marching_cubes(torus(32)[0], crop=False))
+    with tempfile.TemporaryDirectory() as out_dir:
+        file = os.path.join(out_dir, "meshes.nma")
+        with MeshArchive(file, "w") as archive:
+            archive.add("sphere", *meshes["sphere"], smooth_val=5)
+            try:
+                archive.add("sphere", *meshes["sphere"])
+                raise AssertionError("The archive accepted a name twice")
+            except ValueError:
+                pass
+        assert os.listdir(out_dir) == ["meshes.nma"]
+
+        with MeshArchive(file) as archive:
+            assert archive.names() == ["sphere"] and len(archive) == 1 and "sphere" in archive and "torus" not in archive
+            info = archive.info("sphere")
+            assert info["smooth_val"] == 5 and info["faces"] == len(meshes["sphere"][1]) and info["size"] > 0
+            assert_decoded(meshes["sphere"], archive.read("sphere"), info)
+            try:
+                archive.add("torus", *meshes["torus"])
+                raise AssertionError("The archive accepted a mesh in read mode")
+            except ValueError:
+                pass
+
+        # Opened to add meshes without adding any : the file is left as it was
+        with open(file, "rb") as handle:
+            before = handle.read()
+        with MeshArchive(file, "a"):
+            pass
+        with open(file, "rb") as handle:
+            assert handle.read() == before
+
+        # The meshes added before an exception are kept, and the earlier ones are still readable
+        try:
+            with MeshArchive(file, "a") as archive:
+                archive.add("torus", *meshes["torus"], smooth_val=0)
+                raise KeyError("interrupted")
+        except KeyError:
+            pass
+        assert os.listdir(out_dir) == ["meshes.nma"]
+        with MeshArchive(file) as archive:
+            assert archive.names() == ["sphere", "torus"]
+            for name, mesh in meshes.items():
+                assert_decoded(mesh, archive.read(name), archive.info(name))
+
+if __name__ == "__main__":
+    test_encode_round_trip()
+    test_archive_index_and_append()
+    print("mesh_archive tests passed")
@@ -0,0 +1,35 @@
+import numpy as np
+from skimage import measure
+
+from source.mesh_parallel import parallel_marching_cubes
+from source.phantoms import sphere
+
+# ______________________________________________________________________________
+# The welded blocks of the parallel marching cubes must give the mesh of the serial marching cubes
+
+def sorted_rows(verts):
+    return verts[np.lexsort(verts.T[::-1])]
+
+def test_parallel_matches_serial():
+    mask, _ = sphere(32)
+    spacing = (0.8, 1.0, 1.5)
+    verts, faces, _, _ = measure.marching_cubes(mask, level=0.5, spacing=spacing)
+    # z-slabs (default), then blocks split along every axis
+    for workers, block_size in ((2, None), (4, None), (4, 7)):
+        new_verts, new_faces = parallel_marching_cubes(mask, spacing, workers, block_size=block_size)
+        assert len(new_faces) == len(faces) and len(new_verts) == len(verts), (workers, block_size)
+        np.testing.assert_allclose(sorted_rows(new_verts), sorted_rows(verts.astype(np.float64)), atol=1e-5)
+        # Every vertex is used : the copies of the shared planes were welded
+        assert len(np.unique(new_faces)) == len(new_verts)
+
+def test_parallel_threads():
+    mask, _ = sphere(32)
+    verts, faces = parallel_marching_cubes(mask, workers=2, threads=True)
+    ref_verts, ref_faces = parallel_marching_cubes(mask, workers=2)
+    assert len(faces) == len(ref_faces)
+    np.testing.assert_array_equal(sorted_rows(verts), sorted_rows(ref_verts))
+
+if __name__ == "__main__":
+    test_parallel_matches_serial()
+    test_parallel_threads()
+    print("mesh_parallel tests passed")
@@ -0,0 +1,55 @@
+import numpy as np
+
+from source.mesh_gen_python import marching_cubes
+from source.mesh_streaming import slab_bounding_box, stream_marching_cubes
+from source.phantoms import sphere
+
+# ______________________________________________________________________________
+# The streamed marching cubes must give the mesh of the serial marching cubes, whatever the slab size
+
+def stream_mesh(mask, slab_size, box=None):
+    # Joins the chunks of stream_marching_cubes into one mesh
+    chunks = list(stream_marching_cubes(mask, slab_size=slab_size, box=box))
+    return np.concatenate([verts for verts, _ in chunks]), np.concatenate([faces for _, faces in chunks])
+
+def canonical_faces(verts, faces):
+    # Faces as sorted rows of vertex ranks (vertices ranked by their coordinates), each face rotated to start with its
+    # smallest rank : two meshes with the same triangles and orientations give the same array, whatever their order
+    order = np.lexsort(np.round(verts, 6).T[::-1])
+    rank = np.empty(len(verts), dtype=np.int64)
+    rank[order] = np.arange(len(verts))
+    ranked = rank[faces]
+    shift = ranked.argmin(axis=1)
+    rotated = ranked[np.arange(len(ranked))[:, None], (shift[:, None] + np.arange(3)) % 3]
+    return rotated[np.lexsort(rotated.T[::-1])]
+
+def assert_same_mesh(mesh, reference):
+    (verts, faces), (ref_verts, ref_faces) = mesh, reference
+    assert len(verts) == len(ref_verts) and len(faces) == len(ref_faces)
+    np.testing.assert_allclose(np.sort(verts, axis=0), np.sort(ref_verts, axis=0), atol=1e-6)
+    np.testing.assert_array_equal(canonical_faces(verts, faces), canonical_faces(ref_verts, ref_faces))
+
+def test_stream_matches_serial():
+    mask, _ = sphere(32)
+    serial = marching_cubes(mask, crop=False)
+    for slab_size in (7, 16, 64):
+        assert_same_mesh(stream_mesh(mask, slab_size), serial)
+
+def test_crop_shifts_back():
+    mask, _ = sphere(32)
+    # The sphere away from the origin of a larger grid : the cropped meshes must not move
+    grid = np.zeros((48, 40, 44), dtype=np.uint8)
+    grid[9:41, 3:35, 11:43] = mask
+    whole = marching_cubes(grid, crop=False)
+    assert_same_mesh(marching_cubes(grid, crop=True), whole)
+    box, count = slab_bounding_box(grid, slab_size=7)
+    assert count == np.count_nonzero(mask)
+    assert_same_mesh(stream_mesh(grid, 7, box), whole)
+    # Same triangles as the sphere alone, moved by the offset of the grid
+    verts, faces = marching_cubes(mask, crop=False)
+    assert_same_mesh(whole, (verts + (9, 3, 11), faces))
+
+if __name__ == "__main__":
+    test_stream_matches_serial()
+    test_crop_shifts_back()
+    print("mesh_streaming tests passed")
@@ -0,0 +1,39 @@
+import os
+import tempfile
+
+import numpy as np
+import trimesh
+
+from source.mesh_gen_python import marching_cubes
+from source.mesh_metrics import signed_volume
+from source.mesh_writers import WRITERS, save_mesh
+from source.phantoms import sphere
+
+# ______________________________________________________________________________
+# The meshes written from the arrays must be read back by another library with the same faces and volume
+
+def test_read_back():
+    verts, faces = marching_cubes(sphere(32)[0], crop=False)
+    volume = signed_volume(verts, faces)
+    with tempfile.TemporaryDirectory() as out_dir:
+        for out_type in ("stl", "ply", "glb", "obj"):
+            mesh_path = save_mesh(verts, faces, out_dir, "sphere", out_type)
+            # process=False : the vertices of the STL faces are not merged, nothing is repaired
+            mesh = trimesh.load(mesh_path, force="mesh", process=False)
+            assert len(mesh.faces) == len(faces), out_type
+            # Signed volume : the faces keep their orientation (float32 coordinates in STL and GLB)
+            assert np.isclose(mesh.volume, volume, rtol=1e-5), out_type
+
+def test_unique_names():
+    verts, faces = marching_cubes(sphere(32)[0], crop=False)
+    with tempfile.TemporaryDirectory() as out_dir:
+        paths = [save_mesh(verts, faces, out_dir, "sphere", "stl") for _ in range(3)]
+        # An existing file is never replaced, and no temporary file is left
+        assert [os.path.basename(mesh_path) for mesh_path in paths] == ["sphere.stl", "sphere_1.stl", "sphere_2.stl"]
+        assert sorted(os.listdir(out_dir)) == ["sphere.stl", "sphere_1.stl", "sphere_2.stl"]
+    assert set(WRITERS) == {"obj", "stl", "ply", "glb"}
+
+if __name__ == "__main__":
+    test_read_back()
+    test_unique_names()
+    print("mesh_writers tests passed")
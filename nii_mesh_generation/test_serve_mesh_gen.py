@@ -0,0 +1,104 @@
+import asyncio
+import tempfile
+
+from serve_mesh_gen import MeshJobQueue, QueueFull, handle_request, safe_name
+
+# ______________________________________________________________________________
+# Tests of the job queue's bookkeeping : the jobs are not meshed (_run is replaced), so no NIFTI file is needed
+
+class HeldQueue(MeshJobQueue):
+    """
+    Job queue whose jobs only finish when "release" is set. "ran" lists the ids of the jobs that were run.
+    """
+
+    async def start(self):
+        self.release = asyncio.Event()
+        self.ran = []
+        await super().start()
+
+    async def _run(self, loop, job):
+        self.ran.append(job.id)
+        job.status = "running"
+        await self.release.wait()
+        self._finish(job, "done", dict(status="ok"))
+
+def test_queue_full_after_cancellations():
+    async def scenario():
+        with tempfile.TemporaryDirectory() as out_dir:
+            queue = HeldQueue(out_dir=out_dir, workers=1, max_queue=2)
+            await queue.start()
+            running = queue.submit({"nii_dir": "a.nii.gz"})
+            # The worker takes the first job : it runs until released
+            await asyncio.sleep(0)
+            first, second = queue.submit({"nii_dir": "b.nii.gz"}), queue.submit({"nii_dir": "c.nii.gz"})
+            try:
+                queue.submit({"nii_dir": "d.nii.gz"})
+                raise AssertionError("The queue accepted a job beyond max_queue")
+            except QueueFull:
+                pass
+
+            # Cancelled waiting jobs free their places at once
+            assert queue.cancel(first) and queue.cancel(second)
+            third, fourth = queue.submit({"nii_dir": "d.nii.gz"}), queue.submit({"nii_dir": "e.nii.gz"})
+            try:
+                queue.submit({"nii_dir": "f.nii.gz"})
+                raise AssertionError("The queue accepted a job beyond max_queue after the cancellations")
+            except QueueFull:
+                pass
+
+            queue.release.set()
+            for job_id in (running, third, fourth):
+                assert (await queue.wait(job_id))["status"] == "done"
+            # The cancelled jobs were skipped, not run
+            assert queue.ran == [running, third, fourth]
+            assert queue.status(first)["status"] == queue.status(second)["status"] == "cancelled"
+            assert queue.summary()["queued"] == 0
+            await queue.stop()
+    asyncio.run(scenario())
+
+def test_server_parameters():
+    async def scenario():
+        with tempfile.TemporaryDirectory() as out_dir:
+            queue = HeldQueue(out_dir=out_dir, workers=1, max_queue=10)
+            await queue.start()
+            for name in ("out_dir", "cache_dir", "visualize", "stages_file"):
+                try:
+                    queue.submit({"nii_dir": "a.nii.gz", name: "/tmp"})
+                    raise AssertionError(f"The queue accepted {name} from a job")
+                except ValueError:
+                    pass
+            # out_name can't leave the output folder
+            job_id = queue.submit({"nii_dir": "a.nii.gz", "out_name": "../../x"})
+            assert queue.jobs[job_id].params["out_name"] == "x"
+            await queue.stop()
+    asyncio.run(scenario())
+    assert safe_name("../../x") == "x"
+    assert safe_name("..\\..\\mesh name") == "mesh_name"
+    assert safe_name("..") == ""
+    assert safe_name("mesh_pymeshlab_smooth=5") == "mesh_pymeshlab_smooth=5"
+
+def test_malformed_requests():
+    async def scenario():
+        with tempfile.TemporaryDirectory() as out_dir:
+            queue = HeldQueue(out_dir=out_dir, workers=1, max_queue=10)
+            await queue.start()
+            server = await asyncio.start_server(lambda reader, writer: handle_request(queue, reader, writer), "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            for request in (b"\r\n\r\n", b"GET\r\n\r\n", b"GET /jobs HTTP/1.1\r\nContent-Length: x\r\n\r\n"):
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(request)
+                await writer.drain()
+                # The server answers 400, then closes the connection
+                answer = await reader.read()
+                assert answer.startswith(b"HTTP/1.1 400 "), answer
+                writer.close()
+            server.close()
+            await server.wait_closed()
+            await queue.stop()
+    asyncio.run(scenario())
+
+if __name__ == "__main__":
+    test_queue_full_after_cancellations()
+    test_server_parameters()
+    test_malformed_requests()
+    print("serve_mesh_gen tests passed")
@@ -0,0 +1,314 @@
+"""
+Authors: Sacha Cruz, Mario Espinoza
+________________________________
+|                              |
+|   NIFTI -> MESH GENERATION   |
+|             ---              |
+|       warm_mesh_gen.py       |
+|______________________________|
+
+Warm worker daemon : a long-lived process that imports the libraries (nibabel, scikit-image, pymeshlab, vtk, vedo)
+once, keeps a pool of worker processes ready, and runs generate_from_nii jobs sent over a local socket.
+The "run" command is a thin client : it only imports the standard library, forwards the parameters of generate_from_nii
+to the daemon and prints its answer. For small label-maps, a run then costs the meshing time, not the imports.
+
+Usage (CLI):
+    python warm_mesh_gen.py serve --workers 2 &                                       # once
+    python warm_mesh_gen.py run input_files/sartorius.nii.gz -o output_files --smoothing lap --smooth-val 5
+    python warm_mesh_gen.py stop
+
+Usage (Python):
+    from warm_mesh_gen import run_job
+    row = run_job({"nii_dir": "input_files/sartorius.nii.gz", "out_dir": "output_files", "smoothing": "lap", "smooth_val": 5})
+
+The daemon listens on a Unix socket (Linux / Mac OS, only reachable by the user) or on a localhost TCP port (Windows).
+Its meshes are never visualized (visualize is always False) : open them afterwards with the tools of "additional_mesh_utils".
+"""
+
+from os import path, getcwd
+import argparse
+import json
+import socket
+import sys
+import tempfile
+
+# Libraries imported by the daemon and by each of its workers before the first job (the missing ones are skipped)
+PRELOAD = ("numpy", "nibabel", "skimage.measure", "pymeshlab", "vtk", "vedo", "nii_mesh_gen")
+DEFAULT_PORT = 8766
+
+def default_address():
+    """
+    Address of the daemon : a Unix socket in the temporary folder (one per user), or a localhost TCP port on Windows.
+    """
+    if sys.platform == "win32":
+        return ("127.0.0.1", DEFAULT_PORT)
+    from os import getuid
+    return path.join(tempfile.gettempdir(), f"nii_mesh_gen_{getuid()}.sock")
+
+def parse_address(address):
+    # "host:port" --> TCP, anything else --> Unix socket
+    if isinstance(address, str) and ":" in address and not address.startswith("/"):
+        host, port = address.rsplit(":", 1)
+        return (host, int(port))
+    return address
+
+# ------------------------------
+# CLIENT
+# ------------------------------
+
+def request(message, address=None, timeout=None):
+    """
+    Sends one message (a JSON object) to the daemon and returns its answer.
+    Raises ConnectionError if no daemon listens on the address.
+    """
+    address = default_address() if address is None else parse_address(address)
+    family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+    try:
+        with socket.socket(family, socket.SOCK_STREAM) as connection:
+            connection.settimeout(timeout)
+            connection.connect(address)
+            connection.sendall(json.dumps(message).encode() + b"\n")
+            with connection.makefile("rb") as answer:
+                line = answer.readline()
+    except (FileNotFoundError, ConnectionRefusedError):
+        raise ConnectionError(f"No mesh generation daemon on {address} : start it with 'python warm_mesh_gen.py serve'") from None
+    if not line:
+        raise ConnectionError("The daemon closed the connection without answering")
+    return json.loads(line)
+
+def run_job(params, address=None, timeout=None):
+    """
+    Runs generate_from_nii on the daemon. "params" are its parameters (nii_dir required, visualize is ignored).
+    Relative paths are resolved from the current folder. Returns the row of the job (mesh path and metrics, or error)
+    and its printed output ("log").
+    """
+    params = dict(params)
+    params.pop("visualize", None)
+    # The daemon has its own current folder
+    for name in ("nii_dir", "out_dir", "cache_dir", "stages_file"):
+        if isinstance(params.get(name), str):
+            params[name] = path.abspath(params[name])
+    params.setdefault("out_dir", getcwd())
+    return request(dict(op="run", params=params), address, timeout)
+
+# ------------------------------
+# DAEMON
+# ------------------------------
+
+def preload():
+    """
+    Imports the libraries of PRELOAD (and warms up the lazily loaded parts). Returns the names of the imported ones.
+    """
+    import importlib
+    loaded = []
+    for name in PRELOAD:
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            continue
+        if name == "skimage.measure":
+            # scikit-image loads its submodules on first access
+            module.marching_cubes
+        loaded.append(name)
+    try:
+        from source.nii2mesh_lib import library_available
+        if library_available(build=False):
+            loaded.append("libnii2mesh")
+    except ImportError:
+        pass
+    return loaded
+
+def warm_up():
+    """
+    Meshes a small ball once : the parts of the libraries that are only loaded on first use (metrics, writers, ...) are loaded too.
+    """
+    from contextlib import redirect_stdout
+    import io
+    import numpy as np
+    from nii_mesh_gen import generate_from_nii
+    grid = np.indices((12, 12, 12)) - 5.5
+    ball = ((grid ** 2).sum(axis=0) < 16).astype(np.uint8)
+    with tempfile.TemporaryDirectory() as tmp_dir, redirect_stdout(io.StringIO()):
+        generate_from_nii(ball, visualize=False, info_doc=False, out_dir=tmp_dir)
+
+def _init_daemon_worker():
+    from batch_mesh_gen import _init_worker
+    _init_worker()
+    preload()
+    warm_up()
+
+def _run_params(params):
+    # Runs in a worker of the daemon : the printed output is sent back with the row
+    from contextlib import redirect_stdout
+    import io
+    import time
+    from nii_mesh_gen import generate_from_nii
+    initial_time = time.time()
+    params = dict(params)
+    nii_dir = params.pop("nii_dir")
+    # One process per core : the distance queries stay on one thread
+    params["distance_workers"] = 1
+    if params.get("grid_scale") is not None:
+        # JSON only has lists
+        params["grid_scale"] = tuple(params["grid_scale"])
+    log = io.StringIO()
+    row = dict(input=nii_dir, status="ok")
+    try:
+        with redirect_stdout(log):
+            mesh = generate_from_nii(nii_dir, visualize=False, **params)
+        row.update(mesh.as_dict(), stages=mesh.stages)
+    except Exception as e:
+        row.update(status="error", error=f"{type(e).__name__}: {e}")
+    row.update(wall_time=time.time() - initial_time, log=log.getvalue())
+    return row
+
+def _claim_socket(address):
+    """
+    Removes a stale Unix socket (left by a daemon that was killed). Raises RuntimeError if a daemon still listens on it.
+    """
+    from os import remove
+    if not path.exists(address):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(address)
+        except ConnectionRefusedError:
+            # Nobody listens : the socket file is left over
+            remove(address)
+            return
+    raise RuntimeError(f"A mesh generation daemon already listens on {address} : stop it with 'python warm_mesh_gen.py stop'")
+
+def serve_daemon(address=None, workers=1):
+    """
+    Runs the daemon until it receives a "stop" message.
+    Args:
+        address (str / tuple, optional): Unix socket path, or (host, port). Defaults to default_address().
+        workers (int, optional): Number of warm worker processes (jobs run at the same time).
+    Raises RuntimeError if another daemon already listens on the Unix socket.
+    """
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+    from os import remove
+    from source.worker_threads import single_threaded
+
+    address = default_address() if address is None else parse_address(address)
+    unix_socket = not isinstance(address, tuple)
+    if unix_socket:
+        _claim_socket(address)
+    # The libraries are loaded (here and in the workers) with the thread variables set (see source/worker_threads.py)
+    with single_threaded():
+        print(f"Preloaded : {', '.join(preload())}")
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_daemon_worker)
+        # The workers start (and import the libraries) now, not on the first job
+        for job in [pool.submit(len, "") for _ in range(workers)]:
+            job.result()
+
+    async def handle(reader, writer):
+        try:
+            message = json.loads(await reader.readline())
+            op = message.get("op")
+            if op == "run":
+                answer = await asyncio.get_running_loop().run_in_executor(pool, _run_params, message["params"])
+            elif op == "ping":
+                answer = dict(status="ok", workers=workers)
+            elif op == "stop":
+                answer = dict(status="ok")
+                stopped.set()
+            else:
+                answer = dict(status="error", error=f"Unknown operation : {op}")
+        except (ValueError, KeyError, AttributeError) as e:
+            answer = dict(status="error", error=f"Malformed message : {e}")
+        except Exception as e:
+            # The client always gets an answer (a broken worker pool, for example)
+            answer = dict(status="error", error=f"{type(e).__name__}: {e}")
+        writer.write(json.dumps(answer, default=str).encode() + b"\n")
+        await writer.drain()
+        writer.close()
+
+    async def main():
+        nonlocal stopped, bound
+        stopped = asyncio.Event()
+        if unix_socket:
+            server = await asyncio.start_unix_server(handle, path=address)
+            bound = True
+        else:
+            server = await asyncio.start_server(handle, *address)
+        print(f"Mesh generation daemon ready on {address} ({workers} workers)")
+        async with server:
+            await stopped.wait()
+
+    stopped = None
+    bound = False
+    try:
+        asyncio.run(main())
+    finally:
+        pool.shutdown()
+        # Only the socket of this daemon is removed
+        if bound and path.exists(address):
+            remove(address)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Warm mesh generation daemon and its thin client.")
+    parser.add_argument("--address", default=None, help="Unix socket path or host:port of the daemon (default: one socket per user)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="start the daemon")
+    serve.add_argument("-w", "--workers", type=int, default=1, help="number of warm worker processes")
+
+    commands.add_parser("stop", help="stop the daemon")
+    commands.add_parser("ping", help="check that the daemon is running")
+
+    run = commands.add_parser("run", help="mesh a NIFTI file on the daemon (parameters of generate_from_nii)")
+    run.add_argument("input", help="NIFTI file")
+    run.add_argument("-o", "--out-dir", default=".", help="output folder")
+    run.add_argument("-n", "--out-name", default="", help="name of the mesh file (default name from the parameters)")
+    run.add_argument("--library", default="pymeshlab", choices=["pymeshlab", "nii2mesh", "vtk"])
+    run.add_argument("--simplify", default="")
+    run.add_argument("--simply-val", type=int, default=100)
+    run.add_argument("--smoothing", default="")
+    run.add_argument("--smooth-val", type=int, default=0)
+    run.add_argument("--grid-scale", type=float, nargs=3, default=None,
+                     help="voxel spacing forced instead of the header's (default: spacing and affine of the file)")
+    run.add_argument("--out-type", default="obj")
+    run.add_argument("--no-doc", action="store_true", help="do not save the TXT document")
+    run.add_argument("--no-crop", action="store_true", help="run the marching cubes on the full grid")
+    run.add_argument("--distances", action="store_true", help="also measure the surface distances to the label-map")
+    run.add_argument("-q", "--quiet", action="store_true", help="do not print the output of the run")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        try:
+            serve_daemon(args.address, args.workers)
+        except RuntimeError as e:
+            print(e, file=sys.stderr)
+            return 2
+        return 0
+    try:
+        if args.command in ("stop", "ping"):
+            print(request(dict(op=args.command), args.address))
+            return 0
+        row = run_job(dict(
+            nii_dir     = args.input,
+            out_dir     = args.out_dir,
+            out_name    = args.out_name,
+            library     = args.library,
+            simplify    = args.simplify,
+            simply_val  = args.simply_val,
+            smoothing   = args.smoothing,
+            smooth_val  = args.smooth_val,
+            grid_scale  = args.grid_scale,
+            out_type    = args.out_type,
+            info_doc    = not args.no_doc,
+            crop        = not args.no_crop,
+            distances   = args.distances), args.address)
+    except ConnectionError as e:
+        print(e, file=sys.stderr)
+        return 2
+    log = row.pop("log", "")
+    if not args.quiet:
+        print(log, end="")
+    print(json.dumps(row, indent=2, default=str))
+    return 0 if row["status"] == "ok" else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())